@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# bcd.py
+#
+# Packed BCD codec for CAT frequency frames
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+
+Both rigs carry frequency as packed BCD, two decimal digits per byte with
+the more significant digit in the high nibble.
+
+	Yaesu	-	MSB first, 01 42 34 56 = 14.23456 MHz (in 10 Hz units)
+	Icom	-	LSB first, 00 60 34 14 00 = 14.346000 MHz (in Hz)
+
+Each byte is converted with a table lookup so a frame costs one divmod
+and one index per byte, no strings and no per-nibble arithmetic. The two
+frame layouts used on the tuning path (4 bytes MSB first, 5 bytes LSB
+first) also have unrolled versions.
+
+The encoders write into prebuilt frames, so a value out of range raises
+ValueError before any byte is touched.
+
+"""
+
+# Binary 0-99 to a packed BCD byte
+BIN_TO_BCD = bytes(((n // 10) << 4) | (n % 10) for n in range(100))
+# Packed BCD byte to binary 0-99
+# Nibbles above 9 are not valid BCD, they decode to their face value
+BCD_TO_BIN = tuple(((b >> 4) * 10) + (b & 0x0F) for b in range(256))
+# Exclusive upper limits of the fixed width frames
+MAX_MSB4 = 100 ** 4
+MAX_LSB5 = 100 ** 5
+
+#==============================================================================================
+# PUBLIC
+#==============================================================================================
+
+#-------------------------------------------------
+# Encode MSB first into an existing buffer
+def encode_msb_into(buf, offset, value, nbytes):
+	"""
+	Write value as nbytes of packed BCD, most significant byte first
+
+	Arguments:
+		buf	--	bytearray or writable memoryview
+		offset	--	index of the first byte to write
+		value	--	non-negative integer
+		nbytes	--	number of bytes to write
+
+	"""
+
+	if not 0 <= value < 100 ** nbytes:
+		raise ValueError('Value %d out of range for %d BCD bytes' % (value, nbytes))
+	i = offset + nbytes - 1
+	while i >= offset:
+		value, n = divmod(value, 100)
+		buf[i] = BIN_TO_BCD[n]
+		i -= 1
+
+#-------------------------------------------------
+# Encode LSB first into an existing buffer
+def encode_lsb_into(buf, offset, value, nbytes):
+	"""
+	Write value as nbytes of packed BCD, least significant byte first
+
+	Arguments:
+		buf	--	bytearray or writable memoryview
+		offset	--	index of the first byte to write
+		value	--	non-negative integer
+		nbytes	--	number of bytes to write
+
+	"""
+
+	if not 0 <= value < 100 ** nbytes:
+		raise ValueError('Value %d out of range for %d BCD bytes' % (value, nbytes))
+	end = offset + nbytes
+	i = offset
+	while i < end:
+		value, n = divmod(value, 100)
+		buf[i] = BIN_TO_BCD[n]
+		i += 1
+
+#-------------------------------------------------
+# Encode MSB first
+def encode_msb(value, nbytes):
+	buf = bytearray(nbytes)
+	encode_msb_into(buf, 0, value, nbytes)
+	return buf
+
+#-------------------------------------------------
+# Encode LSB first
+def encode_lsb(value, nbytes):
+	buf = bytearray(nbytes)
+	encode_lsb_into(buf, 0, value, nbytes)
+	return buf
+
+#-------------------------------------------------
+# Decode MSB first
+def decode_msb(data, offset, nbytes):
+	"""
+	Return the integer held in nbytes of packed BCD, most significant byte first
+
+	Arguments:
+		data	--	bytes, bytearray or memoryview
+		offset	--	index of the first byte
+		nbytes	--	number of bytes
+
+	"""
+
+	value = 0
+	for i in range(offset, offset + nbytes):
+		value = value * 100 + BCD_TO_BIN[data[i]]
+	return value
+
+#-------------------------------------------------
+# Decode LSB first
+def decode_lsb(data, offset, nbytes):
+	"""
+	Return the integer held in nbytes of packed BCD, least significant byte first
+
+	Arguments:
+		data	--	bytes, bytearray or memoryview
+		offset	--	index of the first byte
+		nbytes	--	number of bytes
+
+	"""
+
+	value = 0
+	for i in range(offset + nbytes - 1, offset - 1, -1):
+		value = value * 100 + BCD_TO_BIN[data[i]]
+	return value
+
+#==============================================================================================
+# Unrolled fixed width versions for the frequency frames
+#==============================================================================================
+
+#-------------------------------------------------
+# Yaesu frequency, 4 bytes MSB first
+def encode_msb4_into(buf, offset, value):
+	if not 0 <= value < MAX_MSB4:
+		raise ValueError('Value %d out of range for 4 BCD bytes' % value)
+	T = BIN_TO_BCD
+	value, n = divmod(value, 100)
+	buf[offset + 3] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset + 2] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset + 1] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset] = T[n]
+
+def decode_msb4(data, offset):
+	T = BCD_TO_BIN
+	return ((T[data[offset]] * 100 + T[data[offset + 1]]) * 100 + T[data[offset + 2]]) * 100 + T[data[offset + 3]]
+
+#-------------------------------------------------
+# Icom frequency, 5 bytes LSB first
+def encode_lsb5_into(buf, offset, value):
+	if not 0 <= value < MAX_LSB5:
+		raise ValueError('Value %d out of range for 5 BCD bytes' % value)
+	T = BIN_TO_BCD
+	value, n = divmod(value, 100)
+	buf[offset] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset + 1] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset + 2] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset + 3] = T[n]
+	value, n = divmod(value, 100)
+	buf[offset + 4] = T[n]
+
+def decode_lsb5(data, offset):
+	T = BCD_TO_BIN
+	return (((T[data[offset + 4]] * 100 + T[data[offset + 3]]) * 100 + T[data[offset + 2]]) * 100 + T[data[offset + 1]]) * 100 + T[data[offset]]
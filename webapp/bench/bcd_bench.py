@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# bcd_bench.py
+#
+# Micro-benchmark of the BCD codec against the code it replaced
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import timeit
+
+# Application imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bcd
+
+"""
+
+Run from the webapp directory:
+	python bench/bcd_bench.py [iterations]
+
+Each case is checked for agreement with the legacy code before it is timed.
+The legacy Icom decode had broken 1Hz/10Hz nibbles so it is checked on a
+frequency with zero in those digits.
+
+"""
+
+FREQ = 14234560
+
+#==============================================================================================
+# Legacy implementations, as they were in cat.py
+#==============================================================================================
+
+def legacy_yaesu_encode(freq):
+	fs = str(int(int(freq)/10))
+	fs = fs.zfill(8)
+	b=bytearray.fromhex(fs)
+	return bytearray([b[0], b[1], b[2], b[3]])
+
+def legacy_yaesu_decode(data):
+	MHz_100 = ((data[0] & 0xF0) >> 4) * 100000000
+	MHz_10 = (data[0] & 0x0F) * 10000000
+	MHz_1 = ((data[1] & 0xF0) >> 4) * 1000000
+	KHz_100 = (data[1] & 0x0F) * 100000
+	KHz_10 = ((data[2] & 0xF0) >> 4) * 10000
+	KHz_1 = (data[2] & 0x0F) * 1000
+	Hz_100 = ((data[3] & 0xF0) >> 4) * 100
+	Hz_10 = (data[3] & 0x0F) * 10
+	return MHz_100 + MHz_10 + MHz_1 + KHz_100 + KHz_10 + KHz_1 + Hz_100 + Hz_10
+
+def legacy_icom_encode(freq):
+	fs = str(int(freq))
+	fs = fs.zfill(10)
+	data = bytearray(5)
+	byte = 4
+	nibble = 0
+	for c in fs:
+		if nibble == 0:
+			data[byte] = ((data[byte] | int(c)) << 4) & 0xF0
+			nibble = 1
+		else:
+			data[byte] = data[byte] | (int(c) & 0x0F)
+			nibble = 0
+			byte -= 1
+	return data
+
+def legacy_icom_decode(data):
+	MHz_1000 = ((data[4] & 0xF0) >> 4) * 1000000000
+	MHz_100 = (data[4] & 0x0F) * 100000000
+	MHz_10 = ((data[3] & 0xF0) >> 4) * 10000000
+	MHz_1 = (data[3] & 0x0F) * 1000000
+	KHz_100 = ((data[2] & 0xF0) >> 4) * 100000
+	KHz_10 = (data[2] & 0x0F) * 10000
+	KHz_1 = ((data[1] & 0xF0) >> 4) * 1000
+	Hz_100 = (data[1] & 0x0F) * 100
+	Hz_10 = ((data[0] & 0x0F) >> 4) * 10
+	Hz_1 = data[0] & 0xF0
+	return MHz_1000 + MHz_100 + MHz_10 + MHz_1 + KHz_100 + KHz_10 + KHz_1 + Hz_100 + Hz_10 + Hz_1
+
+#==============================================================================================
+# Benchmark
+#==============================================================================================
+
+#-------------------------------------------------
+# Time one statement, return ns/op
+def ns_per_op(stmt, number):
+	t = min(timeit.repeat(stmt, globals=globals(), number=number, repeat=5))
+	return t * 1e9 / number
+
+#-------------------------------------------------
+# The new code as cat.py calls it
+def yaesu_encode(freq):
+	b = bytearray(5)
+	bcd.encode_msb4_into(b, 0, freq // 10)
+	return b
+
+def icom_encode(freq):
+	b = bytearray(5)
+	bcd.encode_lsb5_into(b, 0, freq)
+	return b
+
+#-------------------------------------------------
+# Run all cases
+def main():
+	number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+	global yaesu_frame, icom_frame
+	yaesu_frame = bcd.encode_msb(FREQ // 10, 4)
+	icom_frame = bcd.encode_lsb(FREQ, 5)
+	# Agreement with the legacy code and between the generic and unrolled versions
+	assert yaesu_frame == legacy_yaesu_encode(FREQ) == yaesu_encode(FREQ)[:4]
+	assert bcd.decode_msb4(yaesu_frame, 0) * 10 == legacy_yaesu_decode(yaesu_frame)
+	assert bcd.decode_msb(yaesu_frame, 0, 4) == bcd.decode_msb4(yaesu_frame, 0)
+	assert icom_frame == legacy_icom_encode(FREQ) == icom_encode(FREQ)
+	assert bcd.decode_lsb5(icom_frame, 0) == bcd.decode_lsb(icom_frame, 0, 5) == FREQ
+	assert legacy_icom_decode(bcd.encode_lsb(14234500, 5)) == bcd.decode_lsb5(bcd.encode_lsb(14234500, 5), 0)
+
+	cases = (
+		('yaesu encode', 'legacy_yaesu_encode(FREQ)', 'yaesu_encode(FREQ)'),
+		('yaesu decode', 'legacy_yaesu_decode(yaesu_frame)', 'bcd.decode_msb4(yaesu_frame, 0) * 10'),
+		('icom encode', 'legacy_icom_encode(FREQ)', 'icom_encode(FREQ)'),
+		('icom decode', 'legacy_icom_decode(icom_frame)', 'bcd.decode_lsb5(icom_frame, 0)'),
+	)
+	print('%-14s %12s %12s %8s' % ('case', 'legacy ns', 'bcd ns', 'speedup'))
+	for name, legacy, new in cases:
+		t_legacy = ns_per_op(legacy, number)
+		t_new = ns_per_op(new, number)
+		print('%-14s %12.0f %12.0f %7.2fx' % (name, t_legacy, t_new, t_legacy / t_new))
+
+if __name__ == '__main__':
+	main()
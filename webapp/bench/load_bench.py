@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# load_bench.py
+#
+# End-to-end load benchmark of the web tuning services against a simulated rig
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import argparse
+import http.client
+import json
+import random
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+# Library imports
+import cherrypy
+
+# Application imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from defs import *
+import console
+import console_model
+import rigsim
+
+"""
+
+Run from the webapp directory:
+	python bench/load_bench.py [options]
+
+The Console app is started in process on localhost with cherrypy.conf,
+its CAT engine opens a simulated rig (rigsim.py). Each simulated browser
+holds a keep-alive connection and sends a weighted mix of dial, scroll,
+slider, band and mode PUTs with a think time between them, as a tablet
+console does when the dial is spun.
+
+Reported:
+	requests/s and p50/p95/p99/max latency, overall and per service
+	serial frames the rig actually received
+	commands coalesced in the CAT queue and sets suppressed by the state cache
+	commands the rig dropped (with --guard)
+
+Results go to --out as JSON so runs can be compared, with the
+configuration they were made with.
+
+"""
+
+# Service, parameter and relative weight
+MIX = (
+	('dial_service', 'rotation', 60),
+	('scroll_service', 'scroll', 20),
+	('slider_service', 'slider', 15),
+	('band_service', 'band', 3),
+	('mode_service', 'mode', 2),
+)
+# Id of the simulated rig in the console
+RIG_ID = 'sim'
+BANDS = ('160m', '80m', '40m', '20m', '15m', '10m', '2m', '70cm')
+MODES = ('LSB', 'USB', 'AM', 'FM')
+
+#==============================================================================================
+# Simulated browser
+#==============================================================================================
+
+class Browser(threading.Thread):
+
+	def __init__(self, port, until, think, seed):
+		"""
+		Constructor
+
+		Arguments
+			port	--	web server port on localhost
+			until	--	monotonic time to stop
+			think	--	seconds between requests
+			seed	--	random seed, runs are repeatable
+		"""
+
+		super(Browser, self).__init__()
+		self.daemon = True
+		self.__port = port
+		self.__until = until
+		self.__think = think
+		self.__random = random.Random(seed)
+		self.__rotation = 0
+		self.__slider = 50
+		self.latencies = {service: [] for service, param, weight in MIX}
+		self.errors = 0
+
+	def run(self):
+		conn = http.client.HTTPConnection('127.0.0.1', self.__port, timeout=10)
+		services = [service for service, param, weight in MIX]
+		weights = [weight for service, param, weight in MIX]
+		while time.monotonic() < self.__until:
+			service = self.__random.choices(services, weights)[0]
+			body = urlencode(self.__params(service))
+			t = time.perf_counter()
+			try:
+				conn.request('PUT', '/' + service, body, {
+					'Content-Type': 'application/x-www-form-urlencoded',
+					'Accept': 'text/plain'})
+				resp = conn.getresponse()
+				resp.read()
+				ok = resp.status == 200
+			except (OSError, http.client.HTTPException):
+				ok = False
+				conn.close()
+				conn = http.client.HTTPConnection('127.0.0.1', self.__port, timeout=10)
+			if ok:
+				self.latencies[service].append(time.perf_counter() - t)
+			else:
+				self.errors += 1
+			if self.__think > 0:
+				time.sleep(self.__think)
+		conn.close()
+
+	def __params(self, service):
+		""" Request parameters as the page would send them """
+
+		if service == 'dial_service':
+			# Mostly one way, as an operator tunes across the band
+			self.__rotation += 1 if self.__random.random() < 0.8 else -1
+			return {'rotation': self.__rotation}
+		if service == 'scroll_service':
+			return {'scroll': self.__random.choice((-100, 100))}
+		if service == 'slider_service':
+			self.__slider = max(0, min(100, self.__slider + self.__random.randint(-5, 5)))
+			return {'slider': self.__slider}
+		if service == 'band_service':
+			return {'band': self.__random.choice(BANDS)}
+		return {'mode': self.__random.choice(MODES)}
+
+#==============================================================================================
+# Benchmark
+#==============================================================================================
+
+#-------------------------------------------------
+# Nearest rank percentiles of a list of seconds, in ms
+def summarise(samples):
+	if len(samples) == 0:
+		return {'count': 0}
+	s = sorted(samples)
+	def pct(p):
+		return round(s[min(len(s) - 1, int(p / 100.0 * len(s)))] * 1000.0, 3)
+	return {
+		'count': len(s),
+		'p50_ms': pct(50),
+		'p95_ms': pct(95),
+		'p99_ms': pct(99),
+		'max_ms': round(s[-1] * 1000.0, 3),
+	}
+
+#-------------------------------------------------
+# A free port on localhost
+def free_port():
+	s = socket.socket()
+	s.bind(('127.0.0.1', 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+#-------------------------------------------------
+# Wait until the rig has seen everything the CAT queue will send
+def wait_idle(sim, settle = 0.5, limit = 10.0):
+	last = sim.stats()['frames_in']
+	deadline = time.monotonic() + limit
+	while time.monotonic() < deadline:
+		time.sleep(settle)
+		now = sim.stats()['frames_in']
+		if now == last:
+			return
+		last = now
+
+#-------------------------------------------------
+# Run one load test, return the results dict
+def run(args):
+	sim = rigsim.SIMULATORS[args.rig](latency = args.latency / 1000.0, baud = args.baud, guard = args.guard / 1000.0)
+	sim.start()
+
+	# Start the console on localhost
+	port = free_port()
+	cherrypy_conf = os.path.join(os.path.dirname(console.__file__), 'cherrypy.conf')
+	cherrypy.config.update(cherrypy_conf)
+	cherrypy.config.update({
+		'server.socket_host': '127.0.0.1',
+		'server.socket_port': port,
+		'server.thread_pool': args.threads,
+		'log.screen': False,
+	})
+	# The model is saved as it would be, but not over the real one
+	model_dir = tempfile.TemporaryDirectory()
+	model = console_model.ConsoleModel(os.path.join(model_dir.name, console_model.MODEL_PATH))
+	webapp = console.create_app('Load Bench', model, ((RIG_ID, args.rig, sim.port, args.baud), ))
+	cherrypy.tree.mount(webapp, '', config=cherrypy_conf)
+	cherrypy.engine.start()
+	cherrypy.engine.wait(cherrypy.engine.states.STARTED)
+	try:
+		# Browsers
+		start = time.monotonic()
+		until = start + args.duration
+		browsers = [Browser(port, until, args.think / 1000.0, args.seed + n) for n in range(args.browsers)]
+		for b in browsers:
+			b.start()
+		for b in browsers:
+			b.join()
+		elapsed = time.monotonic() - start
+		wait_idle(sim)
+	finally:
+		cherrypy.engine.exit()
+		cat = console.g_rigs.get(RIG_ID).cat
+		console.g_rigs.terminate()
+		model.save_model()
+		model_dir.cleanup()
+		sim.terminate()
+
+	# Collate
+	per_service = {}
+	every = []
+	for service, param, weight in MIX:
+		samples = []
+		for b in browsers:
+			samples.extend(b.latencies[service])
+		per_service[service] = summarise(samples)
+		every.extend(samples)
+	errors = sum(b.errors for b in browsers)
+	sim_stats = sim.stats()
+	return {
+		'config': {
+			'rig': args.rig,
+			'browsers': args.browsers,
+			'duration_s': args.duration,
+			'think_ms': args.think,
+			'thread_pool': args.threads,
+			'latency_ms': args.latency,
+			'baud': args.baud,
+			'guard_ms': args.guard,
+			'seed': args.seed,
+		},
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'requests': len(every),
+		'errors': errors,
+		'requests_per_s': round(len(every) / elapsed, 1),
+		'latency': summarise(every),
+		'services': per_service,
+		'serial': {
+			'frames_written': sim_stats['frames_in'],
+			'bytes_written': sim_stats['bytes_in'],
+			'frames_read': sim_stats['frames_out'],
+			'coalesced': cat.coalesced(),
+			'suppressed': cat.get_state().suppressed(),
+			'dropped_by_rig': sim_stats['dropped'],
+		},
+	}
+
+#-------------------------------------------------
+# Print the headline numbers
+def report(results):
+	print('%d requests, %d errors, %.1f requests/s' % (results['requests'], results['errors'], results['requests_per_s']))
+	print('%-16s %8s %10s %10s %10s %10s' % ('service', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+	rows = list(results['services'].items()) + [('all', results['latency'])]
+	for name, s in rows:
+		if s['count'] > 0:
+			print('%-16s %8d %10.2f %10.2f %10.2f %10.2f' % (name, s['count'], s['p50_ms'], s['p95_ms'], s['p99_ms'], s['max_ms']))
+	serial = results['serial']
+	print('serial frames written %d, coalesced %d, suppressed %d, dropped by rig %d' % (
+		serial['frames_written'], serial['coalesced'], serial['suppressed'], serial['dropped_by_rig']))
+
+#-------------------------------------------------
+# Entry point
+def main():
+	parser = argparse.ArgumentParser(description='Load test the web tuning services')
+	parser.add_argument('--rig', default=FT817ND, choices=sorted(rigsim.SIMULATORS))
+	parser.add_argument('--browsers', type=int, default=10, help='simulated browsers')
+	parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+	parser.add_argument('--think', type=float, default=20.0, help='ms between requests per browser')
+	parser.add_argument('--threads', type=int, default=20, help='server.thread_pool')
+	parser.add_argument('--latency', type=float, default=5.0, help='rig response latency ms')
+	parser.add_argument('--baud', type=int, default=BAUD)
+	parser.add_argument('--guard', type=float, default=0.0, help='rig busy time after a command ms')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--out', default='load_bench.json', help='JSON results file')
+	args = parser.parse_args()
+
+	results = run(args)
+	report(results)
+	with open(args.out, 'w') as f:
+		json.dump(results, f, indent=2)
+	print('Results written to %s' % args.out)
+
+if __name__ == '__main__':
+	main()
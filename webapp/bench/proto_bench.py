@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# proto_bench.py
+#
+# Micro-benchmark of the CAT protocol formatters and decoders
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import argparse
+import json
+import timeit
+import tracemalloc
+
+# Application imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from defs import *
+import cat
+
+"""
+
+Run from the webapp directory:
+	python bench/proto_bench.py				compare with the baseline
+	python bench/proto_bench.py --save		store a new baseline
+
+Every command each rig class supports is formatted, and every response
+it expects is decoded, with the parameters and frames the rig really
+uses. For each case we report
+
+	ns/op		best of REPEAT rounds, every case is timed once a round
+	blocks/op	memory blocks still allocated per op when every result
+				is kept, i.e. what the call creates for its caller
+
+A reference call of the same shape (a method call that indexes a tuple
+and returns a tuple) is timed in the same rounds and the comparison is
+on time relative to it, so a machine that is uniformly slower on this
+run does not count as a regression. Regenerate the baseline with --save
+when the Python version changes. Blocks/op do not depend on the machine.
+
+The run exits non-zero when any case is slower than baseline by more
+than the tolerance or allocates more blocks than the baseline.
+
+"""
+
+# Name of the reference case
+REFERENCE = 'reference'
+# Timing rounds, the best time of each case is kept
+REPEAT = 7
+# Allowed noise in blocks/op
+BLOCKS_SLACK = 0.1
+# More than CPython keeps on a tuple free list
+FREELIST_DRAIN = 4000
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'proto_baseline.json')
+
+# Parameters for each command
+PARAMS = {
+	CAT_LOCK: True,
+	CAT_PTT: True,
+	CAT_PTT_SET: True,
+	CAT_PTT_GET: None,
+	CAT_FREQ_SET: 14234560,
+	CAT_MODE_SET: MODE_USB,
+	CAT_FREQ_GET: None,
+	CAT_MODE_GET: None,
+}
+
+# Responses as the rig sends them
+# The Icom engine decodes memoryview frames from the CI-V framer
+RESPONSES = {
+	FT817ND: {
+		CAT_FREQ_GET: bytes.fromhex('0142345601'),
+		CAT_MODE_GET: bytes.fromhex('0142345601'),
+		CAT_PTT_GET: bytes.fromhex('80'),
+	},
+	IC7100: {
+		CAT_FREQ_GET: memoryview(bytes.fromhex('fefee088036045231400fd')),
+		CAT_MODE_GET: memoryview(bytes.fromhex('fefee088040101fd')),
+	},
+}
+
+#==============================================================================================
+# Measurement
+#==============================================================================================
+
+#-------------------------------------------------
+# Blocks left allocated per call of fn() when its results are kept
+def blocks_per_op(fn, number = 1000):
+	keep = [None] * number
+	fn()
+	tracemalloc.start()
+	try:
+		# Empty the small tuple free lists so every tuple made is seen
+		drain = [(i,) for i in range(FREELIST_DRAIN)] + [(i, i) for i in range(FREELIST_DRAIN)] + [(i, i, i) for i in range(FREELIST_DRAIN)]
+		before = tracemalloc.take_snapshot()
+		for i in range(number):
+			keep[i] = fn()
+		after = tracemalloc.take_snapshot()
+	finally:
+		tracemalloc.stop()
+	stats = after.compare_to(before, 'lineno')
+	# Only count what this benchmark did not make itself
+	blocks = sum(s.count_diff for s in stats if s.count_diff > 0 and s.traceback[0].filename != __file__)
+	return round(blocks / number, 2)
+
+#-------------------------------------------------
+# The reference case
+class Reference:
+	def __init__(self):
+		self.__table = (None, (1, True), None)
+	def call(self, index, param):
+		return True, self.__table[index]
+
+#-------------------------------------------------
+# Every case as (name, callable)
+def cases():
+	result = []
+	for rig, command_set in sorted(cat.COMPILED_COMMAND_SETS.items()):
+		inst = command_set.rig_class(command_set)
+		cls = command_set.rig_class.__name__
+		for cat_cmd in sorted(CAT_OPCODES, key=CAT_OPCODES.get):
+			param = PARAMS[cat_cmd]
+			r, frame = inst.format_cat_cmd(cat_cmd, param)
+			if not r:
+				# Not supported by this rig
+				continue
+			result.append(('%s.format_cat_cmd %s' % (cls, cat_cmd), lambda inst=inst, c=cat_cmd, p=param: inst.format_cat_cmd(c, p)))
+			if inst.is_response(cat_cmd):
+				data = RESPONSES[rig][cat_cmd]
+				ok, c, value = inst.decode_cat_resp(cat_cmd, data)
+				if not ok:
+					raise ValueError('Sample response for %s %s does not decode' % (rig, cat_cmd))
+				result.append(('%s.decode_cat_resp %s' % (cls, cat_cmd), lambda inst=inst, c=cat_cmd, d=data: inst.decode_cat_resp(c, d)))
+	return result
+
+#-------------------------------------------------
+# Measure everything
+def measure(number):
+	ref = Reference()
+	all_cases = [(REFERENCE, lambda: ref.call(1, None))] + cases()
+	# Time every case once per round so drift in machine speed hits all alike
+	best = {name: None for name, fn in all_cases}
+	for i in range(REPEAT):
+		for name, fn in all_cases:
+			t = timeit.timeit(fn, number=number)
+			if best[name] == None or t < best[name]:
+				best[name] = t
+	reference = best.pop(REFERENCE)
+	results = {}
+	for name, fn in all_cases[1:]:
+		results[name] = {
+			'ns': round(best[name] * 1e9 / number, 1),
+			'relative': round(best[name] / reference, 3),
+			'blocks': blocks_per_op(fn),
+		}
+	return {'python': sys.version.split()[0], 'reference_ns': round(reference * 1e9 / number, 1), 'cases': results}
+
+#-------------------------------------------------
+# Return a list of regressions against the baseline
+def compare(current, baseline, tolerance):
+	regressions = []
+	for name, now in current['cases'].items():
+		base = baseline['cases'].get(name)
+		if base == None:
+			continue
+		if now['relative'] > base['relative'] * (1.0 + tolerance):
+			regressions.append('%s: %.1f ns/op, %.2f x reference, baseline %.2f x reference' % (
+				name, now['ns'], now['relative'], base['relative']))
+		if now['blocks'] > base['blocks'] + BLOCKS_SLACK:
+			regressions.append('%s: %.2f blocks/op, baseline %.2f' % (name, now['blocks'], base['blocks']))
+	return regressions
+
+#==============================================================================================
+# Entry point
+#==============================================================================================
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the CAT protocol formatters and decoders')
+	parser.add_argument('--number', type=int, default=100000, help='calls per timing run')
+	parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown as a fraction')
+	parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+	parser.add_argument('--save', action='store_true', help='store this run as the baseline')
+	args = parser.parse_args()
+
+	current = measure(args.number)
+	baseline = None
+	if not args.save and os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+
+	print('reference %.1f ns/op' % current['reference_ns'])
+	print('%-40s %10s %10s %10s' % ('case', 'ns/op', 'baseline', 'blocks/op'))
+	for name, now in current['cases'].items():
+		base = ''
+		if baseline != None and name in baseline['cases']:
+			# Baseline scaled to the speed of this run
+			base = '%.1f' % (baseline['cases'][name]['relative'] * current['reference_ns'])
+		print('%-40s %10.1f %10s %10.2f' % (name, now['ns'], base, now['blocks']))
+
+	if args.save:
+		with open(args.baseline, 'w') as f:
+			json.dump(current, f, indent=2, sort_keys=True)
+		print('Baseline written to %s' % args.baseline)
+		return 0
+	if baseline == None:
+		print('No baseline at %s, run with --save to create one' % args.baseline)
+		return 0
+	regressions = compare(current, baseline, args.tolerance)
+	for r in regressions:
+		print('REGRESSION %s' % r)
+	if len(regressions) > 0:
+		return 1
+	print('No regressions')
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -25,7 +25,6 @@
 
 # System imports
 import os, sys
-import glob
 
 # Application imports
 from defs import *
@@ -34,7 +33,19 @@ import array
 import threading
 import queue
 import traceback
-from time import sleep
+import concurrent.futures
+from collections import namedtuple, deque
+from types import MappingProxyType
+import scheduler
+import bcd
+import civ
+import rig_state
+import metrics
+import ports
+import shaper
+import rtt
+from time import sleep, monotonic
+from math import ceil
 
 """
 
@@ -52,32 +63,55 @@ To define a new protocol:
 	3. Implement a new class for the variant modelled on FT817 class.
 """
 
+# Metrics, served at /metrics
+# Where the time goes between a command being queued and its response decoded
+QUEUE_WAIT = metrics.REGISTRY.histogram('cat_queue_wait_seconds', 'Time a command waited in the CAT queue', ('rig', 'command'))
+FORMAT_TIME = metrics.REGISTRY.histogram('cat_format_seconds', 'Time to format a command', ('rig', 'command'))
+WRITE_TIME = metrics.REGISTRY.histogram('cat_write_seconds', 'Time to write a command to the port, including pacing', ('rig', 'command'))
+RESPONSE_TIME = metrics.REGISTRY.histogram('cat_response_seconds', 'Time from the command written to the response read', ('rig', 'command'))
+DECODE_TIME = metrics.REGISTRY.histogram('cat_decode_seconds', 'Time to decode a response', ('rig', 'command'))
+COMMANDS = metrics.REGISTRY.counter('cat_commands_total', 'Commands sent to the rig', ('rig', 'command'))
+TIMEOUTS = metrics.REGISTRY.counter('cat_timeouts_total', 'Responses not read within the adaptive timeout', ('rig', 'command'))
+RETRIES = metrics.REGISTRY.counter('cat_retries_total', 'Commands sent again after a timeout', ('rig', 'command'))
+PIPELINED = metrics.REGISTRY.counter('cat_pipelined_total', 'Reads sent while another read was outstanding', ('rig', 'command'))
+COALESCED = metrics.REGISTRY.counter('cat_coalesced_total', 'Commands merged into a waiting command of the same type', ('rig', 'command'))
+SUPPRESSED = metrics.REGISTRY.counter('cat_suppressed_total', 'Sets dropped as the rig already has the value', ('rig', 'command'))
+# The children for one rig and command, looked up once, and its round trip estimator
+CommandMetrics = namedtuple('CommandMetrics', ('queue_wait', 'format', 'write', 'response', 'decode', 'commands', 'timeouts', 'retries', 'rtt'))
+
+# Held while the port is down and sent in this order when it reopens
+REPLAY_COMMANDS = (CAT_MODE_SET, CAT_FREQ_SET)
+
 
 #======================================================================================
 # CAT class for all rigs
 class CAT:
 	
-	def __init__(self, rig, com, baud, catq):
+	def __init__(self, rig, com, baud, catq, state_ttl = CAT_STATE_TTL, name = None):
 		"""
 		Constructor
 		
 		Arguments
-			rig		--  currently only FT817ND or IC7100
-			com		--  COM port to which rig is connected
-			baud	--	baud rate rig is set to
-			catq	--	CAT responses here
+			rig			--  currently only FT817ND or IC7100
+			com			--  COM port to which rig is connected
+			baud		--	baud rate rig is set to
+			catq		--	CAT responses here
+			state_ttl	--	seconds a cached rig value stays fresh
+			name		--	name for messages and metrics, defaults to rig,
+							must differ when several rigs of one type are open
 		"""
 	
 		self.__rig 	= rig
+		self.__name = name if name != None else rig
 		self.__com = com
 		self.__baud = baud
 		self.__catq = catq
 		
 		# Get our command set
-		if rig not in CAT_COMMAND_SETS:
+		if rig not in COMPILED_COMMAND_SETS:
 			raise LookupError
 		else:
-			self.__command_set = CAT_COMMAND_SETS[rig]
+			self.__command_set = COMPILED_COMMAND_SETS[rig]
 		
 		# Instance vars
 		self.__port_open = False
@@ -85,57 +119,161 @@ class CAT:
 		self.__device = None
 		self.__cat_thrd = None
 		self.__callback = None
+		# Port actually open, the configured one or where the rig reappeared
+		self.__active_port = com
+		# USB identity of the port, to find the rig again if it comes back elsewhere
+		self.__identity = None
+		# Several ports matched the identity last time
+		self.__ambiguous = False
+		# Serialises swapping the thread with commands going to it
+		self.__lock = threading.Lock()
+		# The supervisor that keeps the port open
+		self.__supervisor = None
+		self.__stop = threading.Event()
+		# Latest value asked for of each command replayed on reconnect
+		self.__desired = {}
+		# Coalesced counts of threads already gone
+		self.__coalesced = 0
+		# For mode lookups while no thread is running
+		self.__cat_cls_inst = self.__command_set.rig_class(self.__command_set)
+		# What we last sent to and read from the rig
+		self.__state = rig_state.RigState(self.__command_set.resolution, state_ttl)
 		
 	#======================================================================================
 	# PUBLIC interface		
 	def run(self):
-		""" Run CAT """
-		
-		if self.__port_open:
-			# Just start the thread
-			self.__cat_thrd.start()
-		else:
-			# Try to open the serial port again
-			try:
-				# List the serial ports again as we can't do this after we open.
-				self.__ports = self.__list_serial_ports()
-				self.__device = serial.Serial(port=self.__com, baudrate=self.__baud, parity=self.__command_set[SERIAL][PARITY], stopbits=self.__command_set[SERIAL][STOP_BITS], timeout=self.__command_set[SERIAL][TIMEOUT])
-				self.__port_open = True
-				print("Opened port %s" % self.__com)
-				# Create and start the CAT thread
-				self.__cat_thrd = CATThrd(self.__rig, self.__command_set, self.__device, self.__catq)
-				self.__cat_thrd.start()
-			except (OSError, serial.SerialException):
-				# Failed to open the port, radio device probably still off
-				print('Failed to open COM port %s for CAT! Available ports are %s.' % (self.__com, self.__ports))
-				return False
-			
-		return True
+		"""
+		Run CAT
+		
+		Returns True if the port opened now. If not, or if the port is
+		lost later, a supervisor thread keeps trying to open it with
+		backoff, see __supervise().
+		"""
+		
+		if self.__supervisor != None:
+			return self.__port_open
+		opened = self.__open_link()
+		if not opened:
+			# Failed to open the port, radio device probably still off
+			# Only now is it worth looking for what is there
+			self.__ports = ports.names()
+			print('Failed to open COM port %s for CAT! Available ports are %s. Will keep trying.' % (self.__com, self.__ports))
+		self.__supervisor = threading.Thread(target=self.__supervise, name='CAT supervisor %s' % self.__name)
+		self.__supervisor.daemon = True
+		self.__supervisor.start()
+		return opened
 	
 	#-----------------------------------------------	
 	def terminate(self):
-		""" Ask the thread to terminate and wait for it to exit """
-		if self.__cat_thrd != None:
-			self.__cat_thrd.terminate()
-			# Wait for the thread to exit
-			self.__cat_thrd.join()
-			
-		if self.__device != None:
-			self.__device.close()
+		""" Stop the supervisor and the thread and close the port """
+		
+		self.__stop.set()
+		if self.__supervisor != None:
+			self.__supervisor.join()
+		self.__close_link()
 
 	#-----------------------------------------------
 	def do_command(self, cat_cmd, params = None):
 		"""
 		Execute a new CAT command
 		
+		While the port is down frequency and mode are held and sent
+		when it reopens, anything else is dropped.
+		
 		Arguments:
 			cat_cmd	-- 	from the CAT command enumerations
 			params	--	required parameters for the command
 			
 		"""
 		
-		if self.__port_open:
-			self.__cat_thrd.do_command(cat_cmd, params)
+		if cat_cmd in REPLAY_COMMANDS:
+			self.__desired[cat_cmd] = params
+		with self.__lock:
+			if self.__port_open:
+				# Drop a set that would not change the rig
+				if self.__state.redundant(cat_cmd, params):
+					SUPPRESSED.labels(self.__name, cat_cmd).inc()
+					return
+				self.__state.requested(cat_cmd, params)
+				self.__cat_thrd.do_command(cat_cmd, params)
+	
+	#-----------------------------------------------
+	def set_callback(self, callback):
+		"""
+		Set a callable for unsolicited updates from the rig
+		
+		The callable is called on the CAT thread with a response tuple,
+		e.g. (True, CAT_FREQ_GET, Hz), whenever the rig reports a change
+		we did not ask for, currently CI-V transceive frames. It must not
+		block.
+		
+		Arguments:
+			callback	--	callable(response)
+			
+		"""
+		
+		with self.__lock:
+			self.__callback = callback
+			if self.__cat_thrd != None:
+				self.__cat_thrd.set_callback(callback)
+	
+	#-----------------------------------------------
+	def query(self, cat_cmd, params = None):
+		"""
+		Execute a CAT command and return a concurrent.futures.Future
+		
+		The future resolves with the decoded response for this command
+		only, the same tuple that do_command() puts on the CAT queue.
+		It fails with TimeoutError if the rig does not answer and IOError
+		if the port is not open. Use asyncio.wrap_future() to await it.
+		A read of a value still fresh in the state cache resolves at once
+		without going to the rig.
+		
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	required parameters for the command
+			
+		"""
+		
+		future = concurrent.futures.Future()
+		with self.__lock:
+			if self.__port_open:
+				response = self.__state.cached(cat_cmd)
+				if response != None:
+					future.set_result(response)
+					return future
+				self.__state.requested(cat_cmd, params)
+				self.__cat_thrd.do_command(cat_cmd, params, future)
+				return future
+		future.set_exception(IOError('CAT port %s is not open' % self.__com))
+		return future
+	
+	#-----------------------------------------------
+	def resolution(self):
+		""" Rig tuning step in Hz """
+		
+		return self.__command_set.resolution
+	
+	#-----------------------------------------------
+	def is_open(self):
+		""" True if the port is open and the thread running """
+		
+		return self.__port_open
+	
+	#-----------------------------------------------
+	def get_state(self):
+		""" Return the rig state cache """
+		
+		return self.__state
+	
+	#-----------------------------------------------
+	def coalesced(self):
+		""" Number of commands absorbed into a waiting command """
+		
+		thrd = self.__cat_thrd
+		if thrd != None:
+			return self.__coalesced + thrd.coalesced()
+		return self.__coalesced
 	
 	#-----------------------------------------------
 	def mode_for_id(self, mode_id):
@@ -147,7 +285,7 @@ class CAT:
 			
 		"""
 		
-		return self.__cat_thrd.mode_for_id(mode_id)
+		return self.__cat_cls_inst.mode_for_id(mode_id)
 	
 	#-----------------------------------------------
 	def id_for_mode(self, mode):
@@ -159,7 +297,7 @@ class CAT:
 			
 		"""
 		
-		return self.__cat_thrd.id_for_mode(mode)
+		return self.__cat_cls_inst.id_for_mode(mode)
 	
 	#-----------------------------------------------
 	def bandwidth_for_mode(self, mode):
@@ -171,54 +309,170 @@ class CAT:
 			
 		"""
 		
-		return self.__cat_thrd.bandwidth_for_mode(mode)
+		return self.__cat_cls_inst.bandwidth_for_mode(mode)
 	
 	#-----------------------------------------------
 	def get_serial_ports(self):
-		""" Return available serial port names """
+		""" Return available serial port names, see ports.py """
 		
+		self.__ports = ports.names()
 		return self.__ports
 	
 	#======================================================================================
-	# PRIVATE interface		
-	def __list_serial_ports(self):
-		""" Lists available serial port names """
-		
-		self.__ports = []
-		all_ports = []
-		if sys.platform.startswith('win'):
-			all_ports = ['COM%s' % (i + 1) for i in range(20)]
-		elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-			# this excludes your current terminal "/dev/tty"
-			all_ports = glob.glob('/dev/tty[A-Za-z]*')
-		elif sys.platform.startswith('darwin'):
-			all_ports = glob.glob('/dev/tty.*')
-	
-		for port in all_ports:
+	# PRIVATE interface
+	def __supervise(self):
+		"""
+		Supervisor thread entry point
+		
+		Watches an open port and reopens a closed one. A USB adapter
+		unplugged shows as the thread failing on I/O or the device node
+		going away. Reopening backs off from CAT_RECONNECT_MIN to
+		CAT_RECONNECT_MAX seconds so a radio left off costs next to nothing.
+		"""
+		
+		delay = CAT_RECONNECT_MIN
+		while not self.__stop.is_set():
+			if self.__port_open:
+				if self.__link_ok():
+					self.__stop.wait(CAT_HEALTH_POLL)
+					continue
+				print('CAT port %s for %s lost, reconnecting...' % (self.__active_port, self.__name))
+				if self.__identity == None:
+					self.__identity = self.__identity_of(self.__active_port)
+				self.__close_link()
+				delay = CAT_RECONNECT_MIN
+			if self.__stop.wait(delay):
+				break
+			if self.__open_link():
+				delay = CAT_RECONNECT_MIN
+			else:
+				delay = min(delay * 2, CAT_RECONNECT_MAX)
+	
+	#-----------------------------------------------
+	def __open_link(self):
+		""" Open the port and start a thread, True if done """
+		
+		port = self.__com
+		if self.__identity != None:
+			# Follow the adapter, it may come back as another ttyUSBn
+			# and something else may now be on the old one
+			port = self.__moved_port()
+			if port == None:
+				return False
+		device = self.__open_port(port)
+		if device == None:
+			return False
+		thrd = CATThrd(self.__name, self.__command_set, device, self.__catq, self.__callback, self.__state)
+		with self.__lock:
+			self.__device = device
+			self.__active_port = port
+			self.__cat_thrd = thrd
+			thrd.start()
+			# Put the rig back where we want it before anything new goes out
+			for cat_cmd in REPLAY_COMMANDS:
+				params = self.__desired.get(cat_cmd)
+				if params != None:
+					self.__state.requested(cat_cmd, params)
+					thrd.do_command(cat_cmd, params)
+			self.__port_open = True
+		if self.__identity == None:
+			# Cheap where sysfs has it, else left to __identity_of() on failure
+			self.__identity = ports.identity(port)
+		print("Opened port %s" % port)
+		return True
+	
+	#-----------------------------------------------
+	def __close_link(self):
+		""" Stop the thread and close the port """
+		
+		with self.__lock:
+			self.__port_open = False
+			thrd = self.__cat_thrd
+			device = self.__device
+			self.__cat_thrd = None
+			self.__device = None
+		if thrd != None:
+			self.__coalesced += thrd.coalesced()
+			thrd.terminate()
+		if device != None:
 			try:
-				s = serial.Serial(port)
-				s.close()
-				self.__ports.append(port)
+				device.close()
 			except (OSError, serial.SerialException):
 				pass
-			except Exception:
-				pass
-		#print (self.__ports)
-		return self.__ports
+		# Nothing we knew about the rig holds now
+		self.__state.invalidate()
+		ports.invalidate()
+	
+	#-----------------------------------------------
+	def __link_ok(self):
+		""" False if the thread has failed or the device node has gone """
+		
+		thrd = self.__cat_thrd
+		if thrd == None or not thrd.is_alive() or thrd.failed():
+			return False
+		if self.__active_port.startswith('/dev/') and not os.path.exists(self.__active_port):
+			return False
+		return True
+	
+	#-----------------------------------------------
+	def __open_port(self, port):
+		""" Return an open serial device or None """
+		
+		try:
+			# Exclusive so a rig's port is never shared with another CAT
+			return serial.Serial(port=port, baudrate=self.__baud, parity=self.__command_set.parity, stopbits=self.__command_set.stop_bits, timeout=self.__command_set.timeout, exclusive=True)
+		except (OSError, serial.SerialException):
+			return None
+	
+	#-----------------------------------------------
+	def __identity_of(self, port):
+		""" USB (vid, pid, serial number) of a port from discovery, None if not USB or gone """
+		
+		real = os.path.realpath(port)
+		for p in ports.discover():
+			if p.device == real and p.vid != None:
+				return (p.vid, p.pid, p.serial_number)
+		return None
+	
+	#-----------------------------------------------
+	def __moved_port(self):
+		"""
+		Where the adapter we had open is now, None if not plugged in
+		
+		Identical adapters may have no serial number or the same one, so
+		the port we had is preferred if it matches and several matches
+		with no way to tell them apart are refused. Any of them may be
+		another rig's port.
+		"""
+		
+		vid, pid, serial_number = self.__identity
+		# find() takes a None serial number as any
+		found = [os.path.realpath(p.device) for p in ports.find(vid, pid, refresh = True) if p.serial_number == serial_number]
+		for port in (self.__active_port, self.__com):
+			if os.path.realpath(port) in found:
+				return port
+		if len(found) == 1:
+			return found[0]
+		if len(found) > 1 and not self.__ambiguous:
+			print('CAT port for %s may be any of %s, not reconnecting' % (self.__name, found))
+		self.__ambiguous = len(found) > 1
+		return None
 	
 #======================================================================================
 # CAT execution thread for all devices
 class CATThrd (threading.Thread):
 	
-	def __init__(self, rig, command_set, device, catq):
+	def __init__(self, rig, command_set, device, catq, callback = None, state = None):
 		"""
 		Constructor
 		
 		Arguments
-			rig			--	rig type
-			command_set	--	command set to use
+			rig			--	rig name for messages and metrics
+			command_set	--	compiled command set to use
 			device   	--  an open device for the transport
 			catq		--	CAT responses here
+			callback	--	unsolicited updates from the rig here
+			state		--	rig state cache to update from responses
 		"""
 
 		super(CATThrd, self).__init__()
@@ -226,38 +480,92 @@ class CATThrd (threading.Thread):
 		self.__rig = rig
 		self.__command_set = command_set
 		self.__device = device
-		self.__callback = None
+		self.__callback = callback
 		self.__catq = catq
+		self.__state = state
 		
 		# Class vars
-		self.__cat_cls_inst = self.__command_set[CLASS](command_set)
-		self.__q = queue.Queue()
+		self.__cat_cls_inst = self.__command_set.rig_class(command_set)
+		self.__q = scheduler.CommandScheduler()
+		# Paces frames to the line rate and the rig's guard time
+		self.__shaper = shaper.for_command_set(self.__command_set, self.__device.baudrate)
+		# Port read timeout, set per exchange
+		self.__timeout = self.__device.timeout
+		# CI-V rigs share a bus, replies are picked out of the byte stream
+		if self.__command_set.rig_class == ICOM:
+			self.__framer = civ.CIVFramer()
+			# Reads in flight at once, see __pipeline()
+			self.__window = self.__command_set.pipeline
+		else:
+			self.__framer = None
+			self.__window = 1
+		# Stop-and-wait after an NG to a pipelined read, until then
+		self.__window_back = 0.0
+		self.__holdoff = CAT_PIPELINE_HOLDOFF
+		# CI-V sets written whose OK or NG has not come, oldest first,
+		# as (metrics, time sent, the line was quiet, command, params), see __settle()
+		self.__owed_sets = deque()
+		# Responses resent reads may still get, as [cmd, reply key, number, until], see __quiet()
+		self.__late = []
+		# How often to look for unsolicited frames when idle, None if the rig sends none
+		self.__listen_poll = self.__command_set.listen_poll
+		# Metrics by command
+		self.__metrics = {}
 		# Terminate flag
 		self.__terminate = False
+		# Set when the port fails, the supervisor replaces us
+		self.__failed = False
 	
 	#-----------------------------------------------	
 	def terminate(self):
 		""" Asked to terminate the thread """
 		
 		self.__terminate = True
+		# Wake the thread if it is waiting for a command
+		self.__q.close()
 		self.join()
 	
 	#-----------------------------------------------
-	def do_command(self, cat_cmd, params):
+	def do_command(self, cat_cmd, params, future = None):
 		"""
 		Execute a new CAT command
 		
 		Arguments:
 			cat_cmd	-- 	from the CAT command enumerations
 			params	--	required parameters for the command
+			future	--	if given receives the response instead of the CAT queue
 			
 		"""
 		
-		# We add the command to a thread-safe Q for execution by the thread
-		# Note we are only interested in the last frequency and the one potentially being executed.
-		# The max_len is therefore set to 2 which discards elements from the opposite end of the q
-		# when the queue is full.
-		self.__q.put((cat_cmd, params))
+		# We add the command to the scheduler for execution by the thread.
+		# PTT and lock go ahead of other traffic and a waiting frequency,
+		# mode or lock command is updated in place rather than queued again.
+		if self.__q.put(cat_cmd, params, future):
+			COALESCED.labels(self.__rig, cat_cmd).inc()
+	
+	#-----------------------------------------------
+	def coalesced(self):
+		""" Number of commands absorbed into a waiting command """
+		
+		return self.__q.coalesced()
+	
+	#-----------------------------------------------
+	def failed(self):
+		""" True if the thread stopped because the port failed """
+		
+		return self.__failed
+	
+	#-----------------------------------------------
+	def set_callback(self, callback):
+		"""
+		Set a callable for unsolicited updates from the rig
+		
+		Arguments:
+			callback	--	callable(response)
+			
+		"""
+		
+		self.__callback = callback
 	
 	#-----------------------------------------------
 	def mode_for_id(self, mode_id):
@@ -303,57 +611,524 @@ class CATThrd (threading.Thread):
 		# Handles all CAT interactions with an external tranceiver
 		print('CAT thread running...')	
 		while not self.__terminate:
+			future = None
 			try:
-				# Requests are queued
-				cmd = None
-				param = None
-				while True:
-					# Only execute the last frequency command
-					try:
-						cmd, param = self.__q.get(block = False)
-						if cmd != CAT_FREQ_SET:
-							# Execute any other commands
-							break
-					except queue.Empty:
-						break
+				# Wait for a request, superseded values are already merged
+				try:
+					cmd, param, future, queued = self.__q.get(timeout = self.__listen_poll)
+				except queue.Empty:
+					# Idle or woken to terminate
+					if self.__listen_poll != None:
+						self.__listen()
+					continue
+				if future != None and not future.set_running_or_notify_cancel():
+					# The caller gave up before we got to it
+					continue
+				m = self.__metrics.get(cmd)
+				if m == None:
+					m = self.__command_metrics(cmd)
+				t = monotonic()
+				m.queue_wait.observe(t - queued)
 				# Format
 				(r, cmd_buf) = self.__cat_cls_inst.format_cat_cmd(cmd, param)
-				if r:
+				t_format = monotonic()
+				m.format.observe(t_format - t)
+				if not r:
+					if future != None:
+						future.set_exception(LookupError('Command %s not supported by %s' % (cmd, self.__rig)))
+				else:
+					is_read = self.__cat_cls_inst.is_response(cmd)
+					# Discard anything the rig sent since the last exchange
+					self.__drain()
+					self.__quiet()
+					if is_read and self.__framer != None:
+						# Reads go out on a quiet line, the timeouts are learned on one
+						self.__settle()
 					# We do not assume a response
-					self.__device.write(cmd_buf)
-					if self.__cat_cls_inst.is_response(cmd):
-						if self.__command_set[CLASS] == ICOM:
-							data = bytearray(30)
-							n = 0
-							while True:
-								ch = self.__device.read()
-								data[n:n+1] = ch
-								# There will be a terminator at the end of the OK or NG frame
-								# skip that and then if there is no data we will timeout and
-								# an error response returned from decode.
-								if ch == b'\xfd':
-									break
-								n += 1
+					t_sent = self.__send(cmd_buf)
+					m.write.observe(monotonic() - t_format)
+					m.commands.inc()
+					if is_read:
+						# More reads waiting go out behind this one on CI-V
+						more = self.__more_reads(cmd) if self.__pipeline_window() > 1 else None
+						if more:
+							self.__pipeline([cmd, future, m, cmd_buf, t_sent], more)
 						else:
-							data = self.__device.read(self.__command_set[SERIAL][READ_SZ])
-						# Return data to the caller
-						# Note, this is an async return
-						if len(data) > 0:
-							response = self.__cat_cls_inst.decode_cat_resp(CAT_COMMAND_SETS[self.__rig], cmd, data)
-							self.__catq.put(response)
+							data, t_response = self.__exchange(cmd, cmd_buf, m, t_sent)
+							self.__deliver(cmd, future, m, data, t_response)
 					else:
-						# There may be some response data even if we don't expect it.
-						# The serial port seems to return an empty string if there is no data available
-						#while True:
-						ch = self.__device.read()
-						#if ch == b'0x00': break
-						#sleep(0.1)
-				sleep(0.1)
+						if self.__framer != None:
+							# The rig still owes an OK or NG
+							self.__owed_sets.append((m, t_sent, len(self.__owed_sets) == 0, cmd, param))
+						if future != None:
+							future.set_result(None)
+			except (OSError, serial.SerialException) as e:
+				# Port gone, usually the USB cable pulled or the rig off
+				print('CAT port for %s failed [%s]' % (self.__rig, str(e)))
+				if future != None and not future.done():
+					future.set_exception(IOError('CAT port for %s failed' % self.__rig))
+				self.__failed = True
+				break
 			except Exception as e:
 				# Oops
 				print("Error in CAT thread [%s]" % traceback.format_exc())
-				self.__catq.put((False, 'ERROR [%s]' % (str(e))))
+				if future != None:
+					if not future.done():
+						future.set_exception(e)
+				else:
+					self.__catq.put((False, 'ERROR [%s]' % (str(e))))
+		# Nobody will answer anything still waiting
+		for cmd, param, future, queued in self.__q.flush():
+			if future != None:
+				future.cancel()
 		print('CAT thread exiting...')
+	
+	#-----------------------------------------------
+	def __command_metrics(self, cmd):
+		""" Look up and keep the metric children for a command """
+		
+		rig = self.__rig
+		m = CommandMetrics(
+			queue_wait = QUEUE_WAIT.labels(rig, cmd),
+			format = FORMAT_TIME.labels(rig, cmd),
+			write = WRITE_TIME.labels(rig, cmd),
+			response = RESPONSE_TIME.labels(rig, cmd),
+			decode = DECODE_TIME.labels(rig, cmd),
+			commands = COMMANDS.labels(rig, cmd),
+			timeouts = TIMEOUTS.labels(rig, cmd),
+			retries = RETRIES.labels(rig, cmd),
+			rtt = rtt.RttEstimator(self.__command_set.timeout))
+		self.__metrics[cmd] = m
+		return m
+	
+	#-----------------------------------------------
+	def __send(self, cmd_buf):
+		""" Write a frame when the link allows, return when it leaves the wire """
+		
+		# Wait for room on the line and for the rig to be ready
+		delay = self.__shaper.reserve(len(cmd_buf))
+		if delay > 0:
+			sleep(delay)
+		self.__device.write(cmd_buf)
+		# Frames ahead of it may still be going out
+		return max(monotonic(), self.__shaper.wire_free())
+	
+	#-----------------------------------------------
+	def __exchange(self, cmd, cmd_buf, m, t_sent, resent = False):
+		"""
+		Return (response, time read) for a command just written
+		
+		Waits the adaptive timeout for the command from when the frame
+		left the wire, see rtt.py. With no response the command is sent
+		again, up to CAT_RETRIES times once the round trip is known, and
+		the response is empty if none of them was answered. A Yaesu reply
+		is only taken whole, one cut short counts as no answer. A response
+		after a resend may be the late one to an earlier send, the
+		others are let go by before the next command, see __quiet().
+		
+		Arguments:
+			cmd		--	the command
+			cmd_buf	--	the frame written
+			m		--	metrics and estimator for the command
+			t_sent	--	when the frame left the wire
+			resent	--	True if the frame was sent before without an answer
+		"""
+		
+		# Until the rig has answered once the timeout is the worst case,
+		# too long to wait more than once
+		retries = CAT_RETRIES if m.rtt.srtt() != None else 0
+		tries = 0
+		key = bytes(cmd_buf[civ.CMD:-1]) if self.__framer != None else None
+		while True:
+			deadline = t_sent + m.rtt.timeout()
+			if self.__framer != None:
+				self.__read_timeout(m.rtt.timeout())
+				data = self.__read_civ_reply(key, deadline)
+			else:
+				size = self.__cat_cls_inst.response_size(cmd)
+				self.__read_timeout(max(0.0, deadline - monotonic()))
+				data = self.__device.read(size)
+				if 0 < len(data) < size:
+					# The reply started at the deadline, the rest is on its way
+					self.__read_timeout(self.__shaper.frame_time(size - len(data)) + m.rtt.timeout())
+					data += self.__device.read(size - len(data))
+					if len(data) < size:
+						# Unusable, as is the rest of it if it comes. The frames have no
+						# markers, so let the line go quiet before anything is resent
+						self.__read_timeout(self.__command_set.timeout)
+						give_up = monotonic() + CAT_RETRIES * self.__command_set.timeout
+						while len(self.__device.read(size)) > 0 and monotonic() < give_up and not self.__terminate:
+							pass
+						data = b''
+			t_response = monotonic()
+			if len(data) > 0:
+				# Replies owed to earlier sends, the first may be this one
+				owed = tries + (1 if resent else 0)
+				if owed == 0:
+					m.rtt.sample(t_response - t_sent)
+				m.response.observe(t_response - t_sent)
+				if owed > 0:
+					self.__late.append([cmd, key, owed, t_response + m.rtt.timeout()])
+				return data, t_response
+			m.timeouts.inc()
+			m.rtt.backoff()
+			if tries >= retries or self.__terminate:
+				return data, t_response
+			tries += 1
+			m.retries.inc()
+			self.__drain()
+			t_sent = self.__send(cmd_buf)
+	
+	#-----------------------------------------------
+	def __quiet(self):
+		"""
+		Let late responses to earlier sends of resent reads go by, so
+		the next read of the same command does not take one for its own.
+		Waits until every one has come or the time recorded for it.
+		"""
+		
+		while len(self.__late) > 0:
+			cmd, key, owed, until = self.__late[0]
+			if self.__framer == None:
+				self.__read_timeout(max(0.0, until - monotonic()))
+				self.__device.read(owed * self.__cat_cls_inst.response_size(cmd))
+				self.__late.pop(0)
+				continue
+			f = self.__framer.next_frame()
+			if f != None:
+				if not self.__accounted(f[0], f[1]):
+					self.__unsolicited(f[0], f[1])
+				continue
+			data = b''
+			if monotonic() < until:
+				self.__read_timeout(until - monotonic())
+				data = self.__device.read(max(1, self.__device.in_waiting))
+			if len(data) > 0:
+				self.__framer.feed(data)
+			else:
+				self.__late.pop(0)
+	
+	#-----------------------------------------------
+	def __settle(self):
+		"""
+		Wait for the OK or NG owed by each CI-V set written
+		
+		Sets are not waited for when written, but their echo and OK are
+		still on the wire ahead of the next read. A read sent behind them
+		would take longer than its learned timeout and a late reply could
+		be taken for the next one, so reads wait here. A set not answered
+		within its own timeout is counted as a timeout and forgotten.
+		"""
+		
+		while len(self.__owed_sets) > 0:
+			f = self.__framer.next_frame()
+			if f != None:
+				if not self.__accounted(f[0], f[1]):
+					self.__unsolicited(f[0], f[1])
+				continue
+			m, t_sent, clean, cmd, param = self.__owed_sets[0]
+			data = b''
+			if monotonic() < t_sent + m.rtt.timeout():
+				self.__read_timeout(m.rtt.timeout())
+				data = self.__device.read(max(1, self.__device.in_waiting))
+			if len(data) > 0:
+				self.__framer.feed(data)
+			else:
+				m.timeouts.inc()
+				m.rtt.backoff()
+				self.__owed_sets.popleft()
+				if self.__state != None:
+					# It may not have been acted on, let it be sent again
+					self.__state.refused(cmd, param)
+	
+	#-----------------------------------------------
+	def __accounted(self, kind, frame):
+		"""
+		True if a CI-V frame is a late response to a resent read or the
+		OK or NG owed by the oldest set, which is then done
+		
+		Arguments:
+			kind	--	frame kind from the framer
+			frame	--	the frame
+		"""
+		
+		for late in self.__late:
+			if kind == civ.FRAME_NG or (kind == civ.FRAME_DATA and frame[civ.CMD:civ.CMD + len(late[1])] == late[1]):
+				late[2] -= 1
+				if late[2] == 0:
+					self.__late.remove(late)
+				return True
+		if len(self.__owed_sets) == 0 or (kind != civ.FRAME_OK and kind != civ.FRAME_NG):
+			return False
+		m, t_sent, clean, cmd, param = self.__owed_sets.popleft()
+		t_response = monotonic()
+		if self.__state != None:
+			if kind == civ.FRAME_OK:
+				self.__state.accepted(cmd, param)
+			else:
+				self.__state.refused(cmd, param)
+		# Sets written behind another wait for it, only one on a quiet line is a round trip
+		if clean:
+			m.rtt.sample(t_response - t_sent)
+		m.response.observe(t_response - t_sent)
+		return True
+	
+	#-----------------------------------------------
+	def __next_frame(self, deadline):
+		"""
+		Return the next CI-V frame as (kind, frame), None if there is
+		none by the deadline. Frames owed, see __accounted(), are taken here.
+		The frame is a view of the framer buffer until the next call.
+		
+		Arguments:
+			deadline	--	monotonic time to give up
+		"""
+		
+		while True:
+			f = self.__framer.next_frame()
+			if f != None:
+				if not self.__accounted(f[0], f[1]):
+					return f
+				continue
+			if monotonic() >= deadline:
+				return None
+			# Take whatever is waiting, block for at least one byte
+			data = self.__device.read(max(1, self.__device.in_waiting))
+			if len(data) == 0:
+				return None
+			self.__framer.feed(data)
+	
+	#-----------------------------------------------
+	def __deliver(self, cmd, future, m, data, t_response):
+		""" Decode a response and pass it to the caller, empty data is a timeout """
+		
+		# Note, this is an async return
+		if len(data) > 0:
+			response = self.__cat_cls_inst.decode_cat_resp(cmd, data)
+			m.decode.observe(monotonic() - t_response)
+			if self.__state != None:
+				self.__state.confirm(response)
+			if future != None:
+				future.set_result(response)
+			else:
+				self.__catq.put(response)
+		elif future != None:
+			future.set_exception(TimeoutError('No response to %s from %s' % (cmd, self.__rig)))
+	
+	#-----------------------------------------------
+	def __more_reads(self, first):
+		"""
+		Take up to window - 1 reads queued right behind the first,
+		return them as [cmd, future, metrics, frame] or an empty list
+		
+		A read frame is fixed so its reply is identified by the command
+		alone, no two reads of the same command are taken.
+		
+		Arguments:
+			first	--	the read already sent
+		"""
+		
+		taken = [first]
+		def accept(cat_cmd):
+			return self.__cat_cls_inst.is_response(cat_cmd) and cat_cmd not in taken
+		more = []
+		while len(more) < self.__window - 1:
+			entry = self.__q.get_if(accept)
+			if entry == None:
+				break
+			cmd, param, future, queued = entry
+			if future != None and not future.set_running_or_notify_cancel():
+				continue
+			m = self.__metrics.get(cmd)
+			if m == None:
+				m = self.__command_metrics(cmd)
+			m.queue_wait.observe(monotonic() - queued)
+			(r, cmd_buf) = self.__cat_cls_inst.format_cat_cmd(cmd, param)
+			if not r:
+				if future != None:
+					future.set_exception(LookupError('Command %s not supported by %s' % (cmd, self.__rig)))
+				continue
+			taken.append(cmd)
+			more.append([cmd, future, m, cmd_buf])
+		return more
+	
+	#-----------------------------------------------
+	def __pipeline(self, first, more):
+		"""
+		Send more reads behind one in flight and match the replies
+		
+		CI-V data replies start with the command and sub-command of the
+		request, so replies to several reads can be told apart. The
+		window hides the turnaround between a reply and the next request.
+		
+		An NG carries no command. NGs owed by sets and resent reads are
+		already accounted for (__accounted()), and the rig answers in
+		order, so an NG here answers the earliest read still pending. To
+		the first read it is that read's answer, as without pipelining.
+		To a read sent behind another the rig may not take reads while
+		busy, that read is sent again on its own and the link is
+		stop-and-wait for a while, see __pipeline_window(). Reads not
+		answered in the longest of their timeouts are sent again one at
+		a time.
+		
+		Arguments:
+			first	--	[cmd, future, metrics, frame, time sent] already sent
+			more	--	from __more_reads()
+		"""
+		
+		try:
+			# In flight as [cmd, future, metrics, frame, time sent, reply key]
+			flight = [first + [bytes(first[3][civ.CMD:-1])]]
+			for cmd, future, m, cmd_buf in more:
+				t = monotonic()
+				t_sent = self.__send(cmd_buf)
+				m.write.observe(monotonic() - t)
+				m.commands.inc()
+				PIPELINED.labels(self.__rig, cmd).inc()
+				flight.append([cmd, future, m, cmd_buf, t_sent, bytes(cmd_buf[civ.CMD:-1])])
+			pending = list(flight)
+			timeout = self.__read_timeout(max(e[2].rtt.timeout() for e in flight))
+			deadline = flight[-1][4] + timeout
+			# Pipelined reads the rig answered NG
+			refused = []
+			while len(pending) > 0:
+				f = self.__next_frame(deadline)
+				if f == None:
+					break
+				kind, frame = f
+				if kind == civ.FRAME_NG and pending[0] is not flight[0]:
+					refused.append(pending.pop(0))
+					continue
+				if kind == civ.FRAME_NG or kind == civ.FRAME_DATA:
+					e = pending[0] if kind == civ.FRAME_NG else self.__match(pending, frame)
+					if e != None:
+						t_response = monotonic()
+						# Later replies queue behind earlier ones, only the first is a clean round trip
+						if e is flight[0]:
+							e[2].rtt.sample(t_response - e[4])
+						e[2].response.observe(t_response - e[4])
+						# Before the next frame, the frame is a view of the framer buffer
+						self.__deliver(e[0], e[1], e[2], frame, t_response)
+						pending.remove(e)
+						continue
+				self.__unsolicited(kind, frame)
+			if len(refused) > 0:
+				print('CI-V NG from %s to a pipelined read, stop-and-wait for %.0fs' % (self.__rig, self.__holdoff))
+				self.__window = 1
+				self.__window_back = monotonic() + self.__holdoff
+				self.__holdoff = min(self.__holdoff * 2, CAT_PIPELINE_HOLDOFF_MAX)
+			elif len(pending) == 0:
+				self.__holdoff = CAT_PIPELINE_HOLDOFF
+			for e in pending:
+				e[2].timeouts.inc()
+				e[2].rtt.backoff()
+			# Whatever is left goes again on its own, unanswered
+			# ones may be answered yet
+			for e, resent in [(e, False) for e in refused] + [(e, True) for e in pending]:
+				self.__drain()
+				self.__quiet()
+				t_sent = self.__send(e[3])
+				data, t_response = self.__exchange(e[0], e[3], e[2], t_sent, resent)
+				self.__deliver(e[0], e[1], e[2], data, t_response)
+		except Exception as ex:
+			# The caller of the first read hears from run()
+			for e in more:
+				if e[1] != None and not e[1].done():
+					e[1].set_exception(ex)
+			raise
+	
+	#-----------------------------------------------
+	def __pipeline_window(self):
+		""" Reads that may be in flight at once now """
+		
+		if self.__window < self.__command_set.pipeline and monotonic() >= self.__window_back:
+			# Try again, the rig may only have been busy
+			self.__window = self.__command_set.pipeline
+		return self.__window
+	
+	#-----------------------------------------------
+	def __match(self, pending, frame):
+		""" The read in pending this data frame replies to, or None """
+		
+		for e in pending:
+			key = e[5]
+			if frame[civ.CMD:civ.CMD + len(key)] == key:
+				return e
+		return None
+	
+	#-----------------------------------------------
+	def __read_timeout(self, timeout):
+		""" Set the port read timeout, return it """
+		
+		# Whole milliseconds so the port is not reconfigured for every sample
+		timeout = ceil(timeout * 1000.0) / 1000.0
+		if timeout != self.__timeout:
+			self.__device.timeout = timeout
+			self.__timeout = timeout
+		return timeout
+	
+	#-----------------------------------------------
+	def __drain(self):
+		""" Discard unsolicited bytes without blocking """
+		
+		n = self.__device.in_waiting
+		if n > 0:
+			data = self.__device.read(n)
+			if self.__framer != None:
+				self.__framer.feed(data)
+		if self.__framer != None:
+			# Complete frames are stale unless unsolicited,
+			# a partial frame may be the start of a reply
+			while True:
+				f = self.__framer.next_frame()
+				if f == None:
+					break
+				if not self.__accounted(f[0], f[1]):
+					self.__unsolicited(f[0], f[1])
+	
+	#-----------------------------------------------
+	def __listen(self):
+		""" Pick up unsolicited frames while idle, without blocking """
+		
+		self.__drain()
+	
+	#-----------------------------------------------
+	def __unsolicited(self, kind, frame):
+		"""
+		Pass a CI-V transceive frame to the callback
+		
+		Arguments:
+			kind	--	frame kind from the framer
+			frame	--	the frame
+		"""
+		
+		if kind == civ.FRAME_TRANSCEIVE and self.__callback != None:
+			response = self.__cat_cls_inst.decode_transceive(frame)
+			if response != None and response[0]:
+				if self.__state != None:
+					self.__state.confirm(response)
+				self.__callback(response)
+	
+	#-----------------------------------------------
+	def __read_civ_reply(self, key, deadline):
+		"""
+		Return the NG or data frame that answers a read
+		Echoes, frames owed, see __accounted(), and other bus
+		traffic are skipped. Returns an empty buffer on timeout.
+		
+		Arguments:
+			key			--	command and sub-command the reply starts with
+			deadline	--	monotonic time to give up
+		"""
+		
+		while True:
+			f = self.__next_frame(deadline)
+			if f == None:
+				return b''
+			kind, frame = f
+			if kind == civ.FRAME_NG or (kind == civ.FRAME_DATA and frame[civ.CMD:civ.CMD + len(key)] == key):
+				return frame
+			self.__unsolicited(kind, frame)
 		
 """
 
@@ -370,6 +1145,10 @@ class YAESU:
 	Commands are 5 bytes, 4 parameter bytes followed by a command byte.
 	Note this class only formats commands, it does not execute them.
 	
+	Frames are built once. Fixed frames are bytes, a frequency set is
+	written into a buffer owned by this instance so a returned frame is
+	only valid until the next call to format_cat_cmd().
+	
 	"""
 	
 	def __init__(self, command_set):
@@ -377,26 +1156,38 @@ class YAESU:
 		Constructor
 		
 		Arguments:
-			command_set	--	command set for the FT-817ND
+			command_set	--	compiled command set for the FT-817ND
 			
 		"""
 		
 		self.__command_set = command_set
 		
-		# Create the dispatch table
-		commands = command_set[COMMANDS]
-		self.__dispatch = {
-			REFERENCE: CAT_COMMAND_SETS[FT817ND],
-			MAP: {
-				CAT_LOCK: [self.__lock, False],
-				CAT_PTT_SET: [self.__ptt_set, False],
-				CAT_PTT_GET: [self.__tx_status, True],
-				CAT_FREQ_SET: [self.__freq_set, False],
-				CAT_MODE_SET: [self.__mode_set, False],
-				CAT_FREQ_GET: [self.__freq_mode_get, True],
-				CAT_MODE_GET: [self.__freq_mode_get, True],
-			}
-		}
+		# Fixed frames
+		commands = command_set.commands
+		self.__lock_on = self.__frame(commands[LOCK_ON])
+		self.__lock_off = self.__frame(commands[LOCK_OFF])
+		self.__ptt_on = self.__frame(commands[PTT_ON])
+		self.__ptt_off = self.__frame(commands[PTT_OFF])
+		self.__tx_status_frame = self.__frame(commands[TX_STATUS])
+		self.__freq_mode_get_frame = self.__frame(commands[FREQ_MODE_GET])
+		self.__mode_frames = {mode: self.__frame(commands[SET_MODE], mode_id) for mode, mode_id in command_set.modes.items()}
+		self.__mode_names = command_set.mode_names
+		# Frequency set, the parameter bytes are rewritten in place
+		self.__freq_buf = bytearray(self.__frame(commands[SET_FREQ]))
+		self.__freq_data = memoryview(self.__freq_buf)[0:4]
+		
+		# Create the dispatch table, indexed by opcode
+		# (formatter, response expected, response bytes)
+		read_sz = command_set.read_sz
+		self.__dispatch = dispatch_table({
+			CAT_LOCK: (self.__lock, False, 0),
+			CAT_PTT_SET: (self.__ptt_set, False, 0),
+			CAT_PTT_GET: (self.__tx_status, True, 1),
+			CAT_FREQ_SET: (self.__freq_set, False, 0),
+			CAT_MODE_SET: (self.__mode_set, False, 0),
+			CAT_FREQ_GET: (self.__freq_mode_get, True, read_sz),
+			CAT_MODE_GET: (self.__freq_mode_get, True, read_sz),
+		})
 		
 		self.mode_to_id = {
 			'LSB': 0,
@@ -448,13 +1239,14 @@ class YAESU:
 			
 		"""
 		
-		if not cat_cmd in self.__dispatch[MAP]:
+		entry = self.__dispatch[CAT_OPCODES.get(cat_cmd, NO_OPCODE)]
+		if entry == None:
 			return False, None
 		
 		# Format command
-		return self.__dispatch[MAP][cat_cmd][0](self.__dispatch[REFERENCE], param)
+		return entry[0](param)
 	
-	def decode_cat_resp(self, lookup, cat_cmd, data):
+	def decode_cat_resp(self, cat_cmd, data):
 		"""
 		Decode and return a tuple according to command type
 		
@@ -465,27 +1257,13 @@ class YAESU:
 		"""
 		 
 		if cat_cmd == CAT_FREQ_GET:
-			# Data 0-3 is freq MSB first
+			# Data 0-3 is freq MSB first in 10Hz units
 			# 01, 42, 34, 56, [ 01 ] = 14.23456 MHz
-			MHz_100 = ((data[0] & 0xF0) >> 4) * 100000000
-			MHz_10 = (data[0] & 0x0F) * 10000000
-			MHz_1 = ((data[1] & 0xF0) >> 4) * 1000000
-			KHz_100 = (data[1] & 0x0F) * 100000
-			KHz_10 = ((data[2] & 0xF0) >> 4) * 10000
-			KHz_1 = (data[2] & 0x0F) * 1000
-			Hz_100 = ((data[3] & 0xF0) >> 4) * 100
-			Hz_10 = (data[3] & 0x0F) * 10
-			Hz = MHz_100 + MHz_10 + MHz_1 + KHz_100 + KHz_10 + KHz_1 + Hz_100 + Hz_10
+			Hz = bcd.decode_msb4(data, 0) * 10
 			return True, CAT_FREQ_GET, Hz
 		elif cat_cmd == CAT_MODE_GET:
 			# Data 4 is mode
-			mode_id = data[4]
-			mode_str = ''
-			for key, value in lookup[MODES].items():
-				if value == mode_id:
-					mode_str = key
-					break
-			return True, CAT_MODE_GET, mode_str
+			return True, CAT_MODE_GET, self.__mode_names.get(data[4], '')
 		elif cat_cmd == CAT_PTT_GET:
 			# Bit 7 is PTT
 			# It appears to be upside down?
@@ -499,7 +1277,7 @@ class YAESU:
 		else:
 			return False, cat_cmd, None
 	
-	def ack_nak(self, lookup, data):
+	def ack_nak(self, data):
 		"""
 		Decode and return any ack/nak response
 		
@@ -513,88 +1291,91 @@ class YAESU:
 		
 	def is_response(self, cmd):
 		"""
-		True if a response is required
+		True if a response is required, False if not or not supported
+		
+		Arguments:
+			cmd	--	command to test
+		"""
+		
+		entry = self.__dispatch[CAT_OPCODES.get(cmd, NO_OPCODE)]
+		if entry == None:
+			return False
+		return entry[1]
+	
+	def response_size(self, cmd):
+		"""
+		Number of bytes in the response, 0 if not supported
 		
 		Arguments:
 			cmd	--	command to test
 		"""
 		
-		return self.__dispatch[MAP][cmd][1]
+		entry = self.__dispatch[CAT_OPCODES.get(cmd, NO_OPCODE)]
+		if entry == None:
+			return 0
+		return entry[2]
 	
-	def __lock(self, lookup, state):
+	def __lock(self, state):
 		"""
 		Toggle Lock on/off
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			state	--	True if Lock on
 			
 		"""
 		
 		if state:
-			lock = lookup[COMMANDS][LOCK_ON]
-		else:
-			lock = lookup[COMMANDS][LOCK_OFF]
-		return True, bytearray([0x00, 0x00, 0x00, 0x00, lock])
+			return True, self.__lock_on
+		return True, self.__lock_off
 
-	def __ptt_set(self, lookup, state):
+	def __ptt_set(self, state):
 		"""
 		Toggle PTT on/off
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			state	--	True if PTT on
 			
 		"""
 		
 		if state:
-			ptt = lookup[COMMANDS][PTT_ON]
-		else:
-			ptt = lookup[COMMANDS][PTT_OFF]
-		return True, bytearray([0x00, 0x00, 0x00, 0x00, ptt])
+			return True, self.__ptt_on
+		return True, self.__ptt_off
 	
-	def __tx_status(self, lookup, dummy):
+	def __tx_status(self, dummy):
 		"""
 		Get TX status
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			
 		"""
 		
-		return True, bytearray([0x00, 0x00, 0x00, 0x00, lookup[COMMANDS][TX_STATUS]])
+		return True, self.__tx_status_frame
 	
-	def __mode_set(self, lookup, mode):
+	def __mode_set(self, mode):
 		"""
 		Change mode
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			mode	--	Mode to set
 			
 		"""
-		mode = mode.lower()
-		return True, bytearray([lookup[MODES][mode], 0x00, 0x00, 0x00, lookup[COMMANDS][SET_MODE]])
+		return True, self.__mode_frames[mode.lower()]
 		
-	def __freq_set(self, lookup, freq):
+	def __freq_set(self, freq):
 		"""
 		Change frequency
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			freq	--	Frequency in Hz
 			
 		"""
 		
 		# Frequency is in Hz
-		# Resolution is 10Hz so 8 digits
-		fs = str(int(int(freq)/10))
-		fs = fs.zfill(8)
-		# fs is an 8 digit string with leading zeros
-		b=bytearray.fromhex(fs)
-		return True, bytearray([b[0], b[1], b[2], b[3], lookup[COMMANDS][SET_FREQ]])
+		# Resolution is 10Hz so 8 digits MSB first
+		bcd.encode_msb4_into(self.__freq_data, 0, int(freq)//10)
+		return True, self.__freq_buf
 		
-	def __freq_mode_get(self, lookup, dummy):
+	def __freq_mode_get(self, dummy):
 		"""
 		Get the frequency and mode
 		
@@ -602,7 +1383,19 @@ class YAESU:
 			
 		"""
 		
-		return True, bytearray([0x00, 0x00, 0x00, 0x00, lookup[COMMANDS][FREQ_MODE_GET]])
+		return True, self.__freq_mode_get_frame
+	
+	def __frame(self, cmd, p1 = 0x00):
+		"""
+		Return a fixed frame
+		
+		Arguments:
+			cmd	--	command byte
+			p1	--	first parameter byte
+			
+		"""
+		
+		return bytes([p1, 0x00, 0x00, 0x00, cmd])
 	
 """
 
@@ -646,7 +1439,14 @@ class ICOM:
 	------------------------
 	
 	FEFE | E0 | 88 | FA | FD	(see above)
-	
+
+	A data reply starts with the command and sub-command it answers, so
+	up to PIPELINE reads may be in flight and the replies matched to
+	them. OK and NG carry no command so sets are one at a time.
+
+	Frames are built once. Fixed frames are bytes, a frequency set is
+	written into a buffer owned by this instance so a returned frame is
+	only valid until the next call to format_cat_cmd().
 	
 	"""
 	
@@ -655,25 +1455,46 @@ class ICOM:
 		Constructor
 		
 		Arguments:
-			command_set	--	command set for the FT-817ND
+			command_set	--	compiled command set for the IC7100
 			
 		"""
 		
 		self.__command_set = command_set
 		
-		# Create the dispatch table
-		commands = command_set[COMMANDS]
-		self.__dispatch = {
-			REFERENCE: CAT_COMMAND_SETS[IC7100],
-			MAP: {
-				CAT_LOCK: [self.__lock, False],
-				CAT_PTT: [self.__ptt, False],
-				CAT_FREQ_SET: [self.__freq_set, False],
-				CAT_MODE_SET: [self.__mode_set, False],
-				CAT_FREQ_GET: [self.__freq_get, True],
-				CAT_MODE_GET: [self.__mode_get, True]
-			}
-		}
+		# Command bytes
+		self.__commands = command_set.commands
+		self.__modes = command_set.modes
+		self.__mode_names = command_set.mode_names
+		self.__nak = command_set.responses[NAK]
+		self.__ack = command_set.responses[ACK]
+		self.__transceive_freq = self.__commands[TRANSCEIVE_FREQ_CMD][0]
+		self.__transceive_mode = self.__commands[TRANSCEIVE_MODE_CMD][0]
+		
+		# Fixed frames
+		commands = self.__commands
+		self.__lock_on = self.__frame(commands[LOCK_CMD], commands[LOCK_SUB], commands[LOCK_ON])
+		self.__lock_off = self.__frame(commands[LOCK_CMD], commands[LOCK_SUB], commands[LOCK_OFF])
+		self.__ptt_on = self.__frame(commands[TRANCEIVE_STATUS_CMD], commands[TRANCEIVE_STATUS_SUB], commands[PTT_ON])
+		self.__ptt_off = self.__frame(commands[TRANCEIVE_STATUS_CMD], commands[TRANCEIVE_STATUS_SUB], commands[PTT_OFF])
+		self.__freq_get_frame = self.__frame(commands[GET_FREQ_CMD], commands[GET_FREQ_SUB], b'')
+		self.__mode_get_frame = self.__frame(commands[GET_MODE_CMD], commands[GET_MODE_SUB], b'')
+		self.__mode_frames = {mode: self.__frame(commands[SET_MODE_CMD], commands[SET_MODE_SUB], data) for mode, data in self.__modes.items()}
+		# Frequency set, the 5 data bytes are rewritten in place
+		self.__freq_buf = bytearray(self.__frame(commands[SET_FREQ_CMD], commands[SET_FREQ_SUB], bytes(5)))
+		freq_start = len(self.__freq_buf) - 6
+		self.__freq_data = memoryview(self.__freq_buf)[freq_start:freq_start + 5]
+		
+		# Create the dispatch table, indexed by opcode
+		# (formatter, response expected, response bytes)
+		# Responses are framed so have no fixed size
+		self.__dispatch = dispatch_table({
+			CAT_LOCK: (self.__lock, False, None),
+			CAT_PTT: (self.__ptt, False, None),
+			CAT_FREQ_SET: (self.__freq_set, False, None),
+			CAT_MODE_SET: (self.__mode_set, False, None),
+			CAT_FREQ_GET: (self.__freq_get, True, None),
+			CAT_MODE_GET: (self.__mode_get, True, None)
+		})
 		
 	def format_cat_cmd(self, cat_cmd, param):
 		"""
@@ -685,13 +1506,14 @@ class ICOM:
 			
 		"""
 		
-		if not cat_cmd in self.__dispatch[MAP]:
+		entry = self.__dispatch[CAT_OPCODES.get(cat_cmd, NO_OPCODE)]
+		if entry == None:
 			return False, None
 		
 		# Format command
-		return self.__dispatch[MAP][cat_cmd][0](self.__dispatch[REFERENCE], param)
+		return entry[0](param)
 	
-	def decode_cat_resp(self, lookup, cat_cmd, data):
+	def decode_cat_resp(self, cat_cmd, data):
 		"""
 		Decode and return a tuple according to command type
 		
@@ -701,12 +1523,12 @@ class ICOM:
 			
 		"""
 		
-		# Data consists of an OK or NG message followed by the response if OK
+		# Data is the reply frame from the rig, either NG or the response
+		# FEFE | E0 | 88 | Cn | DataArea | FD
 		RESPONSE_CODE = 4
-		DATA_START = 11
-		DATA_END = 15
-		if data[RESPONSE_CODE] == lookup[RESPONSES][NAK]:
-			return False, None
+		DATA_START = 5
+		if data[RESPONSE_CODE] == self.__nak:
+			return False, cat_cmd, None
 		if cat_cmd == CAT_FREQ_GET:
 			# The data is in BCD format in 10 fields (0-9) - 5 bytes
 			# Byte 	Nibble 	Digit
@@ -721,33 +1543,38 @@ class ICOM:
 			# 4		0		100MHz
 			# 4		1		1000MHz (always zero)
 			
-			MHz_1000 = ((data[DATA_END - 0] & 0xF0) >> 4) * 1000000000
-			MHz_100 = (data[DATA_END - 0] & 0x0F) * 100000000
-			MHz_10 = ((data[DATA_END - 1] & 0xF0) >> 4) * 10000000
-			MHz_1 = (data[DATA_END - 1] & 0x0F) * 1000000
-			KHz_100 = ((data[DATA_END - 2] & 0xF0) >> 4) * 100000
-			KHz_10 = (data[DATA_END - 2] & 0x0F) * 10000
-			KHz_1 = ((data[DATA_END - 3] & 0xF0) >> 4) * 1000
-			Hz_100 = (data[DATA_END - 3] & 0x0F) * 100
-			Hz_10 = ((data[DATA_END - 4] & 0x0F) >> 4) * 10
-			Hz_1 = data[DATA_END - 4] & 0xF0
-			Hz = MHz_1000 + MHz_100 + MHz_10 + MHz_1 + KHz_100 + KHz_10 + KHz_1 + Hz_100 + Hz_10 + Hz_1
-			return True, Hz
+			Hz = bcd.decode_lsb5(data, DATA_START)
+			return True, CAT_FREQ_GET, Hz
 		elif cat_cmd == CAT_MODE_GET:
 			# Data byte 0 - mode
 			# Data byte 1 - filter
-			mode_id = data[DATA_START]
-			mode_str = ''
-			for key, value in lookup[MODES].items():
-				if value == mode_id:
-					mode_str = key
-					break
-			return True, mode_str
+			return True, CAT_MODE_GET, self.__mode_names.get(data[DATA_START], '')
 		else:
 			# Not expecting anything else
-			return False, None
+			return False, cat_cmd, None
 
-	def ack_nak(self, lookup, data):
+	def decode_transceive(self, frame):
+		"""
+		Decode an unsolicited CI-V transceive frame
+		
+		With CI-V Transceive ON in the rig menu the rig broadcasts (to
+		address 00) a frequency (Cn 00) or mode (Cn 01) frame whenever
+		they change at the rig. The data areas are the same as the replies
+		to read frequency (Cn 03) and read mode (Cn 04).
+		
+		Arguments:
+			frame	--	the transceive frame
+			
+		"""
+		
+		cn = frame[4]
+		if cn == self.__transceive_freq:
+			return self.decode_cat_resp(CAT_FREQ_GET, frame)
+		elif cn == self.__transceive_mode:
+			return self.decode_cat_resp(CAT_MODE_GET, frame)
+		return None
+	
+	def ack_nak(self, data):
 		"""
 		Decode and return any ack/nak response
 		
@@ -758,7 +1585,7 @@ class ICOM:
 		
 		if len(data) > 0:
 			if len(data) == 6:
-				if data[4] == lookup[RESPONSES][ACK]:
+				if data[4] == self.__ack:
 					return True, None
 				else:
 					return False, None
@@ -770,83 +1597,78 @@ class ICOM:
 		
 	def is_response(self, cmd):
 		"""
-		True if a response is required
+		True if a response is required, False if not or not supported
+		
+		Arguments:
+			cmd	--	command to test
+		"""
+		
+		entry = self.__dispatch[CAT_OPCODES.get(cmd, NO_OPCODE)]
+		if entry == None:
+			return False
+		return entry[1]
+	
+	def response_size(self, cmd):
+		"""
+		Number of bytes in the response, None as responses are framed,
+		0 if not supported
 		
 		Arguments:
 			cmd	--	command to test
 		"""
 		
-		return self.__dispatch[MAP][cmd][1]
+		entry = self.__dispatch[CAT_OPCODES.get(cmd, NO_OPCODE)]
+		if entry == None:
+			return 0
+		return entry[2]
 	
-	def __lock(self, lookup, state):
+	def __lock(self, state):
 		"""
 		Toggle Lock on/off
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			state	--	True if Lock on
 			
 		"""
 		
-		cmd = lookup[COMMANDS][LOCK_CMD]
-		sub_cmd = lookup[COMMANDS][LOCK_SUB]
 		if state:
-			# Set lock on
-			data = lookup[COMMANDS][LOCK_ON]
-		else:
-			data = lookup[COMMANDS][LOCK_OFF]
-			
-		return self.__complete_build(cmd, sub_cmd, data)
+			return True, self.__lock_on
+		return True, self.__lock_off
 		
-	def __ptt(self, lookup, state):
+	def __ptt(self, state):
 		"""
 		Toggle PTT on/off
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			state	--	True if PTT on
 			
 		"""
 		
-		cmd = lookup[COMMANDS][TRANCEIVE_STATUS_CMD]
-		sub_cmd = lookup[COMMANDS][TRANCEIVE_STATUS_SUB]
 		if state:
-			# Set PTT on
-			data = lookup[COMMANDS][PTT_ON]
-		else:
-			data = lookup[COMMANDS][PTT_OFF]
-			
-		return self.__complete_build(cmd, sub_cmd, data)
+			return True, self.__ptt_on
+		return True, self.__ptt_off
 	
-	def __mode_set(self, lookup, mode):
+	def __mode_set(self, mode):
 		"""
 		Change mode
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			mode	--	Mode to set
 			
 		"""
 		
-		cmd = lookup[COMMANDS][SET_MODE_CMD]
-		sub_cmd = lookup[COMMANDS][SET_MODE_SUB]
-		data = lookup[MODES][mode]
+		return True, self.__mode_frames[mode]
 		
-		return self.__complete_build(cmd, sub_cmd, data)
-		
-	def __freq_set(self, lookup, freq):
+	def __freq_set(self, freq):
 		"""
 		Change frequency
 		
 		Arguments:
-			lookup	--	ref to the command lookup
-			freq	--	Frequency in MHz
+			freq	--	Frequency in Hz
 			
 		"""
 		
-		cmd = lookup[COMMANDS][SET_FREQ_CMD]
-		sub_cmd = lookup[COMMANDS][SET_FREQ_SUB]			
-		# Frequency is a float in MHz like 14.100000
+		# Frequency is in Hz
 		# The data is required in BCD format in 10 fields (0-9) - 5 bytes
 		# Byte 	Nibble 	Digit
 		# 0		0		1Hz
@@ -859,60 +1681,34 @@ class ICOM:
 		# 3		1		10MHZ
 		# 4		0		100MHz
 		# 4		1		1000MHz (always zero)
+		bcd.encode_lsb5_into(self.__freq_data, 0, int(freq))
+		return True, self.__freq_buf
 		
-		# Make a string of the frequency in Hz
-		fs = str(int(freq*1000000))
-		fs = fs.zfill(10)
-		# Make an array to store the result
-		data = bytearray(5)
-		# Iterate through the string
-		byte = 4
-		nibble = 0
-		for c in fs:
-			if nibble == 0:
-				data[byte] = ((data[byte] | int(c)) << 4) & 0xF0
-				nibble = 1
-			else:
-				data[byte] = data[byte] | (int(c) & 0x0F)
-				nibble = 0
-				byte -= 1
-		return self.__complete_build(cmd, sub_cmd, data)
-		
-	def __freq_get(self, lookup, dummy):
+	def __freq_get(self, dummy):
 		"""
 		Get the current frequency
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			dummy	--	
 			
 		"""
 		
-		cmd = lookup[COMMANDS][GET_FREQ_CMD]
-		sub_cmd = lookup[COMMANDS][GET_FREQ_SUB]
-		data = bytearray([])
-		
-		return self.__complete_build(cmd, sub_cmd, data)
+		return True, self.__freq_get_frame
 	
-	def __mode_get(self, lookup, dummy):
+	def __mode_get(self, dummy):
 		"""
 		Get the current mode
 		
 		Arguments:
-			lookup	--	ref to the command lookup
 			dummy	--	
 			
 		"""
 		
-		cmd = lookup[COMMANDS][GET_MODE_CMD]
-		sub_cmd = lookup[COMMANDS][GET_MODE_SUB]
-		data = bytearray([])
-		
-		return self.__complete_build(cmd, sub_cmd, data)
+		return True, self.__mode_get_frame
 	
-	def __complete_build(self, cmd, sub_cmd, data):
+	def __frame(self, cmd, sub_cmd, data):
 		"""
-		Finish building command
+		Return a complete frame
 		
 		Arguments:
 			cmd			--	command field
@@ -921,26 +1717,89 @@ class ICOM:
 			
 		"""
 		
-		# Do header
-		b = bytearray([0xFE, 0xFE, 0x88, 0xE0])
-		# Add the byte arrays for the data
-		b += cmd[:]
-		b += sub_cmd[:]
-		b += data[:]
-		b += bytearray([0xFD, ])
-			
-		return True, b
+		return b''.join((b'\xFE\xFE\x88\xE0', cmd, sub_cmd, data, b'\xFD'))
 				
+# ============================================================================
+# Command set compilation
+
+# A command set as used on the hot path. Immutable and slotted, byte
+# strings are bytes and modes have a reverse index.
+CompiledCommandSet = namedtuple('CompiledCommandSet', (
+	'rig', 'rig_class', 'resolution',
+	'parity', 'stop_bits', 'timeout', 'read_sz', 'guard', 'burst', 'pipeline', 'listen_poll',
+	'commands', 'modes', 'mode_names', 'responses'))
+
+def compile_command_set(rig, command_set):
+	"""
+	Return the CompiledCommandSet for a command set
+	
+	Arguments:
+		rig			--	rig type
+		command_set	--	entry from CAT_COMMAND_SETS
+		
+	"""
+	
+	def freeze(value):
+		if isinstance(value, bytearray):
+			return bytes(value)
+		return value
+	
+	serial_params = command_set[SERIAL]
+	commands = {key: freeze(value) for key, value in command_set[COMMANDS].items()}
+	modes = {key: freeze(value) for key, value in command_set[MODES].items()}
+	# Mode id as it appears in a response to mode name
+	mode_names = {}
+	for name, mode_id in modes.items():
+		if isinstance(mode_id, bytes):
+			mode_id = mode_id[0]
+		mode_names[mode_id] = name
+	return CompiledCommandSet(
+		rig = rig,
+		rig_class = command_set[CLASS],
+		resolution = command_set[RESOLUTION],
+		parity = serial_params[PARITY],
+		stop_bits = serial_params[STOP_BITS],
+		timeout = serial_params[TIMEOUT],
+		read_sz = serial_params[READ_SZ],
+		guard = serial_params[GUARD_TIME],
+		burst = serial_params[BURST],
+		pipeline = serial_params[PIPELINE],
+		listen_poll = serial_params[LISTEN_POLL],
+		commands = MappingProxyType(commands),
+		modes = MappingProxyType(modes),
+		mode_names = MappingProxyType(mode_names),
+		responses = MappingProxyType(dict(command_set.get(RESPONSES, {}))))
+
+def dispatch_table(entries):
+	"""
+	Return a dispatch tuple indexed by opcode
+	
+	Arguments:
+		entries	--	dict of CAT command to entry
+		
+	"""
+	
+	# One extra slot so NO_OPCODE is always empty
+	table = [None] * (NO_OPCODE + 1)
+	for cat_cmd, entry in entries.items():
+		table[CAT_OPCODES[cat_cmd]] = entry
+	return tuple(table)
+
 # ============================================================================
 # Command sets
 CAT_COMMAND_SETS = {
 	FT817ND: {
 		CLASS: YAESU,
+		RESOLUTION: 10,
 		SERIAL: {
 			PARITY: serial.PARITY_NONE,
 			STOP_BITS: serial.STOPBITS_ONE,
 			TIMEOUT: 2,
-			READ_SZ: 5
+			READ_SZ: 5,
+			GUARD_TIME: 0.005,
+			BURST: 5,
+			PIPELINE: 1,
+			LISTEN_POLL: None
 		},
 		COMMANDS: {
 			LOCK_ON: 0x00,
@@ -965,11 +1824,16 @@ CAT_COMMAND_SETS = {
 	},
 	IC7100: {
 		CLASS: ICOM,
+		RESOLUTION: 1,
 		SERIAL: {
 			PARITY: serial.PARITY_NONE,
 			STOP_BITS: serial.STOPBITS_ONE,
 			TIMEOUT: 5,
-			READ_SZ: 17
+			READ_SZ: 17,
+			GUARD_TIME: 0.0,
+			BURST: 32,
+			PIPELINE: 3,
+			LISTEN_POLL: 0.02
 		},
 		COMMANDS: {
 			LOCK_CMD: bytearray([0x1A, ]),
@@ -987,7 +1851,9 @@ CAT_COMMAND_SETS = {
 			GET_FREQ_CMD: bytearray([0x03, ]),
 			GET_FREQ_SUB: bytearray([]),
 			GET_MODE_CMD: bytearray([0x04, ]),
-			GET_MODE_SUB: bytearray([])
+			GET_MODE_SUB: bytearray([]),
+			TRANSCEIVE_FREQ_CMD: bytearray([0x00, ]),
+			TRANSCEIVE_MODE_CMD: bytearray([0x01, ])
 		},
 		RESPONSES: {
 			ACK: 0xFB,
@@ -1007,3 +1873,6 @@ CAT_COMMAND_SETS = {
 		}
 	}
 }
+
+# Compiled once at load
+COMPILED_COMMAND_SETS = {rig: compile_command_set(rig, command_set) for rig, command_set in CAT_COMMAND_SETS.items()}
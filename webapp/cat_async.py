@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+#
+# cat_async.py
+#
+# asyncio CAT engine for FT817 and IC7100
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import asyncio
+import queue
+import traceback
+from collections import deque
+
+# Application imports
+from defs import *
+import serial
+import scheduler
+import civ
+import shaper
+import rtt
+from cat import COMPILED_COMMAND_SETS, ICOM
+
+"""
+
+An alternative to CAT/CATThrd for applications that run an asyncio loop.
+
+There is no thread per rig. The serial port is opened non-blocking and its
+file descriptor is watched by the event loop, so reads never block and many
+rigs and clients can share one loop. Commands go through the same scheduler
+and the same YAESU/ICOM formatters and decoders as the threaded engine.
+
+POSIX only, the Windows proactor loop cannot watch a serial handle.
+
+Usage:
+	rig = AsyncCAT(FT817ND, '/dev/ttyUSB0', 9600)
+	await rig.open()
+	await rig.do_command(CAT_FREQ_SET, 14100000)
+	response = await rig.query(CAT_FREQ_GET)
+	await rig.close()
+"""
+
+#======================================================================================
+# asyncio CAT engine for all rigs
+class AsyncCAT:
+
+	def __init__(self, rig, com, baud):
+		"""
+		Constructor
+
+		Arguments
+			rig		--  currently only FT817ND or IC7100
+			com		--  COM port to which rig is connected
+			baud	--	baud rate rig is set to
+		"""
+
+		self.__rig = rig
+		self.__com = com
+		self.__baud = baud
+
+		# Get our command set
+		if rig not in COMPILED_COMMAND_SETS:
+			raise LookupError
+		else:
+			self.__command_set = COMPILED_COMMAND_SETS[rig]
+
+		# Instance vars
+		self.__cat_cls_inst = self.__command_set.rig_class(self.__command_set)
+		self.__q = scheduler.CommandScheduler()
+		self.__shaper = shaper.for_command_set(self.__command_set, baud)
+		# Round trip estimator by command, see rtt.py
+		self.__rtt = {}
+		self.__device = None
+		self.__fd = None
+		self.__loop = None
+		self.__task = None
+		self.__wakeup = None
+		self.__failed = False
+		# Received bytes and the reader waiting on them
+		self.__rx = bytearray()
+		self.__rx_waiter = None
+		self.__rx_done = None
+		# CI-V replies are picked out of the byte stream
+		if self.__command_set.rig_class == ICOM:
+			self.__framer = civ.CIVFramer()
+		else:
+			self.__framer = None
+		self.__reply = None
+		self.__reply_key = None
+		# Sets and resent reads still owed a response, as CATThrd
+		self.__owed_sets = deque()
+		self.__late = []
+
+	#======================================================================================
+	# PUBLIC interface
+	async def open(self):
+		""" Open the port and start the engine, False if the port cannot be opened """
+
+		if sys.platform.startswith('win'):
+			raise RuntimeError('AsyncCAT needs a POSIX event loop, use CAT on Windows')
+		try:
+			self.__device = serial.Serial(port=self.__com, baudrate=self.__baud, parity=self.__command_set.parity, stopbits=self.__command_set.stop_bits, timeout=0, exclusive=True)
+		except (OSError, serial.SerialException):
+			print('Failed to open COM port %s for CAT!' % self.__com)
+			return False
+		print("Opened port %s" % self.__com)
+		self.__fd = self.__device.fileno()
+		os.set_blocking(self.__fd, False)
+		self.__loop = asyncio.get_running_loop()
+		self.__wakeup = asyncio.Event()
+		self.__loop.add_reader(self.__fd, self.__on_readable)
+		self.__task = self.__loop.create_task(self.__run())
+		return True
+
+	#-----------------------------------------------
+	async def close(self):
+		""" Stop the engine and close the port """
+
+		if self.__task != None:
+			self.__task.cancel()
+			try:
+				await self.__task
+			except asyncio.CancelledError:
+				pass
+			self.__task = None
+		for cmd, param, future, queued in self.__q.flush():
+			if future != None:
+				future.cancel()
+		if self.__fd != None:
+			if not self.__failed:
+				self.__loop.remove_reader(self.__fd)
+			self.__fd = None
+		if self.__device != None:
+			self.__device.close()
+			self.__device = None
+
+	#-----------------------------------------------
+	async def do_command(self, cat_cmd, params = None):
+		"""
+		Schedule a CAT command, returns without waiting for the rig
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	required parameters for the command
+
+		"""
+
+		self.__schedule(cat_cmd, params, None)
+
+	#-----------------------------------------------
+	async def query(self, cat_cmd, params = None, timeout = None):
+		"""
+		Execute a CAT command and return its decoded response
+
+		Raises TimeoutError if the rig does not answer within timeout
+		(default the command set timeout) and IOError if not open.
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	required parameters for the command
+			timeout	--	max seconds to wait for the response
+
+		"""
+
+		if self.__task == None or self.__failed:
+			raise IOError('CAT port %s is not open' % self.__com)
+		if timeout == None:
+			timeout = self.__command_set.timeout
+		future = self.__loop.create_future()
+		self.__schedule(cat_cmd, params, future)
+		try:
+			return await asyncio.wait_for(future, timeout)
+		except asyncio.TimeoutError:
+			raise TimeoutError('No response to %s from %s' % (cat_cmd, self.__rig))
+
+	#-----------------------------------------------
+	def mode_for_id(self, mode_id):
+		""" Return mode string for a mode id """
+
+		return self.__cat_cls_inst.mode_for_id(mode_id)
+
+	#-----------------------------------------------
+	def id_for_mode(self, mode):
+		""" Return mode id for a mode string """
+
+		return self.__cat_cls_inst.id_for_mode(mode)
+
+	#-----------------------------------------------
+	def bandwidth_for_mode(self, mode):
+		""" Return bandwidth for a given mode string """
+
+		return self.__cat_cls_inst.bandwidth_for_mode(mode)
+
+	#-----------------------------------------------
+	def failed(self):
+		""" True if the engine stopped because the port failed """
+
+		return self.__failed
+
+	#======================================================================================
+	# PRIVATE interface
+	def __schedule(self, cat_cmd, params, future):
+		""" Add to the scheduler and wake the engine """
+
+		if self.__task == None or self.__failed:
+			# Same as CAT, commands are discarded when not open
+			return
+		self.__q.put(cat_cmd, params, future)
+		self.__wakeup.set()
+
+	#-----------------------------------------------
+	async def __run(self):
+		""" Engine task """
+
+		while not self.__failed:
+			try:
+				cmd, param, future, queued = self.__q.get(block = False)
+			except queue.Empty:
+				self.__wakeup.clear()
+				await self.__wakeup.wait()
+				continue
+			if future != None and future.done():
+				# The caller gave up before we got to it
+				continue
+			try:
+				(r, cmd_buf) = self.__cat_cls_inst.format_cat_cmd(cmd, param)
+				if not r:
+					if future != None:
+						future.set_exception(LookupError('Command %s not supported by %s' % (cmd, self.__rig)))
+					continue
+				is_read = self.__cat_cls_inst.is_response(cmd)
+				# Discard anything the rig sent since the last exchange
+				self.__discard()
+				await self.__quiet()
+				if is_read and self.__framer != None:
+					await self.__settle()
+				t_sent = await self.__send(cmd_buf)
+				if is_read:
+					if self.__framer != None:
+						self.__reply_key = bytes(cmd_buf[civ.CMD:-1])
+					data = await self.__exchange(cmd, cmd_buf, t_sent)
+					response = None
+					if len(data) > 0:
+						response = self.__cat_cls_inst.decode_cat_resp(cmd, data)
+					if future != None and not future.done():
+						if response != None:
+							future.set_result(response)
+						else:
+							future.set_exception(TimeoutError('No response to %s from %s' % (cmd, self.__rig)))
+				else:
+					if self.__framer != None:
+						self.__owed_sets.append((cmd, t_sent, len(self.__owed_sets) == 0))
+					if future != None and not future.done():
+						future.set_result(None)
+			except asyncio.CancelledError:
+				raise
+			except (OSError, serial.SerialException) as e:
+				# Port gone, usually the USB cable pulled or the rig off
+				print('CAT port for %s failed [%s]' % (self.__rig, str(e)))
+				if future != None and not future.done():
+					future.set_exception(IOError('CAT port for %s failed' % self.__rig))
+				self.__lost()
+			except Exception as e:
+				print("Error in CAT task [%s]" % traceback.format_exc())
+				if future != None and not future.done():
+					future.set_exception(e)
+		# Nobody will answer anything still waiting
+		for cmd, param, future, queued in self.__q.flush():
+			if future != None and not future.done():
+				future.set_exception(IOError('CAT port for %s failed' % self.__rig))
+
+	#-----------------------------------------------
+	async def __send(self, cmd_buf):
+		""" Write a frame when the link allows, return when it leaves the wire """
+
+		# Wait for room on the line and for the rig to be ready
+		delay = self.__shaper.reserve(len(cmd_buf))
+		if delay > 0:
+			await asyncio.sleep(delay)
+		await self.__write(cmd_buf)
+		# The loop clock is monotonic, as the shaper's
+		return max(self.__loop.time(), self.__shaper.wire_free())
+
+	#-----------------------------------------------
+	async def __exchange(self, cmd, cmd_buf, t_sent):
+		""" Return the response to a frame just written, resent as CAT does """
+
+		estimator = self.__estimator(cmd)
+		retries = CAT_RETRIES if estimator.srtt() != None else 0
+		tries = 0
+		while True:
+			try:
+				wait = t_sent + estimator.timeout() - self.__loop.time()
+				data = await asyncio.wait_for(self.__read_response(cmd), max(0.0, wait))
+				if tries == 0:
+					estimator.sample(self.__loop.time() - t_sent)
+				else:
+					# Earlier sends may be answered yet, see __quiet()
+					self.__late.append([cmd, self.__reply_key, tries, self.__loop.time() + estimator.timeout()])
+				return data
+			except asyncio.TimeoutError:
+				estimator.backoff()
+			if tries >= retries:
+				return b''
+			tries += 1
+			self.__discard()
+			t_sent = await self.__send(cmd_buf)
+
+	#-----------------------------------------------
+	async def __quiet(self):
+		""" Let late responses to earlier sends of resent reads go by, as CATThrd """
+
+		while len(self.__late) > 0:
+			late = self.__late[0]
+			cmd, key, owed, until = late
+			if self.__framer == None:
+				need = owed * self.__cat_cls_inst.response_size(cmd)
+				self.__rx_done = lambda: len(self.__rx) >= need
+				await self.__wait(until)
+				del self.__rx[:]
+				self.__late.pop(0)
+				continue
+			self.__rx_done = lambda: self.__pump() or late not in self.__late
+			if not await self.__wait(until) and late in self.__late:
+				self.__late.remove(late)
+
+	#-----------------------------------------------
+	async def __settle(self):
+		""" Wait for the OK or NG owed by each CI-V set written, as CATThrd """
+
+		while len(self.__owed_sets) > 0:
+			head = self.__owed_sets[0]
+			cmd, t_sent, clean = head
+			self.__rx_done = lambda: self.__pump() or len(self.__owed_sets) == 0 or self.__owed_sets[0] is not head
+			if not await self.__wait(t_sent + self.__estimator(cmd).timeout()) and len(self.__owed_sets) > 0 and self.__owed_sets[0] is head:
+				self.__estimator(cmd).backoff()
+				self.__owed_sets.popleft()
+
+	#-----------------------------------------------
+	async def __wait(self, until):
+		""" Wait for __rx_done() until the loop time given, False if it did not happen """
+
+		if self.__rx_done():
+			return True
+		self.__rx_waiter = self.__loop.create_future()
+		try:
+			await asyncio.wait_for(self.__rx_waiter, max(0.0, until - self.__loop.time()))
+			return True
+		except asyncio.TimeoutError:
+			return False
+		finally:
+			self.__rx_waiter = None
+
+	#-----------------------------------------------
+	def __pump(self):
+		""" Take complete CI-V frames, keeping account of those owed, False """
+
+		while True:
+			f = self.__framer.next_frame()
+			if f == None:
+				return False
+			self.__accounted(f[0], f[1])
+
+	#-----------------------------------------------
+	def __accounted(self, kind, frame):
+		""" True if a CI-V frame is a late response to a resent read or the OK or NG owed by a set """
+
+		for late in self.__late:
+			if kind == civ.FRAME_NG or (kind == civ.FRAME_DATA and frame[civ.CMD:civ.CMD + len(late[1])] == late[1]):
+				late[2] -= 1
+				if late[2] == 0:
+					self.__late.remove(late)
+				return True
+		if len(self.__owed_sets) == 0 or (kind != civ.FRAME_OK and kind != civ.FRAME_NG):
+			return False
+		cmd, t_sent, clean = self.__owed_sets.popleft()
+		# Only a set sent on a quiet line gives a round trip
+		if clean:
+			self.__estimator(cmd).sample(self.__loop.time() - t_sent)
+		return True
+
+	#-----------------------------------------------
+	def __estimator(self, cmd):
+		""" Round trip estimator for a command """
+
+		estimator = self.__rtt.get(cmd)
+		if estimator == None:
+			estimator = self.__rtt[cmd] = rtt.RttEstimator(self.__command_set.timeout)
+		return estimator
+
+	#-----------------------------------------------
+	async def __write(self, buf):
+		""" Write all of buf without blocking the loop """
+
+		view = memoryview(buf)
+		while len(view) > 0:
+			try:
+				n = os.write(self.__fd, view)
+				view = view[n:]
+			except BlockingIOError:
+				writable = self.__loop.create_future()
+				self.__loop.add_writer(self.__fd, writable.set_result, None)
+				try:
+					await writable
+				finally:
+					self.__loop.remove_writer(self.__fd)
+
+	#-----------------------------------------------
+	def __on_readable(self):
+		""" Event loop reader callback """
+
+		try:
+			data = os.read(self.__fd, 4096)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b''
+		if len(data) == 0:
+			# Readable with nothing to read is the device gone, it stays readable
+			print('CAT port for %s failed [device gone]' % self.__rig)
+			self.__lost()
+			return
+		if self.__framer != None:
+			self.__framer.feed(data)
+		else:
+			self.__rx.extend(data)
+		if self.__rx_waiter != None and not self.__rx_waiter.done() and self.__rx_done():
+			self.__rx_waiter.set_result(None)
+
+	#-----------------------------------------------
+	def __lost(self):
+		""" The port has failed, stop watching it and fail whoever waits on it """
+
+		if self.__failed:
+			return
+		self.__failed = True
+		self.__loop.remove_reader(self.__fd)
+		if self.__rx_waiter != None and not self.__rx_waiter.done():
+			self.__rx_waiter.set_exception(IOError('CAT port for %s failed' % self.__rig))
+		# Let the engine see it and fail the queue
+		self.__wakeup.set()
+
+	#-----------------------------------------------
+	async def __read_response(self, cmd):
+		""" Wait for a complete response to cmd and return it """
+
+		if self.__framer != None:
+			self.__rx_done = self.__civ_reply
+		else:
+			read_sz = self.__cat_cls_inst.response_size(cmd)
+			self.__rx_done = lambda: len(self.__rx) >= read_sz
+		if not self.__rx_done():
+			self.__rx_waiter = self.__loop.create_future()
+			try:
+				await self.__rx_waiter
+			finally:
+				self.__rx_waiter = None
+		if self.__framer != None:
+			data = self.__reply
+			self.__reply = None
+		else:
+			data = bytes(self.__rx)
+			del self.__rx[:]
+		return data
+
+	#-----------------------------------------------
+	def __civ_reply(self):
+		""" True when the reply has arrived, echoes, frames owed and other traffic are skipped """
+
+		while True:
+			f = self.__framer.next_frame()
+			if f == None:
+				return False
+			kind, frame = f
+			if self.__accounted(kind, frame):
+				continue
+			key = self.__reply_key
+			if kind == civ.FRAME_NG or (kind == civ.FRAME_DATA and frame[civ.CMD:civ.CMD + len(key)] == key):
+				# The framer reuses its buffer, keep a copy until decoded
+				self.__reply = bytes(frame)
+				return True
+
+	#-----------------------------------------------
+	def __discard(self):
+		""" Discard received data, a partial CI-V frame may be the start of a reply """
+
+		del self.__rx[:]
+		if self.__framer != None:
+			self.__pump()
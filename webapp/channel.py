@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# channel.py
+#
+# Push channel from the console to connected browsers
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import threading
+import queue
+
+# Library imports
+
+# Application imports
+
+"""
+
+Server Sent Events (SSE) channel.
+
+Authoritative frequency and mode updates are published here once and
+fanned out to every connected browser. Each browser holds one long lived
+GET on the event service and receives events as they happen rather than
+polling or waiting for the reply to its own PUT.
+
+"""
+
+# Events waiting for a slow browser before we start discarding the oldest
+EVENT_Q_SZ = 32
+# Send a comment line this often so proxies and browsers keep the stream open
+KEEPALIVE = 15.0
+
+#=====================================================
+# The event channel class
+#=====================================================
+class EventChannel:
+
+    def __init__(self):
+
+        self.__lock = threading.Lock()
+        self.__subscribers = set()
+        # Last value of each event so a new subscriber starts in sync
+        self.__last = {}
+        self.__closed = False
+
+    #==============================================================================================
+    # PUBLIC
+    #==============================================================================================
+
+    #-------------------------------------------------
+    # Publish an event to all subscribers
+    def publish(self, event, data):
+        """
+        Publish an event
+
+        Arguments:
+            event   --  event name, e.g. 'freq'
+            data    --  event data as a string
+
+        """
+
+        with self.__lock:
+            self.__last[event] = data
+            subscribers = tuple(self.__subscribers)
+        for q in subscribers:
+            self.__put(q, (event, data))
+
+    #-------------------------------------------------
+    # Return a generator of SSE formatted events
+    def stream(self):
+        """
+        Generator for one browser connection. Runs until the browser goes
+        away (the server closes the generator) or the channel is closed.
+
+        Arguments:
+
+        """
+
+        q = self.__subscribe()
+        try:
+            # Tell the browser how quickly to reconnect
+            yield 'retry: 2000\n\n'
+            while True:
+                try:
+                    item = q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if item == None:
+                    break
+                event, data = item
+                yield 'event: %s\ndata: %s\n\n' % (event, data)
+        finally:
+            self.__unsubscribe(q)
+
+    #-------------------------------------------------
+    # Release all subscribers
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            subscribers = tuple(self.__subscribers)
+        for q in subscribers:
+            self.__put(q, None)
+
+    #==============================================================================================
+    # PRIVATE
+    #==============================================================================================
+
+    #-------------------------------------------------
+    # Add a subscriber primed with the current state
+    def __subscribe(self):
+        q = queue.Queue(EVENT_Q_SZ)
+        with self.__lock:
+            if self.__closed:
+                q.put(None)
+            else:
+                for item in self.__last.items():
+                    q.put(item)
+                self.__subscribers.add(q)
+        return q
+
+    #-------------------------------------------------
+    # Remove a subscriber
+    def __unsubscribe(self, q):
+        with self.__lock:
+            self.__subscribers.discard(q)
+
+    #-------------------------------------------------
+    # Queue an item, a slow browser loses its oldest events
+    def __put(self, q, item):
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
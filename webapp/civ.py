@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+# civ.py
+#
+# Streaming CI-V framer for Icom rigs
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+"""
+
+CI-V is a bus, everything sent by anyone is seen by everyone including
+the sender. A frame is
+
+	FEFE | To | From | Cn | [Sc] | [DataArea] | FD
+
+The framer accepts bytes in whatever chunks the port delivers, finds
+complete frames and classifies them by address and command byte -
+
+	FRAME_ECHO			-	our own command reflected by the bus
+	FRAME_OK			-	rig to us, FB
+	FRAME_NG			-	rig to us, FA
+	FRAME_DATA			-	rig to us, any other command (a reply)
+	FRAME_TRANSCEIVE	-	rig to everyone (address 00), an unsolicited update
+	FRAME_OTHER			-	anything else on the bus
+
+Frames are returned as memoryview slices of the framer buffer, no copy is
+made. A frame is only valid until the next call to feed().
+
+"""
+
+# Frame bytes
+PREAMBLE = 0xFE
+EOM = 0xFD
+OK = 0xFB
+NG = 0xFA
+# Default addresses
+RIG_ADDR = 0x88
+CTRL_ADDR = 0xE0
+BROADCAST_ADDR = 0x00
+# Frame byte offsets
+TO = 2
+FROM = 3
+CMD = 4
+# Shortest frame, FEFE To From Cn FD
+MIN_FRAME = 6
+
+# Frame kinds
+FRAME_ECHO = 'echo'
+FRAME_OK = 'ok'
+FRAME_NG = 'ng'
+FRAME_DATA = 'data'
+FRAME_TRANSCEIVE = 'transceive'
+FRAME_OTHER = 'other'
+# Kinds that answer a command
+REPLY_FRAMES = (FRAME_OK, FRAME_NG, FRAME_DATA)
+
+#======================================================================================
+# Incremental CI-V framer
+class CIVFramer:
+
+	def __init__(self, rig_addr = RIG_ADDR, ctrl_addr = CTRL_ADDR, size = 256):
+		"""
+		Constructor
+
+		Arguments
+			rig_addr	--	CI-V address of the rig
+			ctrl_addr	--	CI-V address of this controller
+			size		--	buffer size, longer than any expected frame
+		"""
+
+		self.__rig_addr = rig_addr
+		self.__ctrl_addr = ctrl_addr
+		# Fixed buffer, never resized so frame views stay valid
+		self.__buf = bytearray(size)
+		self.__view = memoryview(self.__buf)
+		self.__size = size
+		# Unconsumed bytes are buf[rd:wr]
+		self.__rd = 0
+		self.__wr = 0
+
+	#======================================================================================
+	# PUBLIC interface
+	def feed(self, data):
+		"""
+		Add received bytes
+
+		Arguments:
+			data	--	bytes as read from the port
+
+		"""
+
+		n = len(data)
+		if n == 0:
+			return
+		if self.__wr + n > self.__size:
+			# Move the unconsumed bytes to the front, they overlap so copy first
+			pending = self.__wr - self.__rd
+			self.__buf[0:pending] = bytes(self.__view[self.__rd:self.__wr])
+			self.__rd = 0
+			self.__wr = pending
+			if pending + n > self.__size:
+				# No frame is this long, resynchronise on the new data
+				self.__rd = self.__wr = 0
+				if n > self.__size:
+					data = data[n - self.__size:]
+					n = self.__size
+		self.__buf[self.__wr:self.__wr + n] = data
+		self.__wr += n
+
+	#-----------------------------------------------
+	def next_frame(self):
+		"""
+		Return the next complete frame as (kind, frame) or None
+
+		Arguments:
+
+		"""
+
+		buf = self.__buf
+		while True:
+			# Find the preamble
+			start = buf.find(b'\xfe\xfe', self.__rd, self.__wr)
+			if start < 0:
+				# Keep a trailing FE, it may be the first of a preamble
+				if self.__wr > self.__rd and buf[self.__wr - 1] == PREAMBLE:
+					self.__rd = self.__wr - 1
+				else:
+					self.__rd = self.__wr
+				return None
+			# Some rigs send more than two FE
+			while start + 2 < self.__wr and buf[start + 2] == PREAMBLE:
+				start += 1
+			end = buf.find(b'\xfd', start, self.__wr)
+			if end < 0:
+				self.__rd = start
+				return None
+			self.__rd = end + 1
+			if end + 1 - start < MIN_FRAME:
+				# Runt, discard
+				continue
+			frame = self.__view[start:end + 1]
+			return self.__classify(frame), frame
+
+	#-----------------------------------------------
+	def clear(self):
+		""" Discard everything """
+
+		self.__rd = self.__wr = 0
+
+	#======================================================================================
+	# PRIVATE interface
+	def __classify(self, frame):
+		""" Return the frame kind """
+
+		src = frame[FROM]
+		dst = frame[TO]
+		if src == self.__ctrl_addr:
+			return FRAME_ECHO
+		if src == self.__rig_addr:
+			if dst == self.__ctrl_addr:
+				cmd = frame[CMD]
+				if cmd == OK:
+					return FRAME_OK
+				if cmd == NG:
+					return FRAME_NG
+				return FRAME_DATA
+			if dst == BROADCAST_ADDR:
+				return FRAME_TRANSCEIVE
+		return FRAME_OTHER
@@ -37,69 +37,100 @@ import cherrypy
 from defs import *
 import page
 import console_model
-import cat
+import rigs
+import metrics
 
 # Module globals
-g_rate = 0.01
-g_f = 7.1
-g_cat_q = queue.Queue()
-g_cat = None
+g_rigs = rigs.RigRegistry()
+
+#=====================================================
+# Helpers
+#=====================================================
+
+#-------------------------------------------------
+# The context for the rig named in a request
+def get_rig(rig):
+    try:
+        return g_rigs.get(rig)
+    except KeyError:
+        raise cherrypy.HTTPError(404, 'Unknown rig %s' % rig)
+
+#-------------------------------------------------
+# Callback for unsolicited updates from one rig, e.g. the rig's own knob turned
+# Called on that rig's CAT thread
+def rig_update_for(ctx):
+    def rig_update(response):
+        ok, cmd, value = response
+        if cmd == CAT_FREQ_GET:
+            ctx.tuning.sync(value)
+            ctx.remember(freq = value)
+            ctx.channel.publish('freq', rigs.freq_string(value))
+        elif cmd == CAT_MODE_GET:
+            ctx.remember(mode = value)
+            ctx.channel.publish('mode', value.upper())
+    return rig_update
 
 #=====================================================
 # The main application class
 #===================================================== 
 class Console:
 
-    def __init__(self, name, model):
-        
-        global g_cat_q
-        global g_cat
+    def __init__(self, name, model, rig_config = CONSOLE_RIGS):
         
         self.__name = name
         self.__model = model
         
-        # Create the cat instance
-        g_cat = cat.CAT(FT817ND, CAT_PORT, BAUD, g_cat_q)
-        g_cat.run()
+        # Create and start a CAT instance per rig
+        g_rigs.open(rig_config, rig_update_for, model)
         
     # Expose the index method through the web
     @cherrypy.expose
-    def index(self):
+    def index(self, rig=None):
         # CherryPy will call this method for the root URI ("/") and send
         # its return value to the client.
-        return page.get_page(self.__name, self.__model)
+        ctx = get_rig(rig)
+        request = cherrypy.request
+        coding, variant = page.choose_variant(
+            page.get_cached_page(self.__name, self.__model, ctx.rig_id, g_rigs.ids()),
+            request.headers.get('Accept-Encoding'))
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'text/html;charset=utf-8'
+        headers['ETag'] = variant.etag
+        headers['Vary'] = 'Accept-Encoding'
+        # Always revalidate, usually a 304
+        headers['Cache-Control'] = 'no-cache'
+        if page.not_modified(variant, request.headers.get('If-None-Match')):
+            cherrypy.response.status = 304
+            return b''
+        if coding != page.IDENTITY:
+            headers['Content-Encoding'] = coding
+        return variant.body
+    
+    # The console for one rig, /rig/<id>
+    @cherrypy.expose
+    def rig(self, rig_id=None):
+        return self.index(rig_id)
 
 #=====================================================
 # The web service classes
+# Every service takes an optional rig id, the default rig if absent
 #=====================================================
 @cherrypy.expose
 class DialWebService(object):
     
     def __init__(self):
-        self.__lastRotation = 0
+        pass
     
     @cherrypy.tools.accept(media='text/plain')
     
     #-------------------------------------------------
     # Called by a PUT request
-    def PUT(self, rotation):
-        global g_rate, g_f
+    def PUT(self, rotation, rig=None):
+        ctx = get_rig(rig)
         #print("data: ", rotation)
         rotation = int((float(rotation)))
-        if rotation > self.__lastRotation:
-            # Freq up
-            g_f = g_f + g_rate
-        else:
-            # Freq down
-            g_f = g_f - g_rate
-        # Convert float freq to a 9 digit string.
-        hz = int(g_f * 1000000)
-        s = str(hz)
-        self.__lastRotation = rotation
-        # Set new frequency
-        g_cat.do_command(CAT_FREQ_SET, hz)
-        # Update the UI
-        return (str(hz)).rjust(9, '0')
+        # One step up or down, more when spun fast, sent to the rig and every UI
+        return rigs.freq_string(ctx.tuning.rotate(rotation))
 
 @cherrypy.expose
 class ScrollWebService(object):
@@ -111,50 +142,32 @@ class ScrollWebService(object):
     
     #-------------------------------------------------
     # Called by a PUT request
-    def PUT(self, scroll):
-        global g_f
+    def PUT(self, scroll, rig=None):
+        ctx = get_rig(rig)
         #print("data: ", scroll)
         
-        scroll = float(scroll)
-        g_f = g_f + scroll/1000000.0
-        # Convert float freq to a 9 digit string.
-        hz = int(g_f * 1000000)
-        s = str(hz)
-        # Set new frequency
-        g_cat.do_command(CAT_FREQ_SET, hz)
-        # Update the UI
-        return (str(hz)).rjust(9, '0')
+        # Scroll is in Hz
+        scroll = int(round(float(scroll)))
+        # Set new frequency and update the UI
+        return rigs.freq_string(ctx.tuning.apply(delta = scroll))
 
 @cherrypy.expose
 class SliderWebService(object):
     
     def __init__(self):
-        # Starts mid position
-        # Range 0-100
-        self.__lastSlider = 50
+        pass
     
     @cherrypy.tools.accept(media='text/plain')
     
     #-------------------------------------------------
     # Called by a PUT request
-    def PUT(self, slider):
-        global g_rate, g_f
+    def PUT(self, slider, rig=None):
+        ctx = get_rig(rig)
         #print("data: ", value)
+        # Slider starts mid position, range 0-100
         slider = int((float(slider)))
-        if slider > self.__lastSlider:
-            # Freq up
-            g_f = g_f + (slider - self.__lastSlider) * g_rate 
-        else:
-            # Freq down
-            g_f = g_f - + (self.__lastSlider - slider) * g_rate 
-        # Convert float freq to a 9 digit string.
-        hz = int(g_f * 1000000)
-        s = str(hz)
-        self.__lastSlider = slider
-        # Set new frequency
-        g_cat.do_command(CAT_FREQ_SET, hz)
-        # Update the UI
-        return (str(hz)).rjust(9, '0')
+        # Set new frequency and update the UI
+        return rigs.freq_string(ctx.tuning.slide(slider))
     
 @cherrypy.expose
 class RateWebService(object):
@@ -166,10 +179,11 @@ class RateWebService(object):
     
     #-------------------------------------------------
     # Called by a PUT request
-    def PUT(self, rate):
-        global g_rate
-        rateLookup = {"100KHz": 0.1, "10KHz": 0.01, "1KHz": 0.001, "100Hz": 0.0001, "10Hz": 0.00001,}
-        g_rate = rateLookup[rate]
+    def PUT(self, rate, rig=None):
+        ctx = get_rig(rig)
+        rateLookup = {"100KHz": 100000, "10KHz": 10000, "1KHz": 1000, "100Hz": 100, "10Hz": 10,}
+        # Also selects the dial acceleration curve
+        ctx.tuning.set_step(rateLookup[rate])
 
 @cherrypy.expose
 class ModeWebService(object):
@@ -181,9 +195,12 @@ class ModeWebService(object):
     
     #-------------------------------------------------
     # Called by a PUT request
-    def PUT(self, mode):
+    def PUT(self, mode, rig=None):
+        ctx = get_rig(rig)
         lookup = {'LSB' : MODE_LSB, 'USB' : MODE_USB, 'AM' : MODE_AM, 'FM' : MODE_FM}
-        g_cat.do_command(CAT_MODE_SET, lookup[mode])
+        ctx.cat.do_command(CAT_MODE_SET, lookup[mode])
+        ctx.remember(mode = lookup[mode])
+        ctx.channel.publish('mode', mode)
 
 @cherrypy.expose
 class BandWebService(object):
@@ -195,8 +212,8 @@ class BandWebService(object):
     
     #-------------------------------------------------
     # Called by a PUT request
-    def PUT(self, band):
-        global g_f
+    def PUT(self, band, rig=None):
+        ctx = get_rig(rig)
         lookup = {
             '160m' : BAND_160,
             '80m' : BAND_80,
@@ -207,14 +224,81 @@ class BandWebService(object):
             '2m' : BAND_2,
             '70cm' : BAND_70
         }
-        f_float = lookup[band]
-        hz = int(f_float*1000000.0)
-        g_f = f_float
-        # Set new frequency
-        g_cat.do_command(CAT_FREQ_SET, hz)
-        # Update the UI
-        return (str(hz)).rjust(9, '0')
-              
+        # Band frequencies are MHz
+        hz = int(round(lookup[band] * 1000000.0))
+        # Set new frequency and update the UI
+        return rigs.freq_string(ctx.tuning.set(hz))
+
+@cherrypy.expose
+class TuneWebService(object):
+    
+    def __init__(self):
+        pass
+    
+    @cherrypy.tools.accept(media='text/plain')
+    
+    #-------------------------------------------------
+    # Called by a POST request
+    # The browser batches the tuning it has seen since the last POST
+    # and sends the net result. The new frequency comes back to every
+    # browser on the event channel.
+    def POST(self, dial=0, scroll=0, slider=0, rig=None):
+        ctx = get_rig(rig)
+        #print("data: ", dial, scroll, slider)
+        # Dial and slider are signed step counts, scroll is signed Hz
+        # Dial steps are accelerated, see tuning.py
+        # Set new frequency and update the UI
+        return rigs.freq_string(ctx.tuning.apply(int(slider), int(round(float(scroll))), int(dial)))
+
+@cherrypy.expose
+class EventWebService(object):
+    
+    def __init__(self):
+        pass
+    
+    # The event stream must not be buffered
+    _cp_config = {'response.stream': True}
+    
+    #-------------------------------------------------
+    # Called by a GET request
+    # One long lived request per browser
+    def GET(self, rig=None):
+        ctx = get_rig(rig)
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        return ctx.channel.stream()
+
+@cherrypy.expose
+class MetricsWebService(object):
+    
+    def __init__(self):
+        pass
+    
+    #-------------------------------------------------
+    # Called by a GET request
+    # Scraped by Prometheus
+    def GET(self):
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return metrics.REGISTRY.render()
+
+#==============================================================================================
+# Application assembly
+#==============================================================================================
+#-------------------------------------------------
+# Create the root and mount every service under it
+def create_app(name, model, rig_config = CONSOLE_RIGS):
+    webapp = Console(name, model, rig_config)
+    webapp.dial_service = DialWebService()
+    webapp.scroll_service = ScrollWebService()
+    webapp.slider_service = SliderWebService()
+    webapp.rate_service = RateWebService()
+    webapp.mode_service = ModeWebService()
+    webapp.band_service = BandWebService()
+    webapp.tune_service = TuneWebService()
+    webapp.event_service = EventWebService()
+    webapp.metrics = MetricsWebService()
+    return webapp
+
 #==============================================================================================
 # Main code
 #==============================================================================================
@@ -230,13 +314,7 @@ if __name__ == '__main__':
     # Get configuration file
     cherrypy_conf = os.path.join(os.path.dirname(__file__), 'cherrypy.conf')
     # Create web app instances
-    webapp = Console('Web Console', model)
-    webapp.dial_service = DialWebService()
-    webapp.scroll_service = ScrollWebService()
-    webapp.slider_service = SliderWebService()
-    webapp.rate_service = RateWebService()
-    webapp.mode_service = ModeWebService()
-    webapp.band_service = BandWebService()
+    webapp = create_app('Web Console', model)
 
     # Turn off logging
     access_log = cherrypy.log.access_log
@@ -256,7 +334,9 @@ if __name__ == '__main__':
         pass
     
     # Tidy up
-    g_cat.terminate()
+    g_rigs.terminate()
+    # Write out whatever is still held back
+    model.save_model()
     cherrypy.engine.exit()
     print("Radio Console closing...")
         
@@ -25,21 +25,56 @@
 
 # System imports
 import os, sys
-import pickle
+import json
+import tempfile
+import threading
+from time import monotonic
 
 # Library imports
 
 # Application imports
+from defs import *
+
+"""
+
+The model is what the operator was doing, per rig, so a restart resumes
+where they left off.
+
+Tuning updates the model in memory only. The first update after a save
+starts a timer and everything that arrives before it fires goes out in
+one write, so the file is written at most every SAVE_INTERVAL seconds
+however fast the dial is turned. save_model() writes at once, call it on
+shutdown.
+
+The file is compact JSON, written to a temporary file in the same
+directory and renamed over the old one so a crash mid-write leaves the
+previous model intact.
+
+"""
+
+# Model file
+MODEL_PATH = 'console.model'
+# Least seconds between writes
+SAVE_INTERVAL = 5.0
 
 #=====================================================
 # The main Model class
 #===================================================== 
 class ConsoleModel:
     
-    def __init__(self):
+    def __init__(self, path = MODEL_PATH, interval = SAVE_INTERVAL):
         
-        self.__PATH = "console.model"
+        self.__PATH = path
+        self.__interval = interval
         self.__model = None
+        # Guards the model
+        self.__lock = threading.Lock()
+        # Held for a whole save so writes land in order
+        self.__save_lock = threading.Lock()
+        # Write-behind state
+        self.__dirty = False
+        self.__timer = None
+        self.__last_save = 0.0
     
     #==============================================================================================
     # PUBLIC
@@ -48,28 +83,68 @@ class ConsoleModel:
     #-------------------------------------------------
     # Restore current model
     def restore_model(self):
-        self.__model = self.__restore_model()
-        if self.__model == None:
-            # Use default
-            print("Model not found, using default!")
-            self.__model = self.__get_dafault_model()
-            self.__save_model()    
+        model = self.__restore_model()
+        with self.__lock:
+            self.__model = model
+            if self.__model == None:
+                # Use default
+                print("Model not found, using default!")
+                self.__model = self.__get_dafault_model()
+        if model == None:
+            self.save_model()
             
     #-------------------------------------------------
-    # Save current model
+    # Save current model now
     def save_model(self):
-        self.__save_model()
+        with self.__lock:
+            if self.__timer != None:
+                self.__timer.cancel()
+                self.__timer = None
+            self.__dirty = True
+        self.__flush()
     
     #-------------------------------------------------
-    # Update current model
-    def update_model(self, mode, freq):
-        self.__model['mode'] = mode
-        self.__model['freq'] = freq
+    # Update current model, saved later
+    def update_model(self, rig_id, mode = None, freq = None):
+        """
+        Record the state of a rig
+        
+        Arguments:
+            rig_id  --  rig id as in CONSOLE_RIGS
+            mode    --  CAT mode, MODE_LSB etc, None to leave as is
+            freq    --  frequency in Hz, None to leave as is
+            
+        """
+        
+        with self.__lock:
+            if self.__model == None:
+                self.__model = self.__get_dafault_model()
+            rig = self.__model['rigs'].setdefault(rig_id, self.__get_default_rig())
+            if (mode == None or rig['mode'] == mode) and (freq == None or rig['freq'] == freq):
+                return
+            if mode != None:
+                rig['mode'] = mode
+            if freq != None:
+                rig['freq'] = freq
+            self.__dirty = True
+            if self.__timer == None:
+                delay = max(0.0, self.__last_save + self.__interval - monotonic())
+                self.__timer = threading.Timer(delay, self.__flush)
+                self.__timer.daemon = True
+                self.__timer.start()
     
     #-------------------------------------------------
     # Get current model
     def get_model(self):
         return self.__model
+    
+    #-------------------------------------------------
+    # Saved state of one rig, None if never saved
+    def get_rig(self, rig_id):
+        with self.__lock:
+            if self.__model == None or rig_id not in self.__model['rigs']:
+                return None
+            return dict(self.__model['rigs'][rig_id])
 
     #==============================================================================================
     # PRIVATE
@@ -78,7 +153,10 @@ class ConsoleModel:
     #-------------------------------------------------
     # Default model
     def __get_dafault_model(self):
-        return {'mode': 'LSB', 'freq': 7100000}
+        return {'rigs': {}}
+    
+    def __get_default_rig(self):
+        return {'mode': MODE_LSB, 'freq': 7100000}
     
     #-------------------------------------------------
     # Implementation of restore from disk
@@ -93,37 +171,56 @@ class ConsoleModel:
         model = None
         if os.path.exists(self.__PATH):
             try:       
-                f = open(self.__PATH, 'rb')
-                model = pickle.load(f)
+                with open(self.__PATH, 'r') as f:
+                    model = json.load(f)
+                if not isinstance(model, dict) or not isinstance(model.get('rigs'), dict):
+                    raise ValueError('not a console model')
             except Exception as e:
                 # Error retrieving model file
                 print('Model File - Exception','Exception [%s]' % (str(e)))
-            finally:
-                try:
-                    f.close()
-                except:
-                    pass
+                model = None
         return model
 
+    #-------------------------------------------------
+    # Write the model if changed, on the timer or from save_model()
+    def __flush(self):
+        with self.__save_lock:
+            with self.__lock:
+                if self.__timer is threading.current_thread():
+                    self.__timer = None
+                if not self.__dirty:
+                    return
+                data = json.dumps(self.__model, separators = (',', ':'), sort_keys = True)
+                self.__dirty = False
+                self.__last_save = monotonic()
+            self.__save_model(data)
+
     #-------------------------------------------------
     # Implementation of save to disk
-    def __save_model(self):
+    def __save_model(self, data):
         """
         Save the model
         
         Arguments:
+            data    --  the model as a JSON string
 
         """
         
-        try:       
-            f = open(self.__PATH, 'wb')
-            pickle.dump(self.__model, f)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix = '.console.', suffix = '.tmp', dir = os.path.dirname(os.path.abspath(self.__PATH)))
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.__PATH)
+            tmp = None
         except Exception as e:
             # Error saving model file
             print('Model File - Exception','Exception [%s]' % (str(e)))
         finally:
-            try:
-                f.close()
-            except:
-                pass
-
+            if tmp != None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
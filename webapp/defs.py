@@ -29,6 +29,21 @@
 CAT_PORT = '/dev/ttyUSB0'
 #CAT_PORT = 'COM3'
 BAUD = 9600
+# Seconds a value in the rig state cache stays fresh
+CAT_STATE_TTL = 2.0
+# Seconds between attempts to reopen a lost port, doubling from MIN to MAX
+CAT_RECONNECT_MIN = 0.5
+CAT_RECONNECT_MAX = 8.0
+# Seconds between checks that an open port is still there
+CAT_HEALTH_POLL = 1.0
+# Shortest response timeout, seconds, see rtt.py
+CAT_RTO_MIN = 0.05
+# Times a command with no response is sent again
+CAT_RETRIES = 2
+# Seconds of stop-and-wait after an NG to a pipelined CI-V read, doubling
+# to MAX while the NGs go on
+CAT_PIPELINE_HOLDOFF = 10.0
+CAT_PIPELINE_HOLDOFF_MAX = 300.0
 
 # CAT variants
 FT817ND = 'FT-817ND'
@@ -37,11 +52,33 @@ CAT_VARIANTS = [FT817ND, IC7100]
 YAESU = 'YAESU'
 ICOM = 'ICOM'
 
+# Rigs driven by the console
+# (id used in URLs, rig type, port, baud), the first is the default
+CONSOLE_RIGS = (
+    ('ft817', FT817ND, CAT_PORT, BAUD),
+)
+
+# ============================================================================
+# Tuning
+
+# Dial acceleration, seconds of dial movement the speed is measured over
+ACCEL_WINDOW = 0.3
+# Per tuning step in Hz, ((dial steps per second, step multiplier), ...)
+# in rising speed. The multiplier of the fastest speed reached applies.
+ACCEL_CURVES = {
+    10: ((0, 1), (8, 5), (15, 20), (25, 100), (40, 500)),
+    100: ((0, 1), (8, 5), (15, 20), (25, 50), (40, 100)),
+    1000: ((0, 1), (10, 5), (20, 10), (40, 20)),
+    10000: ((0, 1), (15, 2), (30, 5)),
+    100000: ((0, 1), ),
+}
+
 # ============================================================================
 # Constants used in command sets
 REFERENCE = 'reference'
 MAP = 'map'
 CLASS = 'rigclass'
+RESOLUTION = 'resolution'
 SERIAL = 'serial'
 COMMANDS = 'commands'
 MODES = 'modes'
@@ -49,6 +86,10 @@ PARITY = 'parity'
 STOP_BITS = 'stopbits'
 TIMEOUT = 'timeout'
 READ_SZ = 'readsz'
+GUARD_TIME = 'guardtime'
+BURST = 'burst'
+PIPELINE = 'pipeline'
+LISTEN_POLL = 'listenpoll'
 LOCK_CMD = 'lockcmd'
 LOCK_SUB = 'locksub'
 LOCK_ON = 'lockon'
@@ -70,6 +111,8 @@ GET_MODE_CMD = 'getmodecmd'
 GET_MODE_SUB = 'getmodesub'
 FREQ_MODE_GET = 'freqmodeget'
 RESPONSES = 'responses'
+TRANSCEIVE_FREQ_CMD = 'transceivefreqcmd'
+TRANSCEIVE_MODE_CMD = 'transceivemodecmd'
 
 ACK = 'ack'
 NAK = 'nak'
@@ -111,3 +154,17 @@ CAT_FREQ_SET = 'catfreqset'
 CAT_MODE_SET = 'catmodeset'
 CAT_FREQ_GET = 'catfreqget'
 CAT_MODE_GET = 'catmodeget'
+
+# Integer opcodes for the CAT commands, these index the dispatch tables
+CAT_OPCODES = {
+    CAT_LOCK: 0,
+    CAT_PTT: 1,
+    CAT_PTT_SET: 2,
+    CAT_PTT_GET: 3,
+    CAT_FREQ_SET: 4,
+    CAT_MODE_SET: 5,
+    CAT_FREQ_GET: 6,
+    CAT_MODE_GET: 7,
+}
+# Opcode for anything not in CAT_OPCODES, always an empty table slot
+NO_OPCODE = len(CAT_OPCODES)
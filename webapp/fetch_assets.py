@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# fetch_assets.py
+#
+# Download the third party scripts and styles so the console runs offline
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import re
+import urllib.parse
+import urllib.request
+
+# Application imports
+import page
+
+"""
+
+Run once from the webapp directory on a machine with internet access:
+	python fetch_assets.py
+
+Every library in page.VENDOR is saved under public/lib, with the images a
+stylesheet refers to (the jQuery UI theme's images/) beside it. From then
+on the page links the local copies, restart the console to pick them up.
+Run it again to fetch anything missing, files already present are kept.
+
+"""
+
+# url(...) references in a stylesheet
+CSS_URL = re.compile(r'url\(\s*[\'"]?([^\'")]+?)[\'"]?\s*\)')
+
+def main():
+	failed = 0
+	for path, url in page.VENDOR:
+		target = os.path.join(page.PUBLIC, path)
+		if os.path.exists(target):
+			print('%s already present' % path)
+		elif not fetch(url, target):
+			failed += 1
+			continue
+		if target.endswith('.css'):
+			failed += fetch_css_refs(url, target)
+	return 1 if failed > 0 else 0
+
+#-------------------------------------------------
+# Fetch the files a stylesheet refers to, relative to it on both sides
+# Returns the number that failed
+def fetch_css_refs(url, target):
+	with open(target, encoding = 'utf-8', errors = 'replace') as f:
+		css = f.read()
+	lib = os.path.dirname(os.path.abspath(target))
+	failed = 0
+	for ref in sorted(set(CSS_URL.findall(css))):
+		if ref.startswith(('data:', '/', '#')) or urllib.parse.urlparse(ref).scheme:
+			# Inline or absolute, not ours to fetch
+			continue
+		local = os.path.normpath(os.path.join(lib, ref))
+		if os.path.commonpath((lib, local)) != lib:
+			print('Skipped %s, outside %s' % (ref, lib))
+			continue
+		if os.path.exists(local):
+			continue
+		if not fetch(urllib.parse.urljoin(url, ref), local):
+			failed += 1
+	return failed
+
+#-------------------------------------------------
+# Save url at target, whole or not at all
+def fetch(url, target):
+	os.makedirs(os.path.dirname(target), exist_ok = True)
+	try:
+		with urllib.request.urlopen(url, timeout = 30) as resp:
+			data = resp.read()
+	except OSError as e:
+		print('Failed to fetch %s [%s]' % (url, str(e)))
+		return False
+	with open(target + '.tmp', 'wb') as f:
+		f.write(data)
+	os.replace(target + '.tmp', target)
+	print('%s %d bytes' % (os.path.relpath(target, page.PUBLIC), len(data)))
+	return True
+
+# Entry point
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# metrics.py
+#
+# Counters and fixed-bucket histograms in Prometheus text format
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import threading
+from bisect import bisect_left
+
+"""
+
+Just enough of the Prometheus data model for the CAT engine, with no
+library to install.
+
+A metric is declared once at module level with its label names and a
+labelled child is looked up per observation -
+
+	WAIT = metrics.REGISTRY.histogram('cat_queue_wait_seconds', 'Time in the queue', ('rig', 'command'))
+	WAIT.labels(rig, cmd).observe(secs)
+
+Observing costs a dict lookup and a bisect. A histogram child is only
+written by the thread that owns it (the CAT thread), counters may be
+bumped from any thread and take a lock. A scrape reads without a lock so
+may see one observation half applied, which Prometheus tolerates.
+Creating a child takes a lock.
+
+"""
+
+# Histogram bucket upper bounds in seconds, serial exchanges run from
+# sub-millisecond (format) to the rig timeout (seconds)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+#======================================================================================
+# Single series
+class Counter:
+
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.value = 0
+
+	def inc(self, n = 1):
+		with self.__lock:
+			self.value += n
+
+class Histogram:
+
+	def __init__(self, buckets):
+		self.__buckets = buckets
+		# One count per bucket plus +Inf, not cumulative
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+
+	def observe(self, value):
+		self.counts[bisect_left(self.__buckets, value)] += 1
+		self.sum += value
+
+#======================================================================================
+# Metric with labelled children
+class Family:
+
+	def __init__(self, name, doc, kind, label_names, factory):
+		"""
+		Constructor
+
+		Arguments
+			name		--	metric name
+			doc			--	help text
+			kind		--	'counter' or 'histogram'
+			label_names	--	tuple of label names
+			factory		--	makes a child
+		"""
+
+		self.name = name
+		self.doc = doc
+		self.kind = kind
+		self.label_names = label_names
+		self.__factory = factory
+		self.__lock = threading.Lock()
+		self.children = {}
+
+	def labels(self, *values):
+		""" Return the child for these label values """
+
+		child = self.children.get(values)
+		if child == None:
+			with self.__lock:
+				child = self.children.get(values)
+				if child == None:
+					child = self.__factory()
+					# Replace rather than mutate so a scrape can iterate safely
+					children = dict(self.children)
+					children[values] = child
+					self.children = children
+		return child
+
+#======================================================================================
+# All metrics
+class Registry:
+
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__families = {}
+
+	#======================================================================================
+	# PUBLIC interface
+	def counter(self, name, doc, label_names = ()):
+		""" Declare a counter, names end in _total """
+
+		return self.__add(Family(name, doc, 'counter', label_names, Counter))
+
+	#-----------------------------------------------
+	def histogram(self, name, doc, label_names = (), buckets = DEFAULT_BUCKETS):
+		""" Declare a histogram, names end in the unit e.g. _seconds """
+
+		buckets = tuple(sorted(buckets))
+		return self.__add(Family(name, doc, 'histogram', label_names, lambda: Histogram(buckets)), buckets)
+
+	#-----------------------------------------------
+	def render(self):
+		""" Return every metric in Prometheus text exposition format """
+
+		lines = []
+		with self.__lock:
+			families = list(self.__families.values())
+		for family, buckets in families:
+			lines.append('# HELP %s %s' % (family.name, family.doc))
+			lines.append('# TYPE %s %s' % (family.name, family.kind))
+			for values, child in sorted(family.children.items()):
+				labels = ','.join('%s="%s"' % (n, escape(v)) for n, v in zip(family.label_names, values))
+				if family.kind == 'counter':
+					lines.append('%s%s %d' % (family.name, braces(labels), child.value))
+				else:
+					counts = list(child.counts)
+					cumulative = 0
+					for bound, count in zip(buckets + (None, ), counts):
+						cumulative += count
+						le = '+Inf' if bound == None else repr(bound)
+						lines.append('%s_bucket%s %d' % (family.name, braces(join(labels, 'le="%s"' % le)), cumulative))
+					lines.append('%s_sum%s %r' % (family.name, braces(labels), child.sum))
+					lines.append('%s_count%s %d' % (family.name, braces(labels), cumulative))
+		lines.append('')
+		return '\n'.join(lines)
+
+	#======================================================================================
+	# PRIVATE interface
+	def __add(self, family, buckets = None):
+		""" Register a family, a name can only be declared once """
+
+		with self.__lock:
+			if family.name in self.__families:
+				raise ValueError('Metric %s already declared' % family.name)
+			self.__families[family.name] = (family, buckets)
+		return family
+
+#======================================================================================
+# Helpers
+def escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def join(a, b):
+	return b if a == '' else a + ',' + b
+
+def braces(labels):
+	return '{%s}' % labels if labels != '' else ''
+
+# The process wide registry served at /metrics
+REGISTRY = Registry()
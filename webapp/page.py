@@ -25,32 +25,76 @@
 
 # System imports
 import os, sys
-import pickle
+import gzip
+import hashlib
+import threading
+from collections import namedtuple
 
 # Library imports
+try:
+    # Optional, pip install brotli
+    import brotli
+except ImportError:
+    brotli = None
 
 # Application imports
 
+"""
+
+The page only changes with the console name and rig configuration, so
+it is rendered once per configuration and kept, with a gzip (and, if the
+brotli package is installed, brotli) variant alongside. Each variant has
+a strong ETag and the page is sent no-cache, so a reload costs the
+browser a conditional GET and us a 304.
+
+Scripts and styles are served from /static with a far future expiry.
+Our own carry a hash of their content in the URL so an edit is still
+picked up. The third party libraries are served from public/lib when
+fetch_assets.py has put them there and from their CDN otherwise.
+
+"""
+
+# Where /static is served from
+PUBLIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public')
+# Third party libraries, (file under public, CDN URL)
+VENDOR = (
+    ('lib/jquery-ui-1.8.21.css', 'https://code.jquery.com/ui/1.8.21/themes/base/jquery-ui.css'),
+    ('lib/jquery-2.0.3.js', 'https://code.jquery.com/jquery-2.0.3.js'),
+    ('lib/jquery-ui-1.12.1.js', 'https://code.jquery.com/ui/1.12.1/jquery-ui.js'),
+    ('lib/jquery.ui.touch-punch-0.2.3.min.js', 'https://cdnjs.cloudflare.com/ajax/libs/jqueryui-touch-punch/0.2.3/jquery.ui.touch-punch.min.js'),
+)
+# Content codings in order of preference
+IDENTITY = 'identity'
+CODINGS = ('br', 'gzip')
+
+# One rendering of the page
+PageVariant = namedtuple('PageVariant', ('etag', 'body'))
+
+# Rendered pages by configuration
+_lock = threading.Lock()
+_cache = {}
+
 #==============================================================================================
 # PUBLIC
 #==============================================================================================
  
 #-------------------------------------------------
-# Get the one and only page     
-def get_page(name, model):
+# Get the page for one rig
+# rig_id is sent back with every request, rig_ids lists every console
+def get_page(name, model, rig_id, rig_ids):
     
     index_html = '''
     <html>
     <head>
-        <link href="/static/css/page.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://code.jquery.com/ui/1.8.21/themes/base/jquery-ui.css">
-        <script src="https://code.jquery.com/jquery-2.0.3.js"></script>
-        <script src="https://code.jquery.com/ui/1.12.1/jquery-ui.js"></script>
-        <script type="text/javascript" src="//cdnjs.cloudflare.com/ajax/libs/jqueryui-touch-punch/0.2.3/jquery.ui.touch-punch.min.js"></script>
-        <script type="text/javascript" src="/static/js/jogDial.js"></script>
-        <script type="text/javascript" src="/static/js/page.js"></script>
+        <link href="%s" rel="stylesheet">
+        <link rel="stylesheet" href="%s">
+        <script src="%s"></script>
+        <script src="%s"></script>
+        <script type="text/javascript" src="%s"></script>
+        <script type="text/javascript" src="%s"></script>
+        <script type="text/javascript" src="%s"></script>
     </head>
-    <body>
+    <body data-rig="%s">
         <div id="container" class="grid-container">
             <div id="header" class="header-item"> %s </div>
             <div id="frequency" class="freq-item"> %s </div>
@@ -63,17 +107,113 @@ def get_page(name, model):
         </div>
     </body>
     </html>
-    ''' % (get_header(name), get_frequency(model), get_increment(model), get_mode(model), get_band(model), get_footer())
+    ''' % (asset_url('css/page.css'), vendor_url(0), vendor_url(1), vendor_url(2), vendor_url(3), asset_url('js/jogDial.js'), asset_url('js/page.js'),
+           rig_id, get_header(name, rig_id, rig_ids), get_frequency(model), get_increment(model), get_mode(model), get_band(model), get_footer())
     return index_html
 
+#-------------------------------------------------
+# The page for one rig, rendered once
+def get_cached_page(name, model, rig_id, rig_ids):
+    """
+    Return {coding: PageVariant} for the page, rendering it on first use
+    
+    Arguments:
+        as get_page()
+    
+    """
+    
+    key = (name, id(model), rig_id, tuple(rig_ids))
+    variants = _cache.get(key)
+    if variants == None:
+        with _lock:
+            variants = _cache.get(key)
+            if variants == None:
+                variants = render(get_page(name, model, rig_id, rig_ids))
+                _cache[key] = variants
+    return variants
+
+#-------------------------------------------------
+# Pick the variant to send
+def choose_variant(variants, accept_encoding):
+    """
+    Return (coding, PageVariant), the most compressed the browser accepts
+    
+    Arguments:
+        variants        --  from get_cached_page()
+        accept_encoding --  the Accept-Encoding header or None
+    
+    """
+    
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        parts = item.split(';')
+        q = 1.0
+        for p in parts[1:]:
+            p = p.strip()
+            if p.startswith('q='):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(parts[0].strip().lower())
+    for coding in CODINGS:
+        if coding in variants and (coding in accepted or '*' in accepted):
+            return coding, variants[coding]
+    return IDENTITY, variants[IDENTITY]
+
+#-------------------------------------------------
+# True if an If-None-Match header names this variant
+def not_modified(variant, if_none_match):
+    if if_none_match == None:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    # Weak comparison, as If-None-Match allows
+    return '*' in tags or variant.etag in tags or 'W/' + variant.etag in tags
+
 #==============================================================================================
 # PRIVATE
 #==============================================================================================
+
+#-------------------------------------------------
+# Every variant of a page
+def render(html):
+    body = html.encode('utf-8')
+    tag = hashlib.sha1(body).hexdigest()[:16]
+    variants = {IDENTITY: PageVariant('"%s"' % tag, body)}
+    # No timestamp in the header so the bytes follow the page
+    variants['gzip'] = PageVariant('"%s-gz"' % tag, gzip.compress(body, 9, mtime = 0))
+    if brotli != None:
+        variants['br'] = PageVariant('"%s-br"' % tag, brotli.compress(body))
+    return variants
+
+#-------------------------------------------------
+# URL of one of our files under public, versioned by content
+def asset_url(path):
+    try:
+        with open(os.path.join(PUBLIC, path), 'rb') as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:12]
+    except OSError:
+        return '/static/' + path
+    return '/static/%s?v=%s' % (path, version)
+
+#-------------------------------------------------
+# URL of a third party library, local if fetched
+def vendor_url(index):
+    path, cdn = VENDOR[index]
+    if os.path.exists(os.path.join(PUBLIC, path)):
+        # The version is in the file name
+        return '/static/' + path
+    return cdn
         
 #-------------------------------------------------
 # Header HTML
-def get_header(name):     
-    return "<h1>%s</h1>" % (name)
+# With more than one rig, links to the other consoles
+def get_header(name, rig_id, rig_ids):
+    if len(rig_ids) < 2:
+        return "<h1>%s</h1>" % (name)
+    links = ' '.join('<a href="/rig/%s" class="%s">%s</a>' % (r, 'RigCurrent' if r == rig_id else 'Rig', r) for r in rig_ids)
+    return '<h1>%s <span class="RigLinks">%s</span></h1>' % (name, links)
 
 #-------------------------------------------------
 # Content HTML
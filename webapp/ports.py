@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#
+# ports.py
+#
+# Serial port discovery without opening ports
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import threading
+from collections import namedtuple
+from time import monotonic
+
+# Library imports
+import serial.tools.list_ports
+
+"""
+
+Rig interfaces are USB-serial adapters (the FT-817 CAT cable, the
+IC-7100 built-in USB port). On Linux they are found by reading sysfs,
+the kernel already knows every USB-serial tty and the USB device it
+hangs off, so nothing is opened. Opening every /dev/tty* to see if it
+is a port is slow where there are hundreds of them and can upset other
+devices (modems, consoles).
+
+The udev /dev/serial/by-id links are reported too. They name a device by
+vendor, product and serial number so stay the same whatever ttyUSBn the
+kernel hands out.
+
+Other platforms use pyserial's list_ports, which does not open ports
+either.
+
+Results are cached for CACHE_TTL seconds. Discovery is meant to run only
+when the configured port fails to open. identity() reads just the sysfs
+entry of a port already open.
+
+"""
+
+# Where the kernel lists ttys
+SYSFS_TTY = '/sys/class/tty'
+# udev links by USB identity
+BY_ID = '/dev/serial/by-id'
+# tty names of USB-serial drivers
+USB_PREFIXES = ('ttyUSB', 'ttyACM')
+# Seconds a discovery result is reused
+CACHE_TTL = 10.0
+
+# One port, ids are None where unknown
+PortInfo = namedtuple('PortInfo', ('device', 'vid', 'pid', 'serial_number', 'manufacturer', 'product', 'by_id'))
+
+# The cache
+_lock = threading.Lock()
+_ports = None
+_when = 0.0
+
+#==============================================================================================
+# PUBLIC
+#==============================================================================================
+
+#-------------------------------------------------
+# All serial ports found
+def discover(refresh = False):
+	"""
+	Return a list of PortInfo, from the cache if fresh
+
+	Arguments:
+		refresh	--	ignore the cache
+
+	"""
+
+	global _ports, _when
+	with _lock:
+		if refresh or _ports == None or monotonic() - _when > CACHE_TTL:
+			if sys.platform.startswith('linux'):
+				_ports = _linux_ports()
+			else:
+				_ports = _pyserial_ports()
+			_when = monotonic()
+		return list(_ports)
+
+#-------------------------------------------------
+# Device names only
+def names(refresh = False):
+	return [p.device for p in discover(refresh)]
+
+#-------------------------------------------------
+# Ports matching a USB identity
+def find(vid = None, pid = None, serial_number = None, refresh = False):
+	"""
+	Return the PortInfo of every port matching all the ids given
+
+	Arguments:
+		vid				--	USB vendor id as an int
+		pid				--	USB product id as an int
+		serial_number	--	USB serial number string
+		refresh			--	ignore the cache
+
+	"""
+
+	return [p for p in discover(refresh)
+		if (vid == None or p.vid == vid) and (pid == None or p.pid == pid) and (serial_number == None or p.serial_number == serial_number)]
+
+#-------------------------------------------------
+# USB identity of one port
+def identity(device):
+	"""
+	Return (vid, pid, serial_number) of a USB port, None if not USB
+
+	On Linux only the port's own sysfs entry is read, nothing is
+	discovered. Elsewhere None, the caller discovers when it must.
+
+	Arguments:
+		device	--	port name, links are followed
+
+	"""
+
+	if not sys.platform.startswith('linux'):
+		return None
+	name = os.path.basename(os.path.realpath(device))
+	if not name.startswith(USB_PREFIXES):
+		return None
+	usb = _usb_device(name)
+	if usb == None:
+		return None
+	return (_read_hex(usb, 'idVendor'), _read_hex(usb, 'idProduct'), _read(usb, 'serial'))
+
+#-------------------------------------------------
+# Forget the cache, e.g. on a USB plug event
+def invalidate():
+	global _ports
+	with _lock:
+		_ports = None
+
+#==============================================================================================
+# PRIVATE
+#==============================================================================================
+
+#-------------------------------------------------
+# Linux, from sysfs and the udev links
+def _linux_ports():
+	by_id = {}
+	try:
+		for link in os.listdir(BY_ID):
+			path = os.path.join(BY_ID, link)
+			by_id[os.path.realpath(path)] = path
+	except OSError:
+		# No udev or no USB-serial devices
+		pass
+
+	ports = []
+	try:
+		entries = sorted(os.listdir(SYSFS_TTY))
+	except OSError:
+		return ports
+	for name in entries:
+		if not name.startswith(USB_PREFIXES):
+			continue
+		device = '/dev/' + name
+		usb = _usb_device(name)
+		if usb == None:
+			ports.append(PortInfo(device, None, None, None, None, None, by_id.get(device)))
+			continue
+		vid = _read_hex(usb, 'idVendor')
+		pid = _read_hex(usb, 'idProduct')
+		ports.append(PortInfo(device, vid, pid, _read(usb, 'serial'), _read(usb, 'manufacturer'), _read(usb, 'product'), by_id.get(device)))
+	return ports
+
+#-------------------------------------------------
+# The sysfs USB device a tty hangs off, the first parent with a vendor id
+def _usb_device(name):
+	tty = os.path.join(SYSFS_TTY, name, 'device')
+	if not os.path.exists(tty):
+		return None
+	usb = os.path.realpath(tty)
+	while usb != '/' and not os.path.exists(os.path.join(usb, 'idVendor')):
+		usb = os.path.dirname(usb)
+	return usb if usb != '/' else None
+
+#-------------------------------------------------
+# Anywhere else
+def _pyserial_ports():
+	return [PortInfo(p.device, p.vid, p.pid, p.serial_number, p.manufacturer, p.product, None)
+		for p in sorted(serial.tools.list_ports.comports(), key=lambda p: p.device)]
+
+#-------------------------------------------------
+# A sysfs attribute or None
+def _read(path, attr):
+	try:
+		with open(os.path.join(path, attr)) as f:
+			return f.read().strip()
+	except OSError:
+		return None
+
+def _read_hex(path, attr):
+	value = _read(path, attr)
+	if value == None:
+		return None
+	try:
+		return int(value, 16)
+	except ValueError:
+		return None
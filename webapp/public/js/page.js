@@ -22,10 +22,37 @@
 //     bob@bobcowdery.plus.com
 //
 
+//////////////////////////////////////////////////////////////////
+// Globals
+
+// Tuning seen since the last POST on the tuning channel
+var tune = {dial: 0, scroll: 0, slider: 0};
+// A POST is scheduled or in flight
+var tune_busy = false;
+var tune_pending = false;
+// Time to collect tuning before we POST it
+var TUNE_INTERVAL = 50;
+// True when the event channel is connected
+var channel_up = false;
+// Last dial and slider positions
+var last_rotation = 0;
+var last_slider = 50;
+// The rig this console drives, set by the page
+var rig_id = "";
+
 //////////////////////////////////////////////////////////////////
 // Main code
 $(document).ready(function() {
   
+  ////////////////////////////////////////////
+  // Every service call names our rig
+  rig_id = $("body").data("rig");
+  $.ajaxSetup({data: {rig: rig_id}});
+  
+  ////////////////////////////////////////////
+  // Event channel for updates from the server
+  do_channel();
+  
   ////////////////////////////////////////////
   // Dial jog frequency
   do_dial();
@@ -103,9 +130,51 @@ function set_freq(string) {
     $("#Hz1").text(string[8]);
   }
 
+////////////////////////////////////////////
+// Add tuning to the next POST on the channel
+function queue_tune(kind, delta) {
+  tune[kind] += delta;
+  if (!tune_busy) {
+    tune_busy = true;
+    setTimeout(flush_tune, TUNE_INTERVAL);
+  }
+  else {
+    tune_pending = true;
+  }
+}
+
+////////////////////////////////////////////
+// POST the accumulated tuning, one request in flight at a time
+function flush_tune() {
+  var data = tune;
+  tune = {dial: 0, scroll: 0, slider: 0};
+  tune_pending = false;
+  // The new frequency arrives on the event channel
+  $.ajax({
+     type: "POST",
+     url: "/tune_service",
+     data: data
+   })
+   .always(function () {
+     if (tune_pending) {
+       setTimeout(flush_tune, TUNE_INTERVAL);
+     }
+     else {
+       tune_busy = false;
+     }
+   });
+}
+
 ////////////////////////////////////////////
 // Set new frequency
 function slider_freq() {
+  var value = $( "#slider" ).slider("value");
+  if (channel_up) {
+    queue_tune("slider", value - last_slider);
+    last_slider = value;
+    return;
+  }
+  last_slider = value;
   // Fine tune
   $.ajax({
      type: "PUT",
@@ -123,6 +192,16 @@ function slider_freq() {
 ////////////////////////////////////////////
 // Do scroll exchange
 function execute_scroll(e, inc) {
+  if (channel_up) {
+    if (e.originalEvent.wheelDelta > 0 || e.originalEvent.detail < 0) {
+      queue_tune("scroll", inc);
+    }
+    else {
+      queue_tune("scroll", -inc);
+    }
+    e.preventDefault();
+    return;
+  }
   if (e.originalEvent.wheelDelta > 0 || e.originalEvent.detail < 0) {
     // Scroll up
     $.ajax({
@@ -148,6 +227,29 @@ function execute_scroll(e, inc) {
   e.preventDefault();
 }
 
+////////////////////////////////////////////
+// Connect the event channel
+// Without it every tuning event falls back to its own PUT
+function do_channel() {
+  if (!window.EventSource) {
+    return;
+  }
+  var source = new EventSource("/event_service?rig=" + encodeURIComponent(rig_id));
+  source.onopen = function () {
+    channel_up = true;
+  };
+  source.onerror = function () {
+    // The browser will reconnect, use the PUT services until it does
+    channel_up = false;
+  };
+  source.addEventListener("freq", function (e) {
+    set_freq(e.data);
+  });
+  source.addEventListener("mode", function (e) {
+    highlight_mode($("#" + e.data));
+  });
+}
+
 ////////////////////////////////////////////
 // Do slider frequency
 function do_slider() {
@@ -167,6 +269,20 @@ function do_dial() {
   var el = document.getElementById('dial');
   var dial = JogDial(el, {debug: false});
   dial.on("mousemove", function(e){
+    var rotation = e.target.rotation;
+    if (channel_up) {
+      // Same direction rule as the dial service
+      if (rotation > last_rotation) {
+        queue_tune("dial", 1);
+      }
+      else {
+        queue_tune("dial", -1);
+      }
+      last_rotation = rotation;
+      e.preventDefault();
+      return;
+    }
+    last_rotation = rotation;
       $.ajax({
           type: "PUT",
           url: "/dial_service",
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# rig_state.py
+#
+# Mirror of the rig state held by CAT
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import threading
+from time import monotonic
+
+# Application imports
+from defs import *
+
+"""
+
+Remembers what was last sent to and read from the rig.
+
+A value is fresh for ttl seconds after it was last sent or reported.
+A SET of a value still fresh is redundant, whether the rig has confirmed
+it (an OK, a response or a transceive update) or it is still on its way
+and may yet be refused. A refused SET (NG), or one the rig never
+answered, is forgotten so the same SET sent again goes to the rig. Only
+confirmed values answer a GET. Frequencies are compared at the rig's
+tuning resolution, the FT-817 only takes 10Hz steps so 14.100003 and
+14.100007 are the same frequency to it. The FT-817 acknowledges nothing,
+so its SETs stay unconfirmed and are compared as sent.
+
+PTT is tracked but a PTT set is never redundant, the rig may have
+dropped out of transmit on its own (e.g. time-out timer) and transmit
+control must always reach the rig.
+
+"""
+
+# State items
+STATE_FREQ = 'freq'
+STATE_MODE = 'mode'
+STATE_PTT = 'ptt'
+
+# Commands that set state
+SET_COMMANDS = {
+	CAT_FREQ_SET: STATE_FREQ,
+	CAT_MODE_SET: STATE_MODE,
+	CAT_PTT: STATE_PTT,
+	CAT_PTT_SET: STATE_PTT,
+}
+# Commands that read state
+GET_COMMANDS = {
+	CAT_FREQ_GET: STATE_FREQ,
+	CAT_MODE_GET: STATE_MODE,
+	CAT_PTT_GET: STATE_PTT,
+}
+# Sets that are always sent
+ALWAYS_SEND = (STATE_PTT, )
+
+#======================================================================================
+# Rig state mirror
+class RigState:
+
+	def __init__(self, resolution, ttl):
+		"""
+		Constructor
+
+		Arguments
+			resolution	--	rig tuning step in Hz
+			ttl			--	seconds a value stays fresh
+		"""
+
+		self.__resolution = resolution
+		self.__ttl = ttl
+		self.__lock = threading.Lock()
+		# item -> (value, time set, confirmed by the rig)
+		self.__items = {}
+		self.__suppressed = 0
+
+	#======================================================================================
+	# PUBLIC interface
+	def snap(self, freq):
+		"""
+		Return freq in Hz rounded down to the rig resolution
+
+		Arguments:
+			freq	--	frequency in Hz
+
+		"""
+
+		freq = int(freq)
+		return freq - (freq % self.__resolution)
+
+	#-----------------------------------------------
+	def redundant(self, cat_cmd, params):
+		"""
+		True if this value was sent or confirmed within the ttl, counted as suppressed
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	required parameters for the command
+
+		"""
+
+		item = SET_COMMANDS.get(cat_cmd)
+		if item == None or item in ALWAYS_SEND:
+			return False
+		value = self.__normalise(item, params)
+		with self.__lock:
+			entry = self.__items.get(item)
+			if entry != None and entry[0] == value and monotonic() - entry[1] < self.__ttl:
+				self.__suppressed += 1
+				return True
+		return False
+
+	#-----------------------------------------------
+	def requested(self, cat_cmd, params):
+		"""
+		Record a SET sent to the rig, unconfirmed until the rig reports it
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	required parameters for the command
+
+		"""
+
+		item = SET_COMMANDS.get(cat_cmd)
+		if item == None:
+			return
+		value = self.__normalise(item, params)
+		with self.__lock:
+			entry = self.__items.get(item)
+			if entry != None and entry[2] and entry[0] == value and monotonic() - entry[1] < self.__ttl:
+				# Sent anyway (PTT), the rig already confirmed it
+				return
+			self.__items[item] = (value, monotonic(), False)
+
+	#-----------------------------------------------
+	def accepted(self, cat_cmd, params):
+		"""
+		Record the rig's OK to a SET, the value is confirmed unless superseded
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	parameters the SET was sent with
+
+		"""
+
+		self.__settle(cat_cmd, params, True)
+
+	#-----------------------------------------------
+	def refused(self, cat_cmd, params):
+		"""
+		Forget a SET the rig refused (NG) or never answered
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	parameters the SET was sent with
+
+		"""
+
+		self.__settle(cat_cmd, params, False)
+
+	#-----------------------------------------------
+	def confirm(self, response):
+		"""
+		Record a value reported by the rig
+
+		Arguments:
+			response	--	decoded response tuple (ok, cat_cmd, value)
+
+		"""
+
+		ok, cat_cmd, value = response
+		item = GET_COMMANDS.get(cat_cmd)
+		if ok and item != None:
+			with self.__lock:
+				self.__items[item] = (self.__normalise(item, value), monotonic(), True)
+
+	#-----------------------------------------------
+	def cached(self, cat_cmd):
+		"""
+		Return a response tuple for a GET if the confirmed value is fresh, else None
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+
+		"""
+
+		item = GET_COMMANDS.get(cat_cmd)
+		if item == None:
+			return None
+		with self.__lock:
+			entry = self.__items.get(item)
+			if entry != None and entry[2] and monotonic() - entry[1] < self.__ttl:
+				return True, cat_cmd, entry[0]
+		return None
+
+	#-----------------------------------------------
+	def invalidate(self):
+		""" Forget everything, e.g. the link went down """
+
+		with self.__lock:
+			self.__items.clear()
+
+	#-----------------------------------------------
+	def suppressed(self):
+		""" Number of redundant SETs dropped """
+
+		return self.__suppressed
+
+	#======================================================================================
+	# PRIVATE interface
+	def __settle(self, cat_cmd, params, ok):
+		""" Confirm or drop the pending value of a SET if it is still the latest """
+
+		item = SET_COMMANDS.get(cat_cmd)
+		if item == None:
+			return
+		value = self.__normalise(item, params)
+		with self.__lock:
+			entry = self.__items.get(item)
+			if entry == None or entry[2] or entry[0] != value:
+				# Confirmed or superseded by a later SET
+				return
+			if ok:
+				self.__items[item] = (value, monotonic(), True)
+			else:
+				del self.__items[item]
+
+	#-----------------------------------------------
+	def __normalise(self, item, value):
+		""" Comparable form of a value """
+
+		if item == STATE_FREQ:
+			return self.snap(value)
+		if item == STATE_MODE:
+			return value.lower()
+		return value
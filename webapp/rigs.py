@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# rigs.py
+#
+# Registry of the rigs driven by the console
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import queue
+
+# Library imports
+
+# Application imports
+from defs import *
+import cat
+import channel
+import tuning
+
+"""
+
+One process can drive several rigs. Each rig has its own context - CAT
+instance (so its own thread, command queue, state cache and serial
+port), event channel and tuning state - and is known by a short id
+that appears in the URL (/rig/<id>) or as the 'rig' parameter of every
+service call. Requests without a rig id go to the first rig configured,
+so a single rig console works as it always has.
+
+"""
+
+# Tuning state of a rig never saved, Hz
+DEFAULT_FREQ = 7100000
+DEFAULT_STEP = 10000
+
+#=====================================================
+# Everything belonging to one rig
+#=====================================================
+class RigContext:
+
+    def __init__(self, rig_id, rig, port, baud, model = None):
+        """
+        Constructor
+
+        Arguments:
+            rig_id  --  short id used in URLs
+            rig     --  rig type, FT817ND or IC7100
+            port    --  serial port the rig is on
+            baud    --  baud rate the rig is set to
+            model   --  ConsoleModel to resume from and save to, or None
+
+        """
+
+        self.rig_id = rig_id
+        self.rig = rig
+        self.port = port
+        self.baud = baud
+        # CAT responses
+        self.cat_q = queue.Queue()
+        self.cat = cat.CAT(rig, port, baud, self.cat_q, name = rig_id)
+        # Updates to every browser showing this rig
+        self.channel = channel.EventChannel()
+        # Where the operator left off, None if never saved
+        self.model = model
+        self.saved = model.get_rig(rig_id) if model != None else None
+        # Tuning state, shared by every browser
+        freq = self.saved['freq'] if self.saved != None else DEFAULT_FREQ
+        self.tuning = tuning.TuningEngine(freq, DEFAULT_STEP, self.cat.resolution(), self.send_frequency)
+
+    #-------------------------------------------------
+    # Start CAT, putting the rig back as it was left
+    def run(self, callback):
+        self.cat.set_callback(callback)
+        if self.saved != None:
+            # Held by CAT until the port is open
+            self.cat.do_command(CAT_MODE_SET, self.saved['mode'])
+            self.cat.do_command(CAT_FREQ_SET, self.saved['freq'])
+            self.channel.publish('mode', self.saved['mode'].upper())
+            self.channel.publish('freq', freq_string(self.saved['freq']))
+        return self.cat.run()
+
+    #-------------------------------------------------
+    # Send a new frequency to the rig and all browsers
+    # The tuning engine calls this with its lock held, it must not block
+    def send_frequency(self, hz):
+        self.cat.do_command(CAT_FREQ_SET, hz)
+        self.remember(freq = hz)
+        self.channel.publish('freq', freq_string(hz))
+
+    #-------------------------------------------------
+    # Record the rig state in the model, written behind
+    def remember(self, mode = None, freq = None):
+        if self.model != None:
+            self.model.update_model(self.rig_id, mode, freq)
+
+    #-------------------------------------------------
+    # Stop CAT and close the channel
+    def terminate(self):
+        self.channel.close()
+        self.cat.terminate()
+
+#-------------------------------------------------
+# The UI wants a 9 digit string
+def freq_string(hz):
+    return str(hz).rjust(9, '0')
+
+#=====================================================
+# All rigs
+#=====================================================
+class RigRegistry:
+
+    def __init__(self):
+
+        # Contexts by id in configuration order
+        self.__rigs = {}
+        self.__default = None
+
+    #==============================================================================================
+    # PUBLIC
+    #==============================================================================================
+
+    #-------------------------------------------------
+    # Create and start a context for each rig
+    def open(self, config, callback_for, model = None):
+        """
+        Open every configured rig
+
+        Arguments:
+            config          --  sequence of (rig_id, rig, port, baud)
+            callback_for    --  callable(context) returning the callback
+                                for unsolicited updates from that rig
+            model           --  ConsoleModel holding each rig's last state
+
+        """
+
+        for rig_id, rig, port, baud in config:
+            if rig_id in self.__rigs:
+                raise ValueError('Duplicate rig id %s' % rig_id)
+            context = RigContext(rig_id, rig, port, baud, model)
+            self.__rigs[rig_id] = context
+            if self.__default == None:
+                self.__default = context
+            # A rig that is off does not stop the others, its CAT keeps trying
+            context.run(callback_for(context))
+
+    #-------------------------------------------------
+    # Context for a rig id, None for the default
+    def get(self, rig_id = None):
+        """
+        Return the context for rig_id, the default rig if rig_id is None or empty
+        Raises KeyError for an unknown id
+
+        Arguments:
+            rig_id  --  rig id from the request
+
+        """
+
+        if rig_id == None or rig_id == '':
+            if self.__default == None:
+                raise KeyError('No rigs configured')
+            return self.__default
+        return self.__rigs[rig_id]
+
+    #-------------------------------------------------
+    # All rig ids in configuration order
+    def ids(self):
+        return list(self.__rigs.keys())
+
+    #-------------------------------------------------
+    # All contexts in configuration order
+    def contexts(self):
+        return list(self.__rigs.values())
+
+    #-------------------------------------------------
+    # Stop everything
+    def terminate(self):
+        for context in self.__rigs.values():
+            context.terminate()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+#
+# rigsim.py
+#
+# Virtual FT-817ND and IC-7100 on a pseudo-terminal
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import abc
+import tty
+import select
+import threading
+import time
+import traceback
+
+# Application imports
+from defs import *
+import bcd
+import civ
+
+"""
+
+A simulated rig sits on the master side of a pty, the slave side is a
+normal serial device so the CAT code opens it unchanged -
+
+	sim = rigsim.FT817Sim(latency = 0.01)
+	sim.start()
+	c = cat.CAT(FT817ND, sim.port, BAUD, q)
+
+Timing is modelled with a clock. Each command costs its own wire time,
+the response latency and the wire time of everything sent back, where
+wire time is bytes x bits per character / baud. With the default
+RealClock that time is slept so the link behaves like the real serial
+line. A VirtualClock only adds the time up, the rig answers at once and
+clock.time() says how long the scenario would have taken on the air, so
+long runs finish faster than real time.
+
+Run standalone to put a rig on a pty for the web console -
+	python rigsim.py FT-817ND|IC7100 [latency ms] [baud]
+
+"""
+
+# Bits per character for 8 data bits, no parity and 1 stop bit plus the start bit
+CHAR_BITS = 10
+
+#======================================================================================
+# Clocks
+class RealClock:
+	""" Wall clock, sleeps really sleep """
+
+	def __init__(self):
+		self.__t0 = time.monotonic()
+
+	def time(self):
+		return time.monotonic() - self.__t0
+
+	def sleep(self, secs):
+		if secs > 0:
+			time.sleep(secs)
+
+class VirtualClock:
+	""" Simulated clock, time only moves when something sleeps """
+
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__t = 0.0
+
+	def time(self):
+		with self.__lock:
+			return self.__t
+
+	def sleep(self, secs):
+		if secs > 0:
+			with self.__lock:
+				self.__t += secs
+
+#======================================================================================
+# Common pty and timing handling
+class RigSim(threading.Thread, abc.ABC):
+
+	def __init__(self, latency = 0.0, baud = BAUD, guard = 0.0, clock = None):
+		"""
+		Constructor
+
+		Arguments
+			latency	--	seconds between the end of a command and the start of its response
+			baud	--	line rate used for pacing, None for no pacing
+			guard	--	commands arriving sooner than this after the previous
+						one finished are dropped, as a busy rig would
+			clock	--	RealClock (default) or VirtualClock
+		"""
+
+		super(RigSim, self).__init__()
+		self.daemon = True
+
+		self.__latency = latency
+		if baud:
+			self.__char_time = CHAR_BITS / baud
+		else:
+			self.__char_time = 0.0
+		self.__guard = guard
+		self.clock = clock if clock != None else RealClock()
+
+		# The pty, the CAT code opens the slave side
+		self.__master, self.__slave = os.openpty()
+		tty.setraw(self.__master)
+		tty.setraw(self.__slave)
+		self.port = os.ttyname(self.__slave)
+
+		self.__terminate = False
+		self.__busy_until = None
+		self.__lock = threading.Lock()
+		# Counters
+		self.__counts = {
+			'frames_in': 0,
+			'frames_out': 0,
+			'bytes_in': 0,
+			'bytes_out': 0,
+			'dropped': 0,
+			'ng': 0,
+		}
+		self.__by_cmd = {}
+
+	#======================================================================================
+	# PUBLIC interface
+	def terminate(self):
+		""" Stop the simulator and close the pty """
+
+		self.__terminate = True
+		self.join(1.0)
+		for fd in (self.__master, self.__slave):
+			try:
+				os.close(fd)
+			except OSError:
+				pass
+
+	#-----------------------------------------------
+	def stats(self):
+		""" Return a dict of the frame counters """
+
+		with self.__lock:
+			s = dict(self.__counts)
+			s['by_cmd'] = dict(self.__by_cmd)
+		s['clock'] = self.clock.time()
+		return s
+
+	#-----------------------------------------------
+	def reset_stats(self):
+		""" Zero the frame counters """
+
+		with self.__lock:
+			for key in self.__counts:
+				self.__counts[key] = 0
+			self.__by_cmd.clear()
+
+	#-----------------------------------------------
+	def run(self):
+		""" Thread entry point """
+
+		buf = bytearray()
+		while not self.__terminate:
+			try:
+				r, w, x = select.select([self.__master], [], [], 0.1)
+				if len(r) == 0:
+					continue
+				data = os.read(self.__master, 4096)
+			except OSError:
+				break
+			if len(data) == 0:
+				continue
+			buf.extend(data)
+			try:
+				while True:
+					frame = self.next_frame(buf)
+					if frame == None:
+						break
+					self.__command(frame)
+			except Exception as e:
+				print("Error in rig simulator [%s]" % traceback.format_exc())
+
+	#======================================================================================
+	# PROTECTED interface, for the rig classes
+	@abc.abstractmethod
+	def next_frame(self, buf):
+		""" Remove and return the next complete command from buf or None """
+
+	@abc.abstractmethod
+	def execute(self, frame):
+		""" Act on a command, return a list of frames to send and the command key """
+
+	def send(self, frame):
+		""" Send a frame now, paced at the line rate """
+
+		self.clock.sleep(len(frame) * self.__char_time)
+		try:
+			os.write(self.__master, frame)
+		except OSError:
+			return
+		with self.__lock:
+			self.__counts['frames_out'] += 1
+			self.__counts['bytes_out'] += len(frame)
+
+	def count_ng(self):
+		with self.__lock:
+			self.__counts['ng'] += 1
+
+	#======================================================================================
+	# PRIVATE interface
+	def __command(self, frame):
+		""" Process one command from the controller """
+
+		# The command took this long to arrive
+		self.clock.sleep(len(frame) * self.__char_time)
+		now = self.clock.time()
+		with self.__lock:
+			self.__counts['frames_in'] += 1
+			self.__counts['bytes_in'] += len(frame)
+		if self.__guard > 0 and self.__busy_until != None and now < self.__busy_until:
+			# Still working on the last one
+			with self.__lock:
+				self.__counts['dropped'] += 1
+			return
+		responses, key = self.execute(frame)
+		with self.__lock:
+			self.__by_cmd[key] = self.__by_cmd.get(key, 0) + 1
+		if len(responses) > 0:
+			self.clock.sleep(self.__latency)
+			for response in responses:
+				self.send(response)
+		self.__busy_until = self.clock.time() + self.__guard
+
+#======================================================================================
+# FT-817ND
+class FT817Sim(RigSim):
+
+	"""
+	Commands are 5 bytes, 4 parameter bytes then the command byte. The
+	FT-817 does not echo and only answers the read commands.
+	"""
+
+	# Command bytes
+	LOCK_ON = 0x00
+	LOCK_OFF = 0x80
+	PTT_ON = 0x08
+	PTT_OFF = 0x88
+	SET_FREQ = 0x01
+	SET_MODE = 0x07
+	FREQ_MODE_GET = 0x03
+	TX_STATUS = 0xF7
+	# Mode ids
+	MODES = (0x00, 0x01, 0x02, 0x03, 0x04, 0x06, 0x08, 0x0A, 0x0C)
+
+	def __init__(self, freq = 7100000, mode = 0x01, **kwargs):
+		"""
+		Constructor
+
+		Arguments
+			freq	--	initial frequency in Hz
+			mode	--	initial mode id
+			kwargs	--	see RigSim
+		"""
+
+		super(FT817Sim, self).__init__(**kwargs)
+		self.freq = freq - (freq % 10)
+		self.mode = mode
+		self.ptt = False
+		self.lock = False
+
+	def next_frame(self, buf):
+		if len(buf) < 5:
+			return None
+		frame = bytes(buf[:5])
+		del buf[:5]
+		return frame
+
+	def execute(self, frame):
+		cmd = frame[4]
+		if cmd == self.SET_FREQ:
+			self.freq = bcd.decode_msb4(frame, 0) * 10
+		elif cmd == self.SET_MODE:
+			if frame[0] in self.MODES:
+				self.mode = frame[0]
+		elif cmd == self.FREQ_MODE_GET:
+			response = bytearray(5)
+			bcd.encode_msb4_into(response, 0, self.freq // 10)
+			response[4] = self.mode
+			return [bytes(response)], cmd
+		elif cmd == self.TX_STATUS:
+			# Bit 7 clear when transmitting
+			return [bytes([0x00 if self.ptt else 0x80])], cmd
+		elif cmd == self.PTT_ON:
+			self.ptt = True
+		elif cmd == self.PTT_OFF:
+			self.ptt = False
+		elif cmd == self.LOCK_ON:
+			self.lock = True
+		elif cmd == self.LOCK_OFF:
+			self.lock = False
+		return [], cmd
+
+#======================================================================================
+# IC-7100
+class IC7100Sim(RigSim):
+
+	"""
+	CI-V is a bus so every command is echoed back to the controller. A
+	command to the rig is answered with data, OK (FB) or NG (FA). With
+	transceive on, a change made at the rig (local_tune, local_mode) is
+	broadcast to address 00.
+	"""
+
+	# Command numbers
+	SET_FREQ_TX = 0x00
+	SET_MODE_TX = 0x01
+	GET_FREQ = 0x03
+	GET_MODE = 0x04
+	SET_FREQ = 0x05
+	SET_MODE = 0x06
+	SETTINGS = 0x1A
+	STATUS = 0x1C
+	# Mode ids
+	MODES = (0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x17)
+
+	def __init__(self, freq = 7100000, mode = 0x01, rig_addr = civ.RIG_ADDR, transceive = True, **kwargs):
+		"""
+		Constructor
+
+		Arguments
+			freq		--	initial frequency in Hz
+			mode		--	initial mode id
+			rig_addr	--	CI-V address of the rig
+			transceive	--	broadcast local changes
+			kwargs		--	see RigSim
+		"""
+
+		super(IC7100Sim, self).__init__(**kwargs)
+		self.freq = freq
+		self.mode = mode
+		self.ptt = False
+		self.lock = False
+		self.__rig_addr = rig_addr
+		self.__transceive = transceive
+
+	#-----------------------------------------------
+	def local_tune(self, freq):
+		""" Tune at the rig front panel """
+
+		self.freq = freq
+		if self.__transceive:
+			self.send(self.__frame(civ.BROADCAST_ADDR, self.SET_FREQ_TX, self.__freq_data()))
+
+	def local_mode(self, mode):
+		""" Change mode at the rig front panel """
+
+		self.mode = mode
+		if self.__transceive:
+			self.send(self.__frame(civ.BROADCAST_ADDR, self.SET_MODE_TX, bytes([mode, 0x01])))
+
+	#-----------------------------------------------
+	def next_frame(self, buf):
+		while True:
+			start = buf.find(b'\xfe\xfe')
+			if start < 0:
+				# Keep a trailing FE
+				del buf[:max(0, len(buf) - 1)]
+				return None
+			end = buf.find(b'\xfd', start)
+			if end < 0:
+				del buf[:start]
+				return None
+			frame = bytes(buf[start:end + 1])
+			del buf[:end + 1]
+			if len(frame) >= civ.MIN_FRAME:
+				return frame
+
+	def execute(self, frame):
+		# Everything on the bus comes back to the sender
+		responses = [frame]
+		if frame[civ.TO] != self.__rig_addr:
+			return responses, None
+		ctrl = frame[civ.FROM]
+		cmd = frame[civ.CMD]
+		data = frame[civ.CMD + 1:-1]
+		ok = True
+		if cmd in (self.SET_FREQ_TX, self.SET_FREQ):
+			if len(data) == 5:
+				self.freq = bcd.decode_lsb5(data, 0)
+			else:
+				ok = False
+		elif cmd in (self.SET_MODE_TX, self.SET_MODE):
+			if len(data) > 0 and data[0] in self.MODES:
+				self.mode = data[0]
+			else:
+				ok = False
+		elif cmd == self.GET_FREQ:
+			responses.append(self.__frame(ctrl, cmd, self.__freq_data()))
+			return responses, cmd
+		elif cmd == self.GET_MODE:
+			responses.append(self.__frame(ctrl, cmd, bytes([self.mode, 0x01])))
+			return responses, cmd
+		elif cmd == self.SETTINGS and data[:3] == b'\x05\x00\x14' and len(data) == 4:
+			self.lock = data[3] == 0x01
+		elif cmd == self.STATUS and data[:1] == b'\x00' and len(data) == 2:
+			self.ptt = data[1] == 0x01
+		else:
+			ok = False
+		if ok:
+			responses.append(self.__frame(ctrl, civ.OK, b''))
+		else:
+			self.count_ng()
+			responses.append(self.__frame(ctrl, civ.NG, b''))
+		return responses, cmd
+
+	#-----------------------------------------------
+	def __frame(self, to, cmd, data):
+		return b''.join((bytes([civ.PREAMBLE, civ.PREAMBLE, to, self.__rig_addr, cmd]), data, bytes([civ.EOM])))
+
+	def __freq_data(self):
+		data = bytearray(5)
+		bcd.encode_lsb5_into(data, 0, self.freq)
+		return bytes(data)
+
+# Simulator for each rig type
+SIMULATORS = {
+	FT817ND: FT817Sim,
+	IC7100: IC7100Sim,
+}
+
+#======================================================================================
+# Main code
+def main():
+	if len(sys.argv) < 2 or sys.argv[1] not in SIMULATORS:
+		print('Usage: python rigsim.py %s [latency ms] [baud]' % '|'.join(SIMULATORS))
+		return
+	latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+	baud = int(sys.argv[3]) if len(sys.argv) > 3 else BAUD
+	sim = SIMULATORS[sys.argv[1]](latency = latency, baud = baud)
+	sim.start()
+	print('%s simulator on %s' % (sys.argv[1], sim.port))
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	print(sim.stats())
+	sim.terminate()
+
+# Entry point
+if __name__ == '__main__':
+	main()
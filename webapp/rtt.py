@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+# rtt.py
+#
+# Response timeouts from measured round trip times
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Application imports
+from defs import *
+
+"""
+
+The command set TIMEOUT is how long a rig may take at worst, seconds.
+Waiting that long for a response that was lost stalls every command
+queued behind it, so the time to wait is worked out from how long the
+rig actually takes, as TCP does (RFC 6298) -
+
+	first sample	SRTT = R, RTTVAR = R/2
+	then			RTTVAR = 3/4 RTTVAR + 1/4 |SRTT - R|
+					SRTT = 7/8 SRTT + 1/8 R
+	timeout			SRTT + 4 RTTVAR, within CAT_RTO_MIN and TIMEOUT
+
+The timeout starts at TIMEOUT until there is a sample and doubles on
+each timeout, back to the estimate with the next good sample. A response
+to a resent command is not sampled as it may answer the first send.
+
+One estimator per command type, a mode read and a frequency set do not
+take the same time.
+
+Round trips and timeouts run from when the command's last byte leaves
+the wire (shaper.py), not from the write, which may be ahead of it.
+
+"""
+
+#======================================================================================
+# Round trip estimator for one command
+class RttEstimator:
+
+	def __init__(self, ceiling, floor = CAT_RTO_MIN):
+		"""
+		Constructor
+
+		Arguments
+			ceiling	--	longest timeout, the command set TIMEOUT
+			floor	--	shortest timeout
+		"""
+
+		self.__ceiling = float(ceiling)
+		self.__floor = min(floor, self.__ceiling)
+		self.__srtt = None
+		self.__rttvar = 0.0
+		self.__rto = self.__ceiling
+
+	#======================================================================================
+	# PUBLIC interface
+	def timeout(self):
+		""" Seconds to wait for the next response """
+
+		return self.__rto
+
+	#-----------------------------------------------
+	def sample(self, rtt):
+		"""
+		Add a measured round trip
+
+		Arguments:
+			rtt	--	seconds from the command written to its response read
+
+		"""
+
+		if self.__srtt == None:
+			self.__srtt = rtt
+			self.__rttvar = rtt / 2.0
+		else:
+			self.__rttvar = 0.75 * self.__rttvar + 0.25 * abs(self.__srtt - rtt)
+			self.__srtt = 0.875 * self.__srtt + 0.125 * rtt
+		self.__rto = min(self.__ceiling, max(self.__floor, self.__srtt + 4.0 * self.__rttvar))
+
+	#-----------------------------------------------
+	def backoff(self):
+		""" A response did not come, wait longer next time """
+
+		self.__rto = min(self.__ceiling, self.__rto * 2.0)
+
+	#-----------------------------------------------
+	def srtt(self):
+		""" Smoothed round trip in seconds, None before the first sample """
+
+		return self.__srtt
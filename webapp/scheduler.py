@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# scheduler.py
+#
+# Command scheduler for the CAT thread
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import threading
+import queue
+from collections import deque
+from time import monotonic
+
+# Application imports
+from defs import *
+
+"""
+
+Replaces the plain queue between the callers and the CAT thread.
+
+There are two lanes. The priority lane holds lock and PTT off and is
+always served first, so the transmitter is released without waiting
+behind tuning traffic. PTT off also drops any PTT on still waiting, that
+would key the rig again after it. The normal lane holds everything else
+in arrival order, PTT on included, so the rig transmits on the frequency
+and mode asked for before it.
+
+Commands where only the final value matters (frequency, mode, lock) are
+coalesced. If one of these is still waiting when another of the same type
+arrives the waiting command takes the new value and keeps its place, so a
+fast dial produces one frequency write per link slot rather than a backlog.
+
+Any other command (e.g. a query) is a barrier. A set queued before it is
+never updated by a set queued after it, so the query sees the state that
+was asked for before it.
+
+"""
+
+# Commands served ahead of everything else
+PRIORITY_COMMANDS = (CAT_LOCK, )
+# Transmit control, only PTT off is served ahead
+PTT_COMMANDS = (CAT_PTT, CAT_PTT_SET)
+# Commands where only the latest value matters
+COALESCE_COMMANDS = (CAT_FREQ_SET, CAT_MODE_SET, CAT_LOCK)
+
+#======================================================================================
+# Scheduler for CAT commands
+class CommandScheduler:
+
+	def __init__(self):
+		"""
+		Constructor
+
+		Arguments
+
+		"""
+
+		self.__cond = threading.Condition()
+		self.__priority = deque()
+		self.__normal = deque()
+		# Waiting coalescable entries by command, one map per lane
+		self.__priority_waiting = {}
+		self.__normal_waiting = {}
+		self.__closed = False
+		# Commands absorbed into a waiting command
+		self.__coalesced = 0
+
+	#======================================================================================
+	# PUBLIC interface
+	def put(self, cat_cmd, params, future = None):
+		"""
+		Schedule a command
+
+		Arguments:
+			cat_cmd	-- 	from the CAT command enumerations
+			params	--	required parameters for the command
+			future	--	resolved with the response, never coalesced
+
+		Returns True if the command was absorbed into a waiting command
+
+		"""
+
+		with self.__cond:
+			if cat_cmd in PTT_COMMANDS and not params:
+				self.__drop_ptt_on()
+				lane = self.__priority
+				waiting = self.__priority_waiting
+			elif cat_cmd in PRIORITY_COMMANDS:
+				lane = self.__priority
+				waiting = self.__priority_waiting
+			else:
+				lane = self.__normal
+				waiting = self.__normal_waiting
+			if cat_cmd in COALESCE_COMMANDS and future == None:
+				entry = waiting.get(cat_cmd)
+				if entry != None:
+					# Take the new value in the same place
+					entry[1] = params
+					self.__coalesced += 1
+					return True
+				entry = [cat_cmd, params, None, monotonic()]
+				waiting[cat_cmd] = entry
+			else:
+				# Barrier, nothing queued before this can be updated
+				entry = [cat_cmd, params, future, monotonic()]
+				waiting.clear()
+			lane.append(entry)
+			self.__cond.notify()
+			return False
+
+	#-----------------------------------------------
+	def get(self, block = True, timeout = None):
+		"""
+		Return the next command as (cat_cmd, params, future, queued)
+		where queued is the monotonic time it was first queued.
+		Raises queue.Empty if nothing is available, as for queue.Queue
+
+		Arguments:
+			block	--	wait for a command
+			timeout	--	max time to wait if blocking
+
+		"""
+
+		with self.__cond:
+			if block:
+				self.__cond.wait_for(self.__ready, timeout)
+			if len(self.__priority) > 0:
+				entry = self.__priority.popleft()
+				waiting = self.__priority_waiting
+			elif len(self.__normal) > 0:
+				entry = self.__normal.popleft()
+				waiting = self.__normal_waiting
+			else:
+				raise queue.Empty
+			if waiting.get(entry[0]) is entry:
+				del waiting[entry[0]]
+			return tuple(entry)
+
+	#-----------------------------------------------
+	def get_if(self, accept):
+		"""
+		Return the next command as get() does if accept(cat_cmd) is
+		True, otherwise None. Never blocks. Returns None while anything
+		is in the priority lane, that goes first.
+
+		Arguments:
+			accept	--	callable(cat_cmd) returning True to take it
+
+		"""
+
+		with self.__cond:
+			if len(self.__priority) > 0 or len(self.__normal) == 0:
+				return None
+			entry = self.__normal[0]
+			if not accept(entry[0]):
+				return None
+			self.__normal.popleft()
+			if self.__normal_waiting.get(entry[0]) is entry:
+				del self.__normal_waiting[entry[0]]
+			return tuple(entry)
+
+	#-----------------------------------------------
+	def close(self):
+		""" Wake any waiting consumer, used at terminate """
+
+		with self.__cond:
+			self.__closed = True
+			self.__cond.notify_all()
+
+	#-----------------------------------------------
+	def flush(self):
+		""" Remove and return all waiting commands as (cat_cmd, params, future, queued) """
+
+		with self.__cond:
+			entries = [tuple(entry) for entry in self.__priority] + [tuple(entry) for entry in self.__normal]
+			self.__priority.clear()
+			self.__normal.clear()
+			self.__priority_waiting.clear()
+			self.__normal_waiting.clear()
+			return entries
+
+	#-----------------------------------------------
+	def qsize(self):
+		""" Number of commands waiting """
+
+		with self.__cond:
+			return len(self.__priority) + len(self.__normal)
+
+	#-----------------------------------------------
+	def coalesced(self):
+		""" Number of commands absorbed into a waiting command """
+
+		return self.__coalesced
+
+	#======================================================================================
+	# PRIVATE interface
+	def __ready(self):
+		""" Wait predicate """
+
+		return self.__closed or len(self.__priority) > 0 or len(self.__normal) > 0
+
+	#-----------------------------------------------
+	def __drop_ptt_on(self):
+		""" Remove every PTT on waiting in the normal lane, called with the lock held """
+
+		for entry in [e for e in self.__normal if e[0] in PTT_COMMANDS and e[1]]:
+			self.__normal.remove(entry)
+			if entry[2] != None:
+				entry[2].cancel()
+			self.__coalesced += 1
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# shaper.py
+#
+# Paces CAT frames to the serial line rate and the rig's processing time
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+from time import monotonic
+
+# Library imports
+import serial
+
+"""
+
+A character on the wire is a start bit, 8 data bits, the parity bit if
+any and the stop bits, so at 9600 baud 8N1 a 5 byte Yaesu frame takes
+5.2ms and an 11 byte CI-V frequency set 11.5ms.
+
+The shaper is a token bucket of bytes that fills at the line rate and
+holds the command set's BURST bytes, what may sit in the port's output
+buffer ahead of the wire. A frame written while the one before is still
+going out starts on the wire when that one ends, so with no guard time
+writes run up to BURST bytes ahead of the wire and only wait when the
+buffer is full.
+
+A command set with a GUARD_TIME, the time the rig needs to act on a
+frame, cannot have a frame queued behind another, the UART would send
+it at once. The next write then waits until the guard time after the
+last frame leaves the wire, so the rig is not sent a frame while it is
+still busy with the last one.
+
+The shaper works out when each frame's last byte leaves the wire,
+wire_free() gives it for the last frame booked.
+
+reserve() books a frame and returns how long to wait before writing it,
+so the threaded engine can sleep and the asyncio engine can await.
+
+"""
+
+# Data bits per character, the rigs all use 8
+DATA_BITS = 8
+
+#-------------------------------------------------
+# Bits on the wire per byte
+def bits_per_char(parity, stop_bits, data_bits = DATA_BITS):
+	return 1 + data_bits + (0 if parity == serial.PARITY_NONE else 1) + stop_bits
+
+#======================================================================================
+# Link shaper for one serial port
+class LinkShaper:
+
+	def __init__(self, baud, parity, stop_bits, guard = 0.0, burst = 1, clock = monotonic):
+		"""
+		Constructor
+
+		Arguments
+			baud		--	line rate
+			parity		--	pyserial parity
+			stop_bits	--	pyserial stop bits
+			guard		--	seconds the rig needs after a frame
+			burst		--	bytes that may be written ahead of the wire
+			clock		--	time source in seconds
+		"""
+
+		self.__char_time = bits_per_char(parity, stop_bits) / float(baud)
+		self.__guard = guard
+		self.__burst = max(1, burst)
+		self.__clock = clock
+		self.__tokens = float(self.__burst)
+		self.__filled = clock()
+		# When the last frame booked leaves the wire
+		self.__wire_free = 0.0
+		# When the rig will take another frame
+		self.__ready = 0.0
+		# Totals
+		self.__frames = 0
+		self.__bytes = 0
+		self.__waited = 0.0
+
+	#======================================================================================
+	# PUBLIC interface
+	def reserve(self, n):
+		"""
+		Book a frame, return seconds to wait before writing it
+
+		Arguments:
+			n	--	bytes in the frame
+
+		"""
+
+		now = self.__clock()
+		tokens = min(self.__burst, self.__tokens + (now - self.__filled) / self.__char_time)
+		# Wait out the rig guard time, without one the frame queues behind the last
+		start = max(now, self.__ready) if self.__guard > 0 else now
+		# and for room in the bucket
+		short = min(n, self.__burst) - tokens
+		if short > 0:
+			start = max(start, now + short * self.__char_time)
+		self.__tokens = min(self.__burst, tokens + (start - now) / self.__char_time) - n
+		self.__filled = start
+		# On the wire when written or when the frame ahead has gone
+		end = max(start, self.__wire_free) + n * self.__char_time
+		self.__wire_free = end
+		self.__ready = end + self.__guard
+		self.__frames += 1
+		self.__bytes += n
+		self.__waited += start - now
+		return start - now
+
+	#-----------------------------------------------
+	def wire_free(self):
+		""" When the last frame booked leaves the wire, clock time """
+
+		return self.__wire_free
+
+	#-----------------------------------------------
+	def frame_time(self, n):
+		""" Seconds n bytes take on the wire """
+
+		return n * self.__char_time
+
+	#-----------------------------------------------
+	def stats(self):
+		""" Frames and bytes booked and seconds waited """
+
+		return {'frames': self.__frames, 'bytes': self.__bytes, 'waited': self.__waited}
+
+#-------------------------------------------------
+# The shaper for a port opened with a compiled command set
+def for_command_set(command_set, baud):
+	return LinkShaper(baud, command_set.parity, command_set.stop_bits, command_set.guard, command_set.burst)
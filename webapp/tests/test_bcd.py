@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# test_bcd.py
+#
+# Packed BCD codec
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import pytest
+
+# Application imports
+import bcd
+
+"""
+
+Run from the webapp directory:
+	python -m pytest -q tests
+
+"""
+
+#==============================================================================================
+# Round trips
+#==============================================================================================
+
+FREQS = (0, 1, 9, 10, 99, 100, 1800000, 7100000, 14234560, 14346000, 145500000, 470000000, 9999999999)
+
+@pytest.mark.parametrize('freq', FREQS)
+def test_lsb5_round_trip(freq):
+	buf = bytearray(5)
+	bcd.encode_lsb5_into(buf, 0, freq)
+	assert buf == bcd.encode_lsb(freq, 5)
+	assert bcd.decode_lsb5(buf, 0) == freq
+	assert bcd.decode_lsb(buf, 0, 5) == freq
+
+@pytest.mark.parametrize('freq', FREQS[:-1])
+def test_msb4_round_trip(freq):
+	# Yaesu carries 10Hz units
+	value = freq // 10
+	buf = bytearray(4)
+	bcd.encode_msb4_into(buf, 0, value)
+	assert buf == bcd.encode_msb(value, 4)
+	assert bcd.decode_msb4(buf, 0) == value
+	assert bcd.decode_msb(buf, 0, 4) == value
+
+def test_known_frames():
+	assert bcd.encode_msb(1423456, 4) == bytes((0x01, 0x42, 0x34, 0x56))
+	assert bcd.encode_lsb(14346000, 5) == bytes((0x00, 0x60, 0x34, 0x14, 0x00))
+
+def test_offset_into_frame():
+	frame = bytearray(b'\xfe\xfe\x88\xe0\x05\x00\x00\x00\x00\x00\xfd')
+	bcd.encode_lsb5_into(frame, 5, 7074000)
+	assert frame == bytearray(b'\xfe\xfe\x88\xe0\x05\x00\x40\x07\x07\x00\xfd')
+	assert bcd.decode_lsb5(frame, 5) == 7074000
+
+#==============================================================================================
+# Range checks leave the frame untouched
+#==============================================================================================
+
+@pytest.mark.parametrize('encode, nbytes', (
+	(lambda buf, value: bcd.encode_msb4_into(buf, 1, value), 4),
+	(lambda buf, value: bcd.encode_lsb5_into(buf, 1, value), 5),
+	(lambda buf, value: bcd.encode_msb_into(buf, 1, value, 3), 3),
+	(lambda buf, value: bcd.encode_lsb_into(buf, 1, value, 3), 3),
+))
+@pytest.mark.parametrize('bad', ('over', 'negative'))
+def test_out_of_range(encode, nbytes, bad):
+	value = 100 ** nbytes if bad == 'over' else -1
+	frame = bytearray(range(1, 8))
+	before = bytes(frame)
+	with pytest.raises(ValueError):
+		encode(frame, value)
+	assert frame == before
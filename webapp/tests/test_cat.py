@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# test_cat.py
+#
+# CAT thread exchanges against scripted and simulated rigs
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import os, sys
+import tty
+import time
+import queue
+import threading
+import pytest
+
+# Application imports
+from defs import *
+import cat
+import rigsim
+
+"""
+
+Run from the webapp directory:
+	python -m pytest -q tests
+
+"""
+
+pytestmark = pytest.mark.skipif(sys.platform.startswith('win'), reason = 'needs a pty')
+
+# FT-817 read frequency and its reply, 14.100000 USB
+FT817_FREQ_GET = 0x03
+FT817_FREQ_REPLY = bytes((0x01, 0x41, 0x00, 0x00, 0x01))
+
+#==============================================================================================
+# A FT-817 on a pty that sends its replies as the test says
+#==============================================================================================
+
+class ScriptedFT817(threading.Thread):
+
+	def __init__(self):
+		super(ScriptedFT817, self).__init__()
+		self.daemon = True
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.master)
+		tty.setraw(self.slave)
+		self.port = os.ttyname(self.slave)
+		# (bytes sent at once, seconds before the rest or None for never), taken per read
+		self.script = []
+
+	def run(self):
+		buf = b''
+		while True:
+			try:
+				buf += os.read(self.master, 64)
+			except OSError:
+				return
+			while len(buf) >= 5:
+				frame, buf = buf[:5], buf[5:]
+				if frame[4] != FT817_FREQ_GET:
+					continue
+				split, gap = self.script.pop(0) if len(self.script) > 0 else (5, 0)
+				time.sleep(0.005)
+				os.write(self.master, FT817_FREQ_REPLY[:split])
+				if gap != None:
+					time.sleep(gap)
+					os.write(self.master, FT817_FREQ_REPLY[split:])
+
+	def close(self):
+		for fd in (self.master, self.slave):
+			os.close(fd)
+
+@pytest.fixture
+def ft817():
+	rig = ScriptedFT817()
+	rig.start()
+	c = cat.CAT(FT817ND, rig.port, 4800, queue.Queue(), name = 'scripted')
+	assert c.run()
+	yield c, rig
+	c.terminate()
+	rig.close()
+
+def read_freq(c):
+	# Past the state cache every time
+	c.get_state().invalidate()
+	return c.query(CAT_FREQ_GET).result(10)
+
+#==============================================================================================
+# Yaesu replies are only taken whole
+#==============================================================================================
+
+def test_yaesu_reply_split_at_the_deadline(ft817):
+	c, rig = ft817
+	# Learn the round trip
+	for i in range(3):
+		assert read_freq(c) == (True, CAT_FREQ_GET, 14100000)
+	rig.script.append((2, 0.03))
+	assert read_freq(c) == (True, CAT_FREQ_GET, 14100000)
+
+@pytest.mark.parametrize('gap', (None, 0.4))
+def test_yaesu_reply_cut_short(ft817, gap):
+	c, rig = ft817
+	for i in range(3):
+		assert read_freq(c) == (True, CAT_FREQ_GET, 14100000)
+	# The rest never comes, or comes after the read gave up on it
+	rig.script.append((2, gap))
+	assert read_freq(c) == (True, CAT_FREQ_GET, 14100000)
+	for i in range(3):
+		assert read_freq(c) == (True, CAT_FREQ_GET, 14100000)
+
+#==============================================================================================
+# Reads queued together, pipelined on CI-V
+#==============================================================================================
+
+@pytest.fixture(params = (FT817ND, IC7100))
+def sim(request):
+	s = rigsim.SIMULATORS[request.param](latency = 0.005)
+	s.start()
+	c = cat.CAT(request.param, s.port, 9600, queue.Queue(), name = 'sim' + request.param)
+	assert c.run()
+	yield c, request.param
+	c.terminate()
+	s.terminate()
+
+def test_unsupported_read_among_queued_reads(sim):
+	c, rig = sim
+	for i in range(3):
+		c.get_state().invalidate()
+		futures = [c.query(cmd) for cmd in (CAT_FREQ_GET, CAT_PTT_GET, CAT_MODE_GET)]
+		results = []
+		for f in futures:
+			try:
+				results.append(f.result(5))
+			except LookupError:
+				results.append(None)
+		assert results[0] == (True, CAT_FREQ_GET, 7100000)
+		assert results[2][:2] == (True, CAT_MODE_GET)
+		if results[1] != None:
+			assert results[1][:2] == (True, CAT_PTT_GET)
+	# The thread is still serving
+	c.do_command(CAT_FREQ_SET, 14100000)
+	assert c.query(CAT_FREQ_GET).result(5) == (True, CAT_FREQ_GET, 14100000)
+
+#==============================================================================================
+# An idle thread waits on the scheduler
+#==============================================================================================
+
+def test_idle_thread_serves_and_stops_at_once(sim):
+	c, rig = sim
+	time.sleep(0.3)
+	t = time.monotonic()
+	c.do_command(CAT_FREQ_SET, 14100000)
+	assert c.query(CAT_FREQ_GET).result(5) == (True, CAT_FREQ_GET, 14100000)
+	assert time.monotonic() - t < 0.5
+	t = time.monotonic()
+	c.terminate()
+	assert time.monotonic() - t < 1.0
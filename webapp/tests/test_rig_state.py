@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# test_rig_state.py
+#
+# Rig state cache and redundant SET suppression
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import sys
+import time
+import queue
+import pytest
+
+# Application imports
+from defs import *
+import rig_state
+import rigsim
+import cat
+
+"""
+
+Run from the webapp directory:
+	python -m pytest -q tests
+
+The simulator cases run the CAT thread against rigsim on a pty.
+
+"""
+
+#==============================================================================================
+# The cache on its own
+#==============================================================================================
+
+@pytest.fixture
+def state():
+	return rig_state.RigState(10, 5.0)
+
+def test_repeated_set_is_redundant(state):
+	assert not state.redundant(CAT_FREQ_SET, 14100000)
+	state.requested(CAT_FREQ_SET, 14100000)
+	# Still pending, compared as sent
+	assert state.redundant(CAT_FREQ_SET, 14100000)
+	state.accepted(CAT_FREQ_SET, 14100000)
+	assert state.redundant(CAT_FREQ_SET, 14100005)
+	assert not state.redundant(CAT_FREQ_SET, 14100010)
+	assert state.suppressed() == 2
+
+def test_refused_set_is_sent_again(state):
+	state.requested(CAT_MODE_SET, MODE_USB)
+	state.refused(CAT_MODE_SET, MODE_USB)
+	assert not state.redundant(CAT_MODE_SET, MODE_USB)
+
+def test_late_ok_does_not_confirm_a_superseded_set(state):
+	state.requested(CAT_FREQ_SET, 7100000)
+	state.requested(CAT_FREQ_SET, 14100000)
+	state.accepted(CAT_FREQ_SET, 7100000)
+	assert state.cached(CAT_FREQ_GET) == None
+	state.refused(CAT_FREQ_SET, 7100000)
+	assert state.redundant(CAT_FREQ_SET, 14100000)
+
+def test_only_confirmed_values_answer_a_get(state):
+	state.requested(CAT_FREQ_SET, 14100000)
+	assert state.cached(CAT_FREQ_GET) == None
+	state.accepted(CAT_FREQ_SET, 14100000)
+	assert state.cached(CAT_FREQ_GET) == (True, CAT_FREQ_GET, 14100000)
+	state.confirm((True, CAT_MODE_GET, 'USB'))
+	assert state.cached(CAT_MODE_GET) == (True, CAT_MODE_GET, 'usb')
+	assert state.redundant(CAT_MODE_SET, MODE_USB)
+
+def test_ptt_always_sent(state):
+	state.requested(CAT_PTT_SET, True)
+	state.accepted(CAT_PTT_SET, True)
+	assert not state.redundant(CAT_PTT_SET, True)
+
+def test_values_go_stale():
+	state = rig_state.RigState(10, 0.05)
+	state.requested(CAT_FREQ_SET, 14100000)
+	time.sleep(0.1)
+	assert not state.redundant(CAT_FREQ_SET, 14100000)
+
+#==============================================================================================
+# Against the simulators
+#==============================================================================================
+
+@pytest.fixture(params = (FT817ND, IC7100))
+def rig(request):
+	if sys.platform.startswith('win'):
+		pytest.skip('rigsim needs a pty')
+	sim = rigsim.SIMULATORS[request.param](latency = 0.005)
+	sim.start()
+	c = cat.CAT(request.param, sim.port, 9600, queue.Queue(), name = 'test' + request.param)
+	assert c.run()
+	yield c, sim
+	c.terminate()
+	sim.terminate()
+
+def test_sim_repeated_sets_not_sent(rig):
+	c, sim = rig
+	sim.reset_stats()
+	for i in range(3):
+		c.do_command(CAT_FREQ_SET, 14100000)
+		time.sleep(0.05)
+	for i in range(3):
+		c.do_command(CAT_MODE_SET, MODE_USB)
+		time.sleep(0.05)
+	assert c.query(CAT_FREQ_GET).result(3) == (True, CAT_FREQ_GET, 14100000)
+	assert c.get_state().suppressed() == 4
+	# One of each set, the GET may be answered from the cache
+	assert sim.stats()['frames_in'] in (2, 3)
+
+def test_sim_changed_set_is_sent(rig):
+	c, sim = rig
+	c.do_command(CAT_FREQ_SET, 7100000)
+	time.sleep(0.05)
+	c.do_command(CAT_FREQ_SET, 7200000)
+	time.sleep(0.05)
+	c.do_command(CAT_FREQ_SET, 7100000)
+	assert c.query(CAT_FREQ_GET).result(3)[2] == 7100000
+	assert c.get_state().suppressed() == 0
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# test_scheduler.py
+#
+# CAT command scheduler lanes, coalescing and barriers
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import time
+import queue
+import threading
+import concurrent.futures
+import pytest
+
+# Application imports
+from defs import *
+import scheduler
+
+"""
+
+Run from the webapp directory:
+	python -m pytest -q tests
+
+"""
+
+@pytest.fixture
+def q():
+	return scheduler.CommandScheduler()
+
+def drain(q):
+	""" The waiting commands in the order served, as (cat_cmd, params) """
+
+	served = []
+	while True:
+		try:
+			cmd, params, future, queued = q.get(block = False)
+		except queue.Empty:
+			return served
+		served.append((cmd, params))
+
+#==============================================================================================
+# Coalescing
+#==============================================================================================
+
+def test_waiting_set_takes_the_latest_value(q):
+	assert not q.put(CAT_FREQ_SET, 7100000)
+	assert q.put(CAT_FREQ_SET, 7100010)
+	assert q.put(CAT_FREQ_SET, 7100020)
+	assert drain(q) == [(CAT_FREQ_SET, 7100020)]
+	assert q.coalesced() == 2
+
+def test_coalesced_set_keeps_its_place(q):
+	q.put(CAT_FREQ_SET, 7100000)
+	q.put(CAT_MODE_SET, MODE_USB)
+	q.put(CAT_FREQ_SET, 14100000)
+	assert drain(q) == [(CAT_FREQ_SET, 14100000), (CAT_MODE_SET, MODE_USB)]
+
+def test_served_set_is_not_updated(q):
+	q.put(CAT_FREQ_SET, 7100000)
+	assert drain(q) == [(CAT_FREQ_SET, 7100000)]
+	assert not q.put(CAT_FREQ_SET, 14100000)
+	assert drain(q) == [(CAT_FREQ_SET, 14100000)]
+
+def test_command_with_a_future_is_never_coalesced(q):
+	q.put(CAT_FREQ_SET, 7100000, concurrent.futures.Future())
+	assert not q.put(CAT_FREQ_SET, 14100000)
+	assert drain(q) == [(CAT_FREQ_SET, 7100000), (CAT_FREQ_SET, 14100000)]
+
+#==============================================================================================
+# Barriers
+#==============================================================================================
+
+def test_query_is_a_barrier(q):
+	q.put(CAT_FREQ_SET, 7100000)
+	q.put(CAT_FREQ_GET, None, concurrent.futures.Future())
+	assert not q.put(CAT_FREQ_SET, 14100000)
+	assert drain(q) == [(CAT_FREQ_SET, 7100000), (CAT_FREQ_GET, None), (CAT_FREQ_SET, 14100000)]
+
+def test_ptt_on_waits_for_sets_before_it(q):
+	q.put(CAT_FREQ_SET, 7100000)
+	q.put(CAT_MODE_SET, MODE_USB)
+	q.put(CAT_PTT_SET, True)
+	q.put(CAT_FREQ_SET, 14100000)
+	assert drain(q) == [(CAT_FREQ_SET, 7100000), (CAT_MODE_SET, MODE_USB), (CAT_PTT_SET, True), (CAT_FREQ_SET, 14100000)]
+
+#==============================================================================================
+# Priority lane
+#==============================================================================================
+
+def test_lock_and_ptt_off_go_first(q):
+	q.put(CAT_FREQ_SET, 7100000)
+	q.put(CAT_LOCK, True)
+	q.put(CAT_PTT_SET, False)
+	assert drain(q) == [(CAT_LOCK, True), (CAT_PTT_SET, False), (CAT_FREQ_SET, 7100000)]
+
+def test_ptt_off_drops_ptt_on_waiting(q):
+	future = concurrent.futures.Future()
+	q.put(CAT_FREQ_SET, 7100000)
+	q.put(CAT_PTT_SET, True, future)
+	q.put(CAT_PTT_SET, False)
+	assert drain(q) == [(CAT_PTT_SET, False), (CAT_FREQ_SET, 7100000)]
+	assert future.cancelled()
+	assert q.coalesced() == 1
+
+def test_get_if_leaves_the_priority_lane_first(q):
+	q.put(CAT_FREQ_GET, None, concurrent.futures.Future())
+	q.put(CAT_LOCK, True)
+	assert q.get_if(lambda cmd: True) == None
+	assert q.get(block = False)[0] == CAT_LOCK
+	assert q.get_if(lambda cmd: cmd == CAT_MODE_GET) == None
+	assert q.get_if(lambda cmd: cmd == CAT_FREQ_GET)[0] == CAT_FREQ_GET
+	assert q.qsize() == 0
+
+def test_flush(q):
+	q.put(CAT_FREQ_SET, 7100000)
+	q.put(CAT_LOCK, True)
+	assert [e[:2] for e in q.flush()] == [(CAT_LOCK, True), (CAT_FREQ_SET, 7100000)]
+	assert q.qsize() == 0
+	# Nothing is left to coalesce into
+	assert not q.put(CAT_FREQ_SET, 14100000)
+
+#==============================================================================================
+# A waiting consumer is woken, not polling
+#==============================================================================================
+
+def get_later(q, results):
+	t = time.monotonic()
+	try:
+		results.append((q.get(timeout = 5.0)[0], time.monotonic() - t))
+	except queue.Empty:
+		results.append((None, time.monotonic() - t))
+
+def test_put_wakes_a_waiting_get(q):
+	results = []
+	consumer = threading.Thread(target = get_later, args = (q, results))
+	consumer.start()
+	time.sleep(0.1)
+	q.put(CAT_FREQ_SET, 7100000)
+	consumer.join(5.0)
+	cmd, waited = results[0]
+	assert cmd == CAT_FREQ_SET
+	assert waited < 1.0
+
+def test_close_wakes_a_waiting_get(q):
+	results = []
+	consumer = threading.Thread(target = get_later, args = (q, results))
+	consumer.start()
+	time.sleep(0.1)
+	q.close()
+	consumer.join(5.0)
+	cmd, waited = results[0]
+	assert cmd == None
+	assert waited < 1.0
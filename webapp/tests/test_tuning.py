@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# test_tuning.py
+#
+# Tuning engine, integer Hz under one lock
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import threading
+import pytest
+
+# Application imports
+import tuning
+
+"""
+
+Run from the webapp directory:
+	python -m pytest -q tests
+
+No acceleration curves, so a dial step is one tuning step.
+
+"""
+
+def engine(freq = 7100000, step = 10, resolution = 10, sink = None):
+	return tuning.TuningEngine(freq, step, resolution, sink, curves = {})
+
+#==============================================================================================
+# Integer Hz
+#==============================================================================================
+
+def test_steps_do_not_drift():
+	e = engine(step = 1)
+	for i in range(10000):
+		e.apply(steps = 1)
+	for i in range(10000):
+		e.apply(steps = -1)
+	assert e.frequency() == 7100000
+
+def test_small_deltas_add_up_below_the_resolution():
+	sent = []
+	e = engine(resolution = 10, sink = sent.append)
+	for i in range(4):
+		e.apply(delta = 3)
+	# The exact 7100012 is kept, the rig gets it at 10Hz
+	assert sent == [7100000, 7100000, 7100000, 7100010]
+	e.apply(delta = -2)
+	assert e.frequency() == 7100010
+
+def test_never_below_zero():
+	e = engine(freq = 50, resolution = 1)
+	assert e.apply(steps = -10) == 0
+	assert e.set(-5) == 0
+
+def test_sync_is_not_sent():
+	sent = []
+	e = engine(sink = sent.append)
+	e.sync(14100003)
+	assert sent == []
+	assert e.frequency() == 14100000
+	assert e.apply(steps = 1) == 14100010
+
+#==============================================================================================
+# Dial and slider positions from the browser
+#==============================================================================================
+
+def test_rotate_follows_the_dial_direction():
+	e = engine()
+	assert e.rotate(5) == 7100010
+	assert e.rotate(3) == 7100000
+	assert e.rotate(3) == 7099990
+
+def test_slide_moves_by_positions():
+	e = engine()
+	assert e.slide(tuning.SLIDER_CENTRE + 10) == 7100100
+	assert e.slide(tuning.SLIDER_CENTRE - 5) == 7099950
+
+def test_step_change():
+	e = engine()
+	e.set_step(1000)
+	assert e.step() == 1000
+	assert e.apply(steps = 2) == 7102000
+
+#==============================================================================================
+# Several browsers at once
+#==============================================================================================
+
+def test_concurrent_ticks_all_count_and_reach_the_sink_in_order():
+	sent = []
+	e = engine(step = 10, sink = sent.append)
+	threads = [threading.Thread(target = lambda: [e.apply(steps = 1) for i in range(2000)]) for t in range(8)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert e.frequency() == 7100000 + 8 * 2000 * 10
+	assert len(sent) == 8 * 2000
+	assert sent == sorted(sent)
+	assert sent[-1] == e.frequency()
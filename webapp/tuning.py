@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# tuning.py
+#
+# Frequency and step of one rig, shared by every browser tuning it
+#
+# Copyright (C) 2020 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports
+import threading
+from bisect import bisect_right
+from collections import deque
+from time import monotonic
+
+# Application imports
+from defs import *
+
+"""
+
+Every web worker thread tuning a rig goes through its TuningEngine.
+
+The frequency is an integer in Hz so no amount of tuning drifts it, and
+every change is a read-modify-write under one lock so ticks from several
+browsers at once are all counted. The lock is held for a few integer
+operations and the sink call, never for I/O.
+
+Tuning keeps the exact frequency, what goes to the rig is rounded down to
+the rig resolution. Three 3Hz scroll ticks on a 10Hz rig then move it
+10Hz rather than not at all.
+
+The sink gets each new frequency with the lock held, so frequencies
+reach the CAT queue and the browsers in the order they were made and the
+last one sent is always the current one. It must not block.
+
+Dial steps are accelerated. The dial speed is measured over the last
+ACCEL_WINDOW seconds, counting every step in a batched request, and the
+step is multiplied by what the curve for the current tuning step gives
+at that speed (ACCEL_CURVES). Turning slowly moves one step a tick,
+spinning moves many, so crossing a band takes a few requests rather
+than hundreds. Reversing starts again from one step.
+
+"""
+
+# Slider rest position, it runs 0-100
+SLIDER_CENTRE = 50
+
+#======================================================================================
+# Tuning state of one rig
+class TuningEngine:
+
+	def __init__(self, freq, step, resolution, sink = None, curves = ACCEL_CURVES, window = ACCEL_WINDOW):
+		"""
+		Constructor
+
+		Arguments
+			freq		--	starting frequency in Hz
+			step		--	tuning step in Hz
+			resolution	--	rig tuning step in Hz
+			sink		--	callable(Hz) given every new frequency
+			curves		--	acceleration curve by tuning step, see defs
+			window		--	seconds the dial speed is measured over
+		"""
+
+		self.__lock = threading.Lock()
+		self.__freq = int(freq)
+		self.__curves = curves
+		self.__window = window
+		self.__set_step(step)
+		self.__resolution = max(1, int(resolution))
+		self.__sink = sink
+		# Last dial and slider positions seen
+		self.__rotation = 0
+		self.__slider = SLIDER_CENTRE
+		# Recent dial movement as (time, steps), all one direction
+		self.__moves = deque()
+		self.__moved = 0
+		self.__direction = 0
+
+	#======================================================================================
+	# PUBLIC interface
+	def frequency(self):
+		""" Current frequency in Hz at the rig resolution """
+
+		return self.__snap(self.__freq)
+
+	#-----------------------------------------------
+	def step(self):
+		""" Tuning step in Hz """
+
+		return self.__step
+
+	#-----------------------------------------------
+	def set_step(self, step):
+		"""
+		Set the tuning step
+
+		Arguments:
+			step	--	Hz per dial or slider step
+
+		"""
+
+		with self.__lock:
+			self.__set_step(step)
+
+	#-----------------------------------------------
+	def set(self, freq):
+		"""
+		Tune to a frequency, return it at the rig resolution
+
+		Arguments:
+			freq	--	frequency in Hz
+
+		"""
+
+		with self.__lock:
+			self.__freq = max(0, int(freq))
+			return self.__emit()
+
+	#-----------------------------------------------
+	def apply(self, steps = 0, delta = 0, dial = 0):
+		"""
+		Tune by a number of steps plus Hz, return the new frequency
+
+		Arguments:
+			steps	--	signed tuning steps
+			delta	--	signed Hz
+			dial	--	signed dial steps, accelerated
+
+		"""
+
+		with self.__lock:
+			if dial != 0:
+				steps += self.__accelerate(dial)
+			self.__freq = max(0, self.__freq + steps * self.__step + int(delta))
+			return self.__emit()
+
+	#-----------------------------------------------
+	def rotate(self, rotation):
+		"""
+		Tune one step, accelerated, in the direction the dial moved
+
+		Arguments:
+			rotation	--	dial position from the browser
+
+		"""
+
+		with self.__lock:
+			steps = self.__accelerate(1 if rotation > self.__rotation else -1)
+			self.__rotation = rotation
+			self.__freq = max(0, self.__freq + steps * self.__step)
+			return self.__emit()
+
+	#-----------------------------------------------
+	def slide(self, position):
+		"""
+		Tune one step per slider position moved
+
+		Arguments:
+			position	--	slider position from the browser, 0-100
+
+		"""
+
+		with self.__lock:
+			steps = position - self.__slider
+			self.__slider = position
+			self.__freq = max(0, self.__freq + steps * self.__step)
+			return self.__emit()
+
+	#-----------------------------------------------
+	def sync(self, freq):
+		"""
+		Take a frequency reported by the rig, nothing is sent
+
+		Arguments:
+			freq	--	frequency in Hz
+
+		"""
+
+		with self.__lock:
+			self.__freq = int(freq)
+
+	#-----------------------------------------------
+	def multiplier(self):
+		""" Step multiplier at the current dial speed """
+
+		with self.__lock:
+			return self.__multiplier(self.__moved / self.__window)
+
+	#======================================================================================
+	# PRIVATE interface
+	def __set_step(self, step):
+		""" Set the step and its acceleration curve """
+
+		self.__step = int(step)
+		curve = self.__curves.get(self.__step, ((0, 1), ))
+		self.__speeds = tuple(speed for speed, multiplier in curve)
+		self.__multipliers = tuple(multiplier for speed, multiplier in curve)
+
+	#-----------------------------------------------
+	def __accelerate(self, steps):
+		""" Record dial steps now, return them scaled for the dial speed """
+
+		now = monotonic()
+		direction = 1 if steps > 0 else -1
+		moves = self.__moves
+		if direction != self.__direction:
+			moves.clear()
+			self.__moved = 0
+			self.__direction = direction
+		moves.append((now, abs(steps)))
+		self.__moved += abs(steps)
+		while moves[0][0] < now - self.__window:
+			self.__moved -= moves.popleft()[1]
+		return steps * self.__multiplier(self.__moved / self.__window)
+
+	#-----------------------------------------------
+	def __multiplier(self, speed):
+		i = bisect_right(self.__speeds, speed) - 1
+		return self.__multipliers[i] if i >= 0 else 1
+
+	#-----------------------------------------------
+	def __snap(self, freq):
+		return freq - (freq % self.__resolution)
+
+	#-----------------------------------------------
+	def __emit(self):
+		""" Pass the new frequency on, called with the lock held """
+
+		freq = self.__snap(self.__freq)
+		if self.__sink != None:
+			self.__sink(freq)
+		return freq